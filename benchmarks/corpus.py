@@ -0,0 +1,174 @@
+"""
+Synthetic corpus of text PDFs with one known fact per document.
+
+Every document describes a fictional company and pads it with filler paragraphs, so
+the generated questions have a single relevant document. The PDFs are written without
+any third party library and contain plain text, which is what the parsers see in practice.
+"""
+
+import argparse
+import random
+import textwrap
+from dataclasses import dataclass
+from pathlib import Path
+
+SYLLABLES = [
+    "ka",
+    "lo",
+    "ri",
+    "ven",
+    "tor",
+    "mi",
+    "sa",
+    "dor",
+    "quin",
+    "el",
+    "pha",
+    "ru",
+]
+CITIES = ["Lisbon", "Oslo", "Krakow", "Austin", "Osaka", "Nairobi", "Lima", "Tallinn"]
+PRODUCTS = [
+    "solar inverters",
+    "industrial sensors",
+    "payment terminals",
+    "cargo drones",
+    "water filters",
+    "medical imaging software",
+    "electric scooters",
+    "warehouse robots",
+]
+FILLER_WORDS = (
+    "the quarterly report describes market conditions revenue growth operating costs "
+    "regional teams customer retention supply chain product roadmap hiring plans "
+    "strategic partnerships regulatory changes investment priorities risk factors"
+).split()
+
+LINES_PER_PAGE = 48
+LINE_WIDTH = 90
+
+
+@dataclass
+class Document:
+    path: Path
+    company: str
+    question: str
+    answer: str
+
+
+def _company_name(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(3)).capitalize() + " Systems"
+
+
+def _filler_paragraph(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(FILLER_WORDS) for _ in range(words))
+    return text.capitalize() + "."
+
+
+def _escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: Path, pages: list[list[str]]) -> None:
+    """Writes a minimal PDF with one Helvetica text block per page."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"",  # page tree, filled once the page objects are numbered
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        text = " T* ".join(f"({_escape(line)}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 14 TL 50 790 Td {text} ET".encode("latin-1", "replace")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    content = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(content))
+        content += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(content)
+    content += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    content += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    content += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        xref,
+    )
+    path.write_bytes(bytes(content))
+
+
+def generate_corpus(
+    directory: str | Path, n_docs: int, pages_per_doc: int = 2, seed: int = 0
+) -> list[Document]:
+    """
+    Writes ``n_docs`` PDFs to ``directory`` and returns them with a question about each.
+
+    Args:
+        directory: folder for the documents, created if missing.
+        n_docs: number of documents.
+        pages_per_doc: number of pages of each document.
+        seed: seed of the generator, the same seed gives the same corpus.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+
+    documents = []
+    for i in range(n_docs):
+        company = _company_name(rng)
+        year = rng.randint(1950, 2020)
+        city = rng.choice(CITIES)
+        product = rng.choice(PRODUCTS)
+        fact = (
+            f"{company} was founded in {year} in {city}. "
+            f"The main product of {company} is {product}."
+        )
+        paragraphs = [fact] + [
+            _filler_paragraph(rng, rng.randint(40, 120))
+            for _ in range(pages_per_doc * 4)
+        ]
+        lines = [
+            line
+            for paragraph in paragraphs
+            for line in textwrap.wrap(paragraph, LINE_WIDTH) + [""]
+        ]
+        pages = [
+            lines[start : start + LINES_PER_PAGE]
+            for start in range(0, len(lines), LINES_PER_PAGE)
+        ][:pages_per_doc]
+
+        path = directory / f"doc_{i:05d}.pdf"
+        write_pdf(path, pages)
+        documents.append(
+            Document(
+                path=path,
+                company=company,
+                question=f"In which year was {company} founded?",
+                answer=str(year),
+            )
+        )
+    return documents
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory")
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    documents = generate_corpus(args.directory, args.docs, args.pages, args.seed)
+    print(f"Written {len(documents)} documents to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
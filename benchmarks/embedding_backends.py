@@ -0,0 +1,126 @@
+"""
+Embedding throughput of the PyTorch and ONNX Runtime backends on the CPU.
+
+The documents of the ``document_indexing`` template are parsed and split as in its
+``app.yaml``, and embedded with ``SentenceTransformerEmbedder`` (PyTorch) and with
+``OnnxSentenceTransformerEmbedder`` in float32 and with int8 weights. The embeddings of
+each backend are compared with the ones of PyTorch.
+
+Example::
+
+    python benchmarks/embedding_backends.py --model mixedbread-ai/mxbai-embed-large-v1
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import cast
+
+import numpy as np
+from knn_quantization import TEMPLATE_DIR, load_chunks
+
+sys.path.insert(0, str(TEMPLATE_DIR))
+
+from onnx_embedder import OnnxSentenceTransformerEmbedder, Quantization  # noqa: E402
+
+
+def make_embedder(backend: str, model: str, num_threads: int, cache_dir: str):
+    if backend == "pytorch":
+        import torch
+        from pathway.xpacks.llm.embedders import SentenceTransformerEmbedder
+
+        torch.set_num_threads(num_threads)
+        return SentenceTransformerEmbedder(model, call_kwargs={"batch_size": 32})
+    quantization: Quantization | None = None
+    if backend != "onnx":
+        quantization = cast(Quantization, backend.removeprefix("onnx-int8-"))
+    return OnnxSentenceTransformerEmbedder(
+        model,
+        quantization=quantization,
+        num_threads=num_threads,
+        cache_dir=cache_dir,
+    )
+
+
+def run(
+    chunks: list[str],
+    backends: list[str],
+    model: str,
+    num_threads: int,
+    batch_size: int,
+    cache_dir: str,
+) -> list[dict]:
+    reports = []
+    reference = None
+    for backend in backends:
+        embedder = make_embedder(backend, model, num_threads, cache_dir)
+        # the first call loads the model into memory and is not measured
+        embedder.__wrapped__(chunks[:batch_size])
+        start = time.perf_counter()
+        embeddings = []
+        for i in range(0, len(chunks), batch_size):
+            embeddings.extend(embedder.__wrapped__(chunks[i : i + batch_size]))
+        seconds = time.perf_counter() - start
+
+        vectors = np.array(embeddings, dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        if reference is None:
+            reference = vectors
+        reports.append(
+            {
+                "backend": backend,
+                "chunks_per_second": round(len(chunks) / seconds, 2),
+                "seconds": round(seconds, 3),
+                "mean_cosine_to_first": round(
+                    float(np.mean(np.sum(vectors * reference, axis=1))), 5
+                ),
+            }
+        )
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default="mixedbread-ai/mxbai-embed-large-v1")
+    parser.add_argument(
+        "--backends",
+        default="pytorch,onnx,onnx-int8-avx2",
+        help="comma-separated list of `pytorch`, `onnx` and `onnx-int8-<instruction set>`,"
+        " the first one is the reference of the embeddings",
+    )
+    parser.add_argument(
+        "--docs", type=Path, default=TEMPLATE_DIR / "files-for-indexing"
+    )
+    parser.add_argument("--max-tokens", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=128,
+        help="number of chunks per call of the embedder, as sent by the pipeline",
+    )
+    parser.add_argument("--cache-dir", default="onnx-models")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.docs, args.max_tokens)
+    print(f"{len(chunks)} chunks, {args.threads} threads", file=sys.stderr)
+    reports = run(
+        chunks,
+        args.backends.split(","),
+        args.model,
+        args.threads,
+        args.batch_size,
+        args.cache_dir,
+    )
+    for report in reports:
+        print("  ".join(f"{key}={value}" for key, value in report.items()))
+    if args.output:
+        args.output.write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
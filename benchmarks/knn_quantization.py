@@ -0,0 +1,252 @@
+"""
+Recall and latency of the quantized usearch index of the ``document_indexing`` template.
+
+The documents of the template are parsed and split as in its ``app.yaml``, embedded with
+the given model, and indexed by the engine's usearch index, as by ``UsearchKnnFactory``,
+and by ``QuantizedUsearchIndex`` with each precision. Sentences picked from the chunks are
+used as queries, and the results are compared with an exact float32 search.
+
+Example::
+
+    python benchmarks/knn_quantization.py --model mixedbread-ai/mxbai-embed-large-v1
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from run_benchmark import percentile
+
+TEMPLATE_DIR = (
+    Path(__file__).resolve().parent.parent / "templates" / "document_indexing"
+)
+sys.path.insert(0, str(TEMPLATE_DIR))
+
+from quantized_index import QuantizedUsearchIndex, ScalarKind  # noqa: E402
+
+# precision and rescoring of the compared settings of `QuantizedUsearchIndex`
+SETTINGS: list[tuple[ScalarKind, bool]] = [
+    ("f32", False),
+    ("f16", False),
+    ("f16", True),
+    ("i8", False),
+    ("i8", True),
+]
+
+# logical times at which the engine gets the vectors and then the queries
+DATA_TIME = 2
+QUERIES_TIME = 4
+
+
+def load_chunks(path: Path, max_tokens: int) -> list[str]:
+    from pathway.xpacks.llm.parsers import PypdfParser
+    from pathway.xpacks.llm.splitters import TokenCountSplitter
+
+    parser = PypdfParser()
+    splitter = TokenCountSplitter(max_tokens=max_tokens)
+    chunks: list[str] = []
+    for file in sorted(path.iterdir()):
+        if file.suffix.lower() != ".pdf":
+            continue
+        for text, _ in parser.__wrapped__(file.read_bytes()):
+            chunks.extend(chunk for chunk, _ in splitter.__wrapped__(text))
+    return chunks
+
+
+def embed(texts: list[str], model: str) -> np.ndarray:
+    if model == "stub":
+        # offline, with the hashed bag-of-words vectors of the OpenAI stub
+        from openai_stub import embed as stub_embed
+
+        return np.array([stub_embed(text, 1024) for text in texts], dtype=np.float32)
+
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(model).encode(texts, batch_size=64).astype(np.float32)
+
+
+def sample_queries(chunks: list[str], count: int, rng: random.Random) -> list[str]:
+    sentences = [
+        sentence.strip()
+        for chunk in chunks
+        for sentence in re.split(r"(?<=[.!?])\s+", chunk)
+        if len(sentence.split()) >= 6
+    ]
+    return rng.sample(sentences, min(count, len(sentences)))
+
+
+def scale_vectors(vectors: np.ndarray, size: int, rng: np.random.Generator):
+    """Adds noisy copies of the vectors, to measure the latency of a larger index."""
+    if size <= len(vectors):
+        return vectors
+    copies = vectors[rng.integers(len(vectors), size=size - len(vectors))]
+    noise = rng.normal(scale=0.5 / np.sqrt(vectors.shape[1]), size=copies.shape)
+    return np.concatenate([vectors, copies + noise.astype(np.float32)])
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int) -> list[list[int]]:
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    results = []
+    for query in queries:
+        scores = normalized @ (query / np.linalg.norm(query))
+        results.append(np.argsort(-scores)[:k].tolist())
+    return results
+
+
+def run_engine(vectors: np.ndarray, queries: np.ndarray, k: int):
+    """
+    Queries the engine's usearch index, as built by ``UsearchKnnFactory``.
+
+    The queries are answered by the engine in one batch, after all the vectors are
+    indexed, so only their mean latency is measured.
+    """
+    import pandas as pd
+    import pathway as pw
+    from pathway.stdlib.indexing.nearest_neighbors import UsearchKnnFactory
+
+    data = pw.debug.table_from_pandas(
+        pd.DataFrame(
+            {"vector": list(vectors), "n": range(len(vectors)), "__time__": DATA_TIME}
+        )
+    )
+    query_table = pw.debug.table_from_pandas(
+        pd.DataFrame(
+            {
+                "vector": list(queries),
+                "q": range(len(queries)),
+                "__time__": QUERIES_TIME,
+            }
+        )
+    )
+    index = UsearchKnnFactory(
+        dimensions=vectors.shape[1], reserved_space=len(vectors)
+    ).build_index(data.vector, data)
+    replies = index.query_as_of_now(query_table.vector, number_of_matches=k).select(
+        q=pw.left.q, n=pw.right.n
+    )
+    ends: dict[int, float] = {}
+    matches: dict[int, list[int]] = {}
+
+    def on_change(key, row, time, is_addition):
+        matches[row["q"]] = list(row["n"])
+
+    def on_data_change(key, row, time, is_addition):
+        pass
+
+    def on_time_end(time):
+        ends[time] = _now()
+
+    pw.io.subscribe(replies, on_change=on_change, on_time_end=on_time_end)
+    # the end of the time of the vectors, when the replies have no change
+    pw.io.subscribe(data.select(), on_change=on_data_change, on_time_end=on_time_end)
+    pw.run(monitoring_level=pw.MonitoringLevel.NONE)
+    mean_latency = (ends[QUERIES_TIME] - ends[DATA_TIME]) / len(queries)
+    return [matches[q] for q in range(len(queries))], mean_latency
+
+
+def _now() -> float:
+    return time.perf_counter()
+
+
+def recall(found: list[list[int]], exact: list[list[int]]) -> float:
+    return float(
+        np.mean([len(set(ids) & set(ref)) / len(ref) for ids, ref in zip(found, exact)])
+    )
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, k: int, oversampling: float):
+    exact = exact_search(vectors, queries, k)
+    engine_matches, engine_latency = run_engine(vectors, queries, k)
+    # the engine adds the vectors in the order of the hashes of their keys, and the
+    # HNSW graph of the noisy copies added after their chunks is much worse
+    order = np.random.default_rng(0).permutation(len(vectors))
+    reports: list[dict] = [
+        {
+            "setting": "UsearchKnnFactory (engine, f32)",
+            "bytes_per_vector": None,
+            f"recall@{k}": round(recall(engine_matches, exact), 4),
+            "mean_ms": round(engine_latency * 1000, 3),
+        }
+    ]
+    for dtype, rescore in SETTINGS:
+        index = QuantizedUsearchIndex(
+            vectors.shape[1],
+            dtype=dtype,
+            rescore=rescore,
+            oversampling=oversampling,
+            reserved_space=len(vectors),
+        )
+        # without the memory allocated up front by an empty index
+        empty_bytes = index.nbytes
+        for key in order:
+            index.add(int(key), vectors[key])
+        latencies = []
+        matches = []
+        for query in queries:
+            start = time.perf_counter()
+            matches.append([key for key, _ in index.search(query, k)])
+            latencies.append(time.perf_counter() - start)
+        reports.append(
+            {
+                "setting": dtype + (" + rescoring" if rescore else ""),
+                "bytes_per_vector": (index.nbytes - empty_bytes) // len(vectors),
+                f"recall@{k}": round(recall(matches, exact), 4),
+                "mean_ms": round(float(np.mean(latencies)) * 1000, 3),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            }
+        )
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--model",
+        default="mixedbread-ai/mxbai-embed-large-v1",
+        help="SentenceTransformer model, or `stub` for the offline hashed embeddings",
+    )
+    parser.add_argument(
+        "--docs", type=Path, default=TEMPLATE_DIR / "files-for-indexing"
+    )
+    parser.add_argument("--max-tokens", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--oversampling", type=float, default=4.0)
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=0,
+        help="number of vectors to index, filled up with noisy copies of the chunks",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chunks = load_chunks(args.docs, args.max_tokens)
+    queries = sample_queries(chunks, args.queries, rng)
+    embeddings = embed(chunks + queries, args.model)
+    vectors = scale_vectors(
+        embeddings[: len(chunks)], args.scale, np.random.default_rng(args.seed)
+    )
+    print(
+        f"{len(chunks)} chunks, {len(vectors)} vectors of {vectors.shape[1]} dimensions, "
+        f"{len(queries)} queries",
+        file=sys.stderr,
+    )
+
+    reports = run(vectors, embeddings[len(chunks) :], args.k, args.oversampling)
+    for report in reports:
+        print("  ".join(f"{key}={value}" for key, value in report.items()))
+    if args.output:
+        args.output.write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
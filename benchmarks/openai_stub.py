@@ -0,0 +1,203 @@
+"""
+Local stand-in for the OpenAI chat completions and embeddings endpoints.
+
+Embeddings are deterministic hashed bag-of-words vectors, so documents sharing words
+with a query are retrieved for it, and chat completions echo the question. Both endpoints
+sleep for a configurable time to emulate the latency of the real API. Streamed chat
+completions (``"stream": true``) spread this time between the words of the answer.
+
+Run it standalone with ``python openai_stub.py --port 8990`` and point the apps to it
+with ``OPENAI_BASE_URL=http://127.0.0.1:8990/v1``.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import uuid
+from array import array
+
+from aiohttp import web
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def embed(text: str, dimensions: int) -> list[float]:
+    vector = [0.0] * dimensions
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] % 2 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector))
+    if norm == 0:
+        vector[0] = norm = 1.0
+    return [x / norm for x in vector]
+
+
+class OpenAIStub:
+    """
+    ``aiohttp`` application emulating ``/v1/chat/completions`` and ``/v1/embeddings``.
+
+    Args:
+        chat_latency: mean time in seconds taken by a chat completion.
+        embedding_latency: mean time in seconds taken by an embedding request, regardless of
+            the number of inputs in the request.
+        jitter: relative spread of the latencies, e.g. 0.2 means +/- 20%.
+        dimensions: dimension of the returned embeddings.
+    """
+
+    def __init__(
+        self,
+        chat_latency: float = 0.5,
+        embedding_latency: float = 0.05,
+        jitter: float = 0.2,
+        dimensions: int = 1536,
+    ):
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.jitter = jitter
+        self.dimensions = dimensions
+        self.chat_requests = 0
+        self.embedding_requests = 0
+        self.embedded_inputs = 0
+
+    async def _sleep(self, latency: float) -> None:
+        await asyncio.sleep(latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.chat_requests += 1
+
+        prompt = " ".join(
+            str(message.get("content", "")) for message in payload.get("messages", [])
+        )
+        answer = f"Stub answer based on {len(prompt)} characters of context."
+        if payload.get("stream"):
+            return await self._stream_chat_completion(request, payload, answer)
+
+        await self._sleep(self.chat_latency)
+        prompt_tokens = len(TOKEN_PATTERN.findall(prompt))
+        completion_tokens = len(TOKEN_PATTERN.findall(answer))
+        return web.json_response(
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": answer},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    async def _stream_chat_completion(
+        self, request: web.Request, payload: dict, answer: str
+    ) -> web.StreamResponse:
+        """Sends the answer word by word, spreading the latency between the words."""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        words = re.findall(r"\S+\s*", answer)
+        for word in words:
+            await self._sleep(self.chat_latency / len(words))
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [
+                    {"index": 0, "delta": {"content": word}, "finish_reason": None}
+                ],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        inputs = payload["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.embedding_requests += 1
+        self.embedded_inputs += len(inputs)
+        await self._sleep(self.embedding_latency)
+
+        dimensions = payload.get("dimensions") or self.dimensions
+        base64_encoded = payload.get("encoding_format") == "base64"
+        data = []
+        for index, text in enumerate(inputs):
+            vector: list[float] | str = embed(str(text), dimensions)
+            if base64_encoded:
+                vector = base64.b64encode(array("f", vector).tobytes()).decode()
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(len(TOKEN_PATTERN.findall(str(text))) for text in inputs)
+        return web.json_response(
+            {
+                "object": "list",
+                "data": data,
+                "model": payload.get("model", "stub"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+        )
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "chat_requests": self.chat_requests,
+                "embedding_requests": self.embedding_requests,
+                "embedded_inputs": self.embedded_inputs,
+            }
+        )
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024**2)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def start_stub(stub: OpenAIStub, host: str, port: int) -> web.AppRunner:
+    """Starts the stub in the running event loop, call ``cleanup()`` on the result to stop it."""
+    runner = web.AppRunner(stub.build_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8990)
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    args = parser.parse_args()
+
+    stub = OpenAIStub(
+        chat_latency=args.chat_latency,
+        embedding_latency=args.embedding_latency,
+        jitter=args.jitter,
+        dimensions=args.dimensions,
+    )
+    web.run_app(stub.build_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""
+End-to-end benchmark of a template running from its ``app.yaml``.
+
+The template is copied to a scratch directory, its first ``$sources`` path is pointed to
+a synthetic corpus and it is started against a local OpenAI stub. The benchmark reports
+the startup time, time-to-index and ingest throughput, and query latency percentiles
+for each concurrency level.
+
+Example::
+
+    python benchmarks/run_benchmark.py question_answering_rag --docs 200 --concurrency 1 8 32
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import aiohttp
+from corpus import Document, generate_corpus
+from openai_stub import OpenAIStub, start_stub
+
+TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
+SKIPPED_FILES = shutil.ignore_patterns(
+    "data", "files-for-indexing", "Cache", ".Cache", "ui", "*.gif", "*.png"
+)
+
+# Payloads of the queries, the `question` placeholder is replaced with the question of a document.
+QUERY_ENDPOINTS: dict[str, tuple[str, dict]] = {
+    "answer": ("/v2/answer", {"prompt": "question"}),
+    "retrieve": ("/v1/retrieve", {"query": "question", "k": 3}),
+}
+DEFAULT_QUERY_ENDPOINTS = {
+    "question_answering_rag": "answer",
+    "adaptive_rag": "answer",
+    "multimodal_rag": "answer",
+    "private_rag": "answer",
+    "document_indexing": "retrieve",
+}
+
+
+@dataclass
+class LatencyReport:
+    concurrency: int
+    requests: int
+    errors: int
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+
+
+@dataclass
+class BenchmarkReport:
+    template: str
+    docs: int
+    startup_seconds: float
+    time_to_index_seconds: float
+    ingest_docs_per_second: float
+    queries: list[LatencyReport] = field(default_factory=list)
+    stub: dict = field(default_factory=dict)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, ``q`` in the range [0, 100]."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def prepare_template(
+    template: str, config: Path | None, corpus_dir: Path, workdir: Path, port: int
+) -> Path:
+    """Copies the template to ``workdir`` with the sources, port and cache overridden."""
+    app_dir = workdir / template
+    shutil.copytree(TEMPLATES_DIR / template, app_dir, ignore=SKIPPED_FILES)
+
+    config_text = (config or TEMPLATES_DIR / template / "app.yaml").read_text()
+
+    def override_path(match: re.Match[str]) -> str:
+        return f'{match.group(1)}"{corpus_dir}"\n'
+
+    config_text, replaced = re.subn(
+        r"(\$sources:.*?\n\s+path: ).*?\n",
+        override_path,
+        config_text,
+        count=1,
+        flags=re.DOTALL,
+    )
+    if not replaced:
+        raise ValueError("the config has no `$sources` with a `path` to override")
+    # later keys override the ones set earlier in the file
+    config_text += f'\nhost: "127.0.0.1"\nport: {port}\npersistence_mode: null\n'
+    (app_dir / "app.yaml").write_text(config_text)
+    return app_dir
+
+
+async def _post(
+    session: aiohttp.ClientSession, url: str, payload: dict, timeout: float = 600
+):
+    async with session.post(
+        url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def wait_until_serving(
+    session: aiohttp.ClientSession, url: str, process: subprocess.Popen, timeout: float
+) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the app exited with code {process.returncode}")
+        try:
+            await _post(session, f"{url}/v1/statistics", {}, timeout=5)
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            await asyncio.sleep(0.2)
+    raise TimeoutError("the app did not start serving in time")
+
+
+async def wait_until_indexed(
+    session: aiohttp.ClientSession,
+    url: str,
+    documents: list[Document],
+    process: subprocess.Popen,
+    timeout: float,
+) -> None:
+    """Waits until all documents are parsed and the last one can be retrieved."""
+    deadline = time.monotonic() + timeout
+    last = documents[-1].path.name
+    # only the chunks of the last document match, so they are returned once indexed
+    probe = {
+        "query": documents[-1].question,
+        "k": 1,
+        "filepath_globpattern": f"**/{last}",
+    }
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the app exited with code {process.returncode}")
+        try:
+            stats = await _post(session, f"{url}/v1/statistics", {}, timeout=30)
+            if stats.get("file_count", 0) >= len(documents):
+                chunks = await _post(session, f"{url}/v1/retrieve", probe, timeout=30)
+                if any(
+                    Path(chunk["metadata"].get("path", "")).name == last
+                    for chunk in chunks
+                ):
+                    return
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError("the corpus was not indexed in time")
+
+
+async def measure_queries(
+    session: aiohttp.ClientSession,
+    url: str,
+    endpoint: str,
+    documents: list[Document],
+    concurrency: int,
+    n_requests: int,
+) -> LatencyReport:
+    route, template_payload = QUERY_ENDPOINTS[endpoint]
+    latencies: list[float] = []
+    errors = 0
+    pending = iter(range(n_requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in pending:
+            question = documents[i % len(documents)].question
+            payload = {
+                key: question if value == "question" else value
+                for key, value in template_payload.items()
+            }
+            start = time.perf_counter()
+            try:
+                await _post(session, f"{url}{route}", payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return LatencyReport(
+        concurrency=concurrency,
+        requests=n_requests,
+        errors=errors,
+        throughput=len(latencies) / elapsed,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+    )
+
+
+async def run_benchmark(args: argparse.Namespace) -> BenchmarkReport:
+    stub = OpenAIStub(
+        chat_latency=args.chat_latency,
+        embedding_latency=args.embedding_latency,
+        dimensions=args.dimensions,
+    )
+    stub_runner = await start_stub(stub, "127.0.0.1", args.stub_port)
+
+    with tempfile.TemporaryDirectory(prefix="llm-app-bench-") as tmp:
+        workdir = Path(tmp)
+        documents = generate_corpus(
+            workdir / "corpus", args.docs, args.pages, args.seed
+        )
+        app_dir = prepare_template(
+            args.template, args.config, workdir / "corpus", workdir, args.port
+        )
+        env = {
+            **os.environ,
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{args.stub_port}/v1",
+            "OPENAI_API_KEY": "sk-benchmark",
+        }
+        log = open(workdir / "app.log", "w")
+        started = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, "app.py"],
+            cwd=app_dir,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        url = f"http://127.0.0.1:{args.port}"
+        try:
+            async with aiohttp.ClientSession() as session:
+                await wait_until_serving(session, url, process, args.timeout)
+                serving = time.monotonic()
+                await wait_until_indexed(session, url, documents, process, args.timeout)
+                indexed = time.monotonic()
+
+                report = BenchmarkReport(
+                    template=args.template,
+                    docs=len(documents),
+                    startup_seconds=serving - started,
+                    time_to_index_seconds=indexed - started,
+                    ingest_docs_per_second=len(documents)
+                    / max(indexed - serving, 1e-9),
+                )
+                endpoint = args.endpoint or DEFAULT_QUERY_ENDPOINTS[args.template]
+                for concurrency in args.concurrency:
+                    report.queries.append(
+                        await measure_queries(
+                            session,
+                            url,
+                            endpoint,
+                            documents,
+                            concurrency,
+                            args.requests,
+                        )
+                    )
+        except Exception:
+            log.flush()
+            print((workdir / "app.log").read_text()[-5000:], file=sys.stderr)
+            raise
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+            await stub_runner.cleanup()
+
+    report.stub = {
+        "chat_requests": stub.chat_requests,
+        "embedding_requests": stub.embedding_requests,
+        "embedded_inputs": stub.embedded_inputs,
+    }
+    return report
+
+
+def print_report(report: BenchmarkReport) -> None:
+    print(f"template:            {report.template}")
+    print(f"documents:           {report.docs}")
+    print(f"startup:             {report.startup_seconds:.2f} s")
+    print(f"time-to-index:       {report.time_to_index_seconds:.2f} s")
+    print(f"ingest throughput:   {report.ingest_docs_per_second:.2f} docs/s")
+    print(
+        f"stub calls:          {report.stub['chat_requests']} chat, "
+        f"{report.stub['embedding_requests']} embedding "
+        f"({report.stub['embedded_inputs']} inputs)"
+    )
+    print()
+    print("concurrency  requests  errors  req/s    p50 [s]  p95 [s]  p99 [s]")
+    for q in report.queries:
+        print(
+            f"{q.concurrency:>11}  {q.requests:>8}  {q.errors:>6}  {q.throughput:>6.2f}"
+            f"  {q.p50:>7.3f}  {q.p95:>7.3f}  {q.p99:>7.3f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("template", choices=sorted(DEFAULT_QUERY_ENDPOINTS))
+    parser.add_argument(
+        "--config",
+        type=Path,
+        help="variant of the template `app.yaml` to benchmark, e.g. with a different splitter",
+    )
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--requests", type=int, default=64, help="queries per concurrency level"
+    )
+    parser.add_argument("--endpoint", choices=sorted(QUERY_ENDPOINTS))
+    parser.add_argument("--chat-latency", type=float, default=0.5)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stub-port", type=int, default=8990)
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.output is not None:
+        args.output.write_text(json.dumps(asdict(report), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Startup profile of the ``document_indexing`` template.
+
+The template is copied to a scratch directory with a synthetic corpus, as in
+``run_benchmark.py``, and started with ``python -X importtime``. The profile reports
+the time until ``/health`` answers (the pod is live) and until ``/ready`` answers 200
+(the corpus is indexed), the time taken to build the app from ``app.yaml``, and the
+imports of ``app.py`` taking the longest, with the time of their own imports included.
+A module imported by several others is counted in the first of them.
+
+Example::
+
+    python benchmarks/startup_profile.py --docs 20 --top 15
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import aiohttp
+from corpus import generate_corpus
+from run_benchmark import prepare_template
+
+TEMPLATE = "document_indexing"
+# `import time: self [us] | cumulative | imported package`, indented by nesting
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+BUILD_TIME = re.compile(r"Built the app from app.yaml in ([\d.]+) s")
+
+
+@dataclass
+class StartupProfile:
+    docs: int
+    live_seconds: float = 0.0
+    ready_seconds: float = 0.0
+    build_seconds: float | None = None
+    import_seconds: float = 0.0
+    slowest_imports: list[dict] = field(default_factory=list)
+
+
+def parse_import_times(log: str) -> list[tuple[str, int, float, float]]:
+    """Returns the module, nesting level, own and cumulative seconds of every import."""
+    imports = []
+    for match in IMPORT_TIME.finditer(log):
+        own, cumulative, indent, module = match.groups()
+        imports.append(
+            (module, len(indent) // 2, int(own) / 1e6, int(cumulative) / 1e6)
+        )
+    return imports
+
+
+async def wait_for(
+    session: aiohttp.ClientSession,
+    url: str,
+    process: subprocess.Popen,
+    timeout: float,
+) -> float:
+    """Polls ``url`` until it answers 200 and returns the time at which it did."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the app exited with code {process.returncode}")
+        try:
+            async with session.get(
+                url, timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                if response.status == 200:
+                    return time.monotonic()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f"{url} did not answer in time")
+
+
+async def profile_startup(args: argparse.Namespace) -> StartupProfile:
+    with tempfile.TemporaryDirectory(prefix="llm-app-startup-") as tmp:
+        workdir = Path(tmp)
+        documents = generate_corpus(
+            workdir / "corpus", args.docs, args.pages, args.seed
+        )
+        app_dir = prepare_template(
+            TEMPLATE, args.config, workdir / "corpus", workdir, args.port
+        )
+        log_path = workdir / "app.log"
+        log = open(log_path, "w")
+        started = time.monotonic()
+        process = subprocess.Popen(
+            [sys.executable, "-X", "importtime", "app.py"],
+            cwd=app_dir,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        url = f"http://127.0.0.1:{args.port}"
+        try:
+            async with aiohttp.ClientSession() as session:
+                live = await wait_for(session, f"{url}/health", process, args.timeout)
+                ready = await wait_for(session, f"{url}/ready", process, args.timeout)
+        except Exception:
+            log.flush()
+            print(log_path.read_text()[-5000:], file=sys.stderr)
+            raise
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        output = log_path.read_text()
+
+    imports = parse_import_times(output)
+    build = BUILD_TIME.search(output)
+    report = StartupProfile(
+        docs=len(documents),
+        live_seconds=live - started,
+        ready_seconds=ready - started,
+        build_seconds=float(build.group(1)) if build else None,
+        # top-level imports include the time of the imports nested in them
+        import_seconds=sum(
+            cumulative for _, level, _, cumulative in imports if level == 0
+        ),
+    )
+    slowest = sorted(
+        (entry for entry in imports if entry[1] <= args.depth),
+        key=lambda entry: entry[3],
+        reverse=True,
+    )
+    report.slowest_imports = [
+        {
+            "module": module,
+            "level": level,
+            "self_seconds": round(own, 4),
+            "cumulative_seconds": round(cumulative, 4),
+        }
+        for module, level, own, cumulative in slowest[: args.top]
+    ]
+    return report
+
+
+def print_profile(report: StartupProfile) -> None:
+    print(f"documents:           {report.docs}")
+    print(f"live (/health):      {report.live_seconds:.2f} s")
+    print(f"ready (/ready):      {report.ready_seconds:.2f} s")
+    if report.build_seconds is not None:
+        print(f"building from yaml:  {report.build_seconds:.2f} s")
+    print(f"imports:             {report.import_seconds:.2f} s")
+    print()
+    print("cumulative [s]  self [s]  module")
+    for entry in report.slowest_imports:
+        print(
+            f"{entry['cumulative_seconds']:>14.3f}  {entry['self_seconds']:>8.3f}  "
+            f"{'  ' * entry['level']}{entry['module']}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        help="variant of the template `app.yaml` to profile, e.g. with eager loading",
+    )
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=15, help="number of imports shown")
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=1,
+        help="deepest nesting level of the imports shown, 0 for the imports of app.py",
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--output", type=Path, help="write the profile as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(profile_startup(args))
+    print_profile(report)
+    if args.output is not None:
+        args.output.write_text(json.dumps(asdict(report), indent=2))
+
+
+if __name__ == "__main__":
+    main()
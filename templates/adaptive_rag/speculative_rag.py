@@ -0,0 +1,164 @@
+"""
+Adaptive RAG with speculative iterations.
+
+``AdaptiveRAGQuestionAnswerer`` asks the LLM with ``n_starting_documents`` documents, and
+only once it answers that no information was found, asks it again with ``factor`` times
+more documents. A question needing the largest context waits for ``max_iterations``
+LLM calls in a row. ``SpeculativeAdaptiveRAGQuestionAnswerer`` starts the next, larger
+iterations while the earlier ones are still running, and cancels the larger ones as soon
+as an earlier one answers. The answer is the one of the smallest context which has one,
+as in the sequential strategy, at the cost of LLM calls which are started in vain.
+"""
+
+import asyncio
+import inspect
+
+import metrics
+import pathway as pw
+from pathway.xpacks.llm.document_store import DocumentStore, _get_jmespath_filter
+from pathway.xpacks.llm.llms import BaseChat
+from pathway.xpacks.llm.question_answering import (
+    AdaptiveRAGQuestionAnswerer,
+    _get_RAG_prompt_udf,
+)
+from pathway.xpacks.llm.vector_store import VectorStoreServer
+
+
+class SpeculativeAdaptiveRAGQuestionAnswerer(AdaptiveRAGQuestionAnswerer):
+    """
+    ``AdaptiveRAGQuestionAnswerer`` which runs up to ``max_speculative_calls`` larger
+    iterations ahead of the one it waits for.
+
+    Iterations are started in the order of their number of documents. Whenever an
+    iteration answers, the larger ones are cancelled, otherwise the next one is started.
+    Iterations which would get the same documents as the previous one, because fewer
+    documents were retrieved, are skipped. Cancelled calls are counted in the
+    ``llm_cancelled`` rows of the metrics.
+
+    Args:
+        max_speculative_calls: number of LLM calls per question which may be in flight
+            besides the one of the smallest pending iteration. ``0`` runs the iterations
+            one by one, as ``AdaptiveRAGQuestionAnswerer`` does.
+        kwargs: arguments of ``AdaptiveRAGQuestionAnswerer``.
+    """
+
+    def __init__(
+        self,
+        llm: BaseChat,
+        indexer: VectorStoreServer | DocumentStore,
+        *,
+        max_speculative_calls: int = 1,
+        **kwargs,
+    ) -> None:
+        super().__init__(llm, indexer, **kwargs)
+        if max_speculative_calls < 0:
+            raise ValueError("`max_speculative_calls` must not be negative")
+        self.max_speculative_calls = max_speculative_calls
+
+    def _document_counts(self, retrieved: int) -> list[int]:
+        counts: list[int] = []
+        for iteration in range(self.max_iterations):
+            count = min(self.n_starting_documents * self.factor**iteration, retrieved)
+            if not counts or count != counts[-1]:
+                counts.append(count)
+        return counts
+
+    async def _ask(
+        self, query: str, docs: list[dict], prompt_udf: pw.UDF
+    ) -> str | None:
+        context = self.docs_to_context_transformer.__wrapped__(docs)
+        prompt = prompt_udf.__wrapped__(context, query)
+        answer = await self._chat(prompt, len(docs))
+        return None if answer == self.no_answer_string else answer
+
+    async def _chat(self, prompt: str, documents: int) -> str | None:
+        """Asks the LLM with ``prompt``, holding ``documents`` documents."""
+        messages = [{"role": "user", "content": prompt}]
+        # through `func`, to keep the retries, the cache and the capacity of the LLM
+        if inspect.iscoroutinefunction(self.llm.func):
+            return await self.llm.func(messages)
+        return await asyncio.to_thread(self.llm.func, messages)
+
+    async def _answer_speculatively(
+        self, query: str, documents: list[str], prompt_udf: pw.UDF
+    ) -> tuple[str | None, list[dict]]:
+        docs = [{"text": doc} for doc in documents]
+        answer, count = await self._run_iterations(
+            query, docs, self._document_counts(len(docs)), prompt_udf
+        )
+        return answer, docs[:count]
+
+    async def _run_iterations(
+        self, query: str, docs: list[dict], counts: list[int], prompt_udf: pw.UDF
+    ) -> tuple[str | None, int]:
+        """
+        Asks the LLM with the first ``counts`` documents until it answers. Returns the
+        answer and the number of documents it was given, or ``None`` and all documents.
+        """
+        tasks: list[asyncio.Task] = []
+        try:
+            for iteration, count in enumerate(counts):
+                while (
+                    len(tasks) < len(counts)
+                    and len(tasks) <= iteration + self.max_speculative_calls
+                ):
+                    tasks.append(
+                        asyncio.create_task(
+                            self._ask(query, docs[: counts[len(tasks)]], prompt_udf)
+                        )
+                    )
+                answer = await tasks[iteration]
+                if answer is not None:
+                    return answer, count
+            return None, len(docs)
+        finally:
+            cancelled = 0
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    cancelled += 1
+                elif not task.cancelled():
+                    # retrieved, so that the errors of unused iterations are not logged
+                    task.exception()
+            if cancelled:
+                metrics.REGISTRY.count_rows("llm_cancelled", cancelled)
+
+    @pw.table_transformer
+    def answer_query(self, pw_ai_queries: pw.Table) -> pw.Table:
+        """Create RAG response with speculative adaptive retrieval."""
+
+        if isinstance(self.indexer, VectorStoreServer):
+            data_column_name = "data"
+        else:
+            data_column_name = "text"
+        prompt_udf = _get_RAG_prompt_udf(self.prompt_template)
+        max_documents = self.n_starting_documents * self.factor ** (
+            self.max_iterations - 1
+        )
+
+        @pw.udf(executor=pw.udfs.async_executor())
+        async def answer(
+            query: str, documents: list[str], return_context_docs: bool
+        ) -> pw.Json:
+            response, docs = await self._answer_speculatively(
+                query, list(documents), prompt_udf
+            )
+            result: dict = {
+                "response": response if response is not None else self.no_answer_string
+            }
+            if return_context_docs:
+                result["context_docs"] = docs
+            return pw.Json(result)
+
+        retrieved = pw_ai_queries + self.indexer.index.query_as_of_now(
+            pw_ai_queries.prompt,
+            number_of_matches=max_documents,
+            collapse_rows=True,
+            metadata_filter=_get_jmespath_filter(pw_ai_queries.filters, ""),
+        ).select(documents=pw.coalesce(pw.this[data_column_name], ()))
+
+        return retrieved.select(
+            result=answer(
+                pw.this.prompt, pw.this.documents, pw.this.return_context_docs
+            )
+        )
@@ -1,7 +1,12 @@
 import logging
+import time
 from warnings import warn
 
+import health
+import ingestion_queue
+import metrics
 import pathway as pw
+import request_coalescing
 from dotenv import load_dotenv
 from pathway.xpacks.llm.document_store import DocumentStore
 from pathway.xpacks.llm.servers import DocumentStoreServer
@@ -30,11 +35,29 @@ class App(BaseModel):
     persistence_backend: pw.persistence.Backend | None = None
     persistence_mode: pw.PersistenceMode | None = pw.PersistenceMode.UDF_CACHING
     terminate_on_error: bool = False
+    metrics_port: int | None = None
+    coalesce_requests: bool = True
+    ready_timeout_seconds: float = 600.0
 
     def run(self) -> None:
-        server = DocumentStoreServer(  # noqa: F841
-            self.host, self.port, self.document_store
+        server = DocumentStoreServer(
+            self.host,
+            self.port,
+            self.document_store,
+            cache_strategy=(
+                request_coalescing.SingleFlight() if self.coalesce_requests else None
+            ),
         )
+        health.serve_health(
+            server.webserver, self.document_store, self.ready_timeout_seconds
+        )
+        ingestion_queue.observe(self.document_store)
+
+        if self.metrics_port is not None:
+            metrics.observe_webserver(server.webserver)
+            metrics.observe_document_store(self.document_store)
+            metrics.start_metrics_server(self.host, self.metrics_port)
+
         if self.persistence_mode is None:
             if self.with_cache is True:
                 warn(
@@ -69,7 +92,9 @@ class App(BaseModel):
 
 
 if __name__ == "__main__":
+    start = time.perf_counter()
     with open("app.yaml") as f:
         config = pw.load_yaml(f)
     app = App(**config)
+    logging.info("Built the app from app.yaml in %.2f s", time.perf_counter() - start)
     app.run()
@@ -0,0 +1,238 @@
+"""
+Memory-mapped snapshot of the embeddings of the indexed texts.
+
+After a restart, the index is built again from the replayed documents, and every chunk is
+embedded again unless its embedding is cached. ``pw.udfs.DefaultCache`` stores the results in
+an SQLite-based disk cache, limited to 1 GB by default, so with millions of chunks most of the
+embeddings are evicted. ``MmapEmbeddingCache`` appends every embedding to a flat file in the
+persistence directory. On startup the file is memory-mapped, so the stored embeddings are
+available at once and read from disk only when needed, and only the texts added or changed
+since the snapshot are sent to the embedder. The embeddings appended since the start are read
+back from the file as well, so the process never holds a second copy of all the vectors.
+Each embedding model gets its own snapshot.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import ParamSpec
+
+import numpy as np
+import pathway as pw
+
+logger = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+
+_KEY_SIZE = hashlib.sha256().digest_size
+
+
+class _Snapshot:
+    """Append-only store of vectors of a fixed size, keyed by the hash of the input."""
+
+    def __init__(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        self._keys_path = directory / "keys"
+        self._vectors_path = directory / "vectors"
+        self._meta_path = directory / "meta.json"
+        self._lock = threading.Lock()
+        self._rows: dict[bytes, int] = {}
+        # rows of the file when it was opened, read through the memory map, while the
+        # rows appended later are read by their offset
+        self._stored: np.ndarray | None = None
+        self._stored_rows = 0
+        self.dimensions: int | None = None
+        self.dtype: np.dtype | None = None
+
+        if self._meta_path.exists():
+            meta = json.loads(self._meta_path.read_text())
+            self.dimensions, self.dtype = meta["dimensions"], np.dtype(meta["dtype"])
+            self._open()
+        self._keys_file = open(self._keys_path, "ab")
+        self._vectors_file = open(self._vectors_path, "ab")
+        self._vectors_fd = os.open(self._vectors_path, os.O_RDONLY)
+
+    def _open(self) -> None:
+        assert self.dimensions is not None and self.dtype is not None
+        row_size = self.dimensions * self.dtype.itemsize
+        keys = self._keys_path.read_bytes() if self._keys_path.exists() else b""
+        vectors_size = (
+            self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+        )
+        # a write interrupted by a crash leaves an incomplete last row, which is dropped
+        rows = min(len(keys) // _KEY_SIZE, vectors_size // row_size)
+        for file, size in (
+            (self._keys_path, _KEY_SIZE),
+            (self._vectors_path, row_size),
+        ):
+            if file.exists():
+                os.truncate(file, rows * size)
+        if rows > 0:
+            self._stored = np.memmap(
+                self._vectors_path,
+                dtype=self.dtype,
+                mode="r",
+                shape=(rows, self.dimensions),
+            )
+        self._rows = {keys[i * _KEY_SIZE : (i + 1) * _KEY_SIZE]: i for i in range(rows)}
+        self._stored_rows = rows
+        logger.info(
+            "Memory-mapped %d embeddings from %s", rows, self._vectors_path.parent
+        )
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, key: bytes) -> np.ndarray | None:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        if row < self._stored_rows:
+            assert self._stored is not None
+            return np.array(self._stored[row])
+        assert self.dimensions is not None and self.dtype is not None
+        row_size = self.dimensions * self.dtype.itemsize
+        data = os.pread(self._vectors_fd, row_size, row * row_size)
+        return np.frombuffer(data, dtype=self.dtype).copy()
+
+    def append(self, key: bytes, vector: np.ndarray) -> None:
+        vector = np.asarray(vector)
+        with self._lock:
+            if key in self._rows:
+                return
+            if self.dimensions is None:
+                self.dimensions, self.dtype = len(vector), vector.dtype
+                self._meta_path.write_text(
+                    json.dumps({"dimensions": self.dimensions, "dtype": self.dtype.str})
+                )
+            if vector.shape != (self.dimensions,):
+                return
+            self._vectors_file.write(vector.astype(self.dtype).tobytes())
+            self._vectors_file.flush()
+            self._keys_file.write(key)
+            self._keys_file.flush()
+            # registered once written, so that it can be read back from the file
+            self._rows[key] = len(self._rows)
+
+
+def _model_name(udf: pw.UDF | None) -> str:
+    """
+    Describes the embedding model of ``udf``, or of the embedder it wraps, by its class
+    and the name of the model, e.g. ``OpenAIEmbedder:text-embedding-3-small``.
+    """
+    embedder = getattr(udf, "embedder", udf)
+    parts = [type(embedder).__name__]
+    kwargs = getattr(embedder, "kwargs", None) or {}
+    for argument in ("model", "model_id"):
+        if kwargs.get(argument) is not None:
+            parts.append(str(kwargs[argument]))
+    model = getattr(embedder, "model", None)
+    if isinstance(model, str):
+        parts.append(model)
+    elif model is not None:
+        # e.g. `SentenceTransformer`, named by the path or name it was loaded from
+        tokenizer = getattr(model, "tokenizer", None)
+        parts.append(str(getattr(tokenizer, "name_or_path", type(model).__name__)))
+    return ":".join(parts)
+
+
+class MmapEmbeddingCache(pw.udfs.CacheStrategy):
+    """
+    Cache of the embeddings kept in a memory-mapped snapshot, which survives restarts.
+
+    Like ``pw.udfs.DefaultCache``, it works only with the persistence enabled and stores
+    the snapshot under the filesystem persistence backend, unless ``path`` is given.
+    It is meant for UDFs embedding a single text, e.g. ``BatchingEmbedder``.
+
+    The snapshot is kept in a subdirectory named by the hash of the embedding model, so
+    that switching the model, even to one with the same number of dimensions, starts a
+    new snapshot instead of returning the embeddings of the previous one.
+
+    Args:
+        path: directory of the snapshots. Defaults to ``embedding_snapshot/<name>`` in the
+            directory of the persistence backend.
+        name: name of the snapshots. Defaults to the name of the cached function.
+        model: name of the embedding model. Defaults to the class and the model of the
+            ``embedder`` of the cached UDF, e.g. of ``BatchingEmbedder``.
+    """
+
+    def __init__(
+        self, path: str | None = None, name: str | None = None, model: str | None = None
+    ) -> None:
+        self.path = path
+        self.name = name
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._snapshot: _Snapshot | None = None
+
+    def _get_snapshot(self, func: Callable) -> _Snapshot | None:
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            func = inspect.unwrap(func)
+            path = self.path
+            if path is None:
+                storage_root = os.environ.get("PATHWAY_PERSISTENT_STORAGE")
+                if storage_root is None:
+                    return None
+                if self.name is None:
+                    self.name = f"{func.__module__}_{func.__qualname__}"
+                path = os.path.join(storage_root, "embedding_snapshot", self.name)
+            if self.model is None:
+                self.model = _model_name(getattr(func, "__self__", None))
+            model_hash = hashlib.sha256(self.model.encode()).hexdigest()[:16]
+            logger.info(
+                "Embeddings of %s are kept in snapshot %s", self.model, model_hash
+            )
+            self._snapshot = _Snapshot(Path(path) / model_hash)
+            return self._snapshot
+
+    @staticmethod
+    def _key(args: tuple, kwargs: dict) -> bytes:
+        return hashlib.sha256(repr((args, sorted(kwargs.items()))).encode()).digest()
+
+    def wrap_async(
+        self, func: Callable[P, Awaitable[np.ndarray]]
+    ) -> Callable[P, Awaitable[np.ndarray]]:
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> np.ndarray:
+            snapshot = self._get_snapshot(func)
+            if snapshot is None:
+                return await func(*args, **kwargs)
+            key = self._key(args, kwargs)
+            vector = snapshot.get(key)
+            if vector is not None:
+                self.hits += 1
+                return vector
+            self.misses += 1
+            vector = await func(*args, **kwargs)
+            snapshot.append(key, vector)
+            return vector
+
+        return wrapper
+
+    def wrap_sync(self, func: Callable[P, np.ndarray]) -> Callable[P, np.ndarray]:
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> np.ndarray:
+            snapshot = self._get_snapshot(func)
+            if snapshot is None:
+                return func(*args, **kwargs)
+            key = self._key(args, kwargs)
+            vector = snapshot.get(key)
+            if vector is not None:
+                self.hits += 1
+                return vector
+            self.misses += 1
+            vector = func(*args, **kwargs)
+            snapshot.append(key, vector)
+            return vector
+
+        return wrapper
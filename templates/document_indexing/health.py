@@ -0,0 +1,173 @@
+"""
+Liveness and readiness endpoints of the template.
+
+``GET /health`` answers 200 as soon as the webserver is up, so an orchestrator does not
+restart a pod which is still loading. ``GET /ready`` answers 503 until the pipeline is
+running, the components created by ``lazy_loading`` are loaded and every document read
+so far is parsed and indexed, and 200 from then on. Documents added later do not make
+the pod unready again, as it can still answer from the documents already indexed.
+A document which failed to parse or gave no chunks is never marked as parsed, so
+documents not indexed within ``timeout_seconds`` no longer count as pending. A pipeline
+whose sources have read nothing ``startup_seconds`` after the start counts as running,
+so that a pod with an empty corpus gets ready too.
+"""
+
+import logging
+import threading
+import time
+
+import ingestion_queue
+import lazy_loading
+import pathway as pw
+from aiohttp import web
+from pathway.xpacks.llm.document_store import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Tracks whether the pipeline has caught up with the documents read at startup.
+
+    Args:
+        document_store: document store of the app.
+        timeout_seconds: time after which a document read and not indexed, e.g. because
+            its parsing failed or gave no text, no longer counts as pending.
+        startup_seconds: time after the start of the run after which the pipeline counts
+            as running even if its sources have read nothing.
+    """
+
+    def __init__(
+        self,
+        document_store: DocumentStore,
+        timeout_seconds: float = 600.0,
+        startup_seconds: float = 5.0,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.startup_seconds = startup_seconds
+        self._lock = threading.Lock()
+        self.running = False
+        self.ready = False
+        self._started_at: float | None = None
+        self._parsed: set = set()
+        # time at which each document not parsed yet was read, and its path
+        self._unparsed: dict = {}
+        self._stalled: set = set()
+        changes: dict = {}
+
+        def on_progress_change(key, row, time, is_addition):
+            # an update removes the previous row and adds the new one, in any order
+            if is_addition:
+                changes[key] = row
+            else:
+                changes.setdefault(key, None)
+
+        def on_time_end(time):
+            with self._lock:
+                for key, row in changes.items():
+                    if row is not None and not row["is_parsed"]:
+                        self._parsed.discard(key)
+                        if key not in self._unparsed:
+                            path = row["metadata"].value.get("path")
+                            self._unparsed[key] = (_now(), path)
+                        continue
+                    self._unparsed.pop(key, None)
+                    self._stalled.discard(key)
+                    if row is None:
+                        self._parsed.discard(key)
+                    else:
+                        self._parsed.add(key)
+                changes.clear()
+                self.running = True
+
+        pw.io.subscribe(
+            document_store.progress_table,
+            on_change=on_progress_change,
+            on_time_end=on_time_end,
+        )
+
+        def on_start_change(key, row, time, is_addition):
+            pass
+
+        def on_start(time):
+            with self._lock:
+                if self._started_at is None:
+                    self._started_at = _now()
+
+        # the time of a static row ends once the run starts, whether or not the sources
+        # read anything
+        started = pw.debug.table_from_rows(
+            pw.schema_from_types(started=bool), [(True,)]
+        )
+        pw.io.subscribe(started, on_change=on_start_change, on_time_end=on_start)
+
+    def _expire(self) -> None:
+        # called with the lock held
+        deadline = _now() - self.timeout_seconds
+        for key, (read_at, path) in self._unparsed.items():
+            if read_at < deadline and key not in self._stalled:
+                logger.warning(
+                    "Document %s not indexed after %.0f s, no longer waiting for it "
+                    "to be ready",
+                    path,
+                    self.timeout_seconds,
+                )
+                self._stalled.add(key)
+
+    def _running(self) -> bool:
+        # called with the lock held
+        if self.running:
+            return True
+        return (
+            self._started_at is not None
+            and _now() - self._started_at >= self.startup_seconds
+        )
+
+    def status(self) -> dict:
+        with self._lock:
+            self._expire()
+            running = self._running()
+            loading = lazy_loading.pending()
+            queued = ingestion_queue.queued()
+            pending_documents = len(self._unparsed) - len(self._stalled)
+            status = {
+                "running": running,
+                "indexed_documents": len(self._parsed),
+                "pending_documents": pending_documents,
+                "stalled_documents": len(self._stalled),
+                "queued_documents": queued,
+                "loading": loading,
+            }
+            pending = pending_documents + queued
+            if running and not loading and pending == 0:
+                self.ready = True
+            status["ready"] = self.ready
+            return status
+
+
+def _now() -> float:
+    return time.monotonic()
+
+
+def serve_health(
+    webserver: pw.io.http.PathwayWebserver,
+    document_store: DocumentStore,
+    timeout_seconds: float = 600.0,
+) -> Readiness:
+    """
+    Adds the ``/health`` and ``/ready`` endpoints to the webserver of the app.
+    See ``Readiness`` for ``timeout_seconds``.
+    """
+    readiness = Readiness(document_store, timeout_seconds)
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def ready(request: web.Request) -> web.Response:
+        status = readiness.status()
+        return web.json_response(status, status=200 if status["ready"] else 503)
+
+    # added to the app directly, so that the probes are not logged as requests
+    webserver._app.router.add_get("/health", health)
+    webserver._app.router.add_get("/ready", ready)
+    return readiness
@@ -0,0 +1,403 @@
+"""
+Priority queue of the documents between the sources and the ``DocumentStore``.
+
+The ``DocumentStore`` parses documents in the order in which the sources read them, so
+during a backfill of thousands of files a newly added document waits behind all of
+them. ``prioritize`` puts the documents of the sources into a queue ordered by
+configurable rules, e.g. the priority of their source, the newest or the smallest first,
+and passes them on to the ``DocumentStore`` when fewer than ``max_in_flight`` documents
+are being parsed and indexed. The contents of the queued documents are kept in memory
+up to ``max_queued_bytes``, and the rest is written to files until it is passed on.
+
+Deleted documents are removed from the index at once, and a modified document already
+in the index stays searchable in its previous version until the new one is indexed.
+Each version is passed on under its own key, so that a parser run with the fully
+asynchronous executor does not carry the chunks of the previous version over to it.
+
+The documents passed on get two metadata fields, ``_ingestion_id``, the key of the
+document in its source, and ``_ingestion_seq``, the number of its version. The queue
+matches the chunks of the store to the versions in flight by them, so they stay in the
+metadata of the chunks and are returned with the documents and the retrieved chunks,
+like the ``_file_id`` of the ``DocumentStore``.
+"""
+
+import heapq
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Literal, get_args
+
+import metrics
+import pathway as pw
+from pathway.xpacks.llm.document_store import DocumentStore
+
+logger = logging.getLogger(__name__)
+
+Rule = Literal["source", "newest", "oldest", "smallest", "largest"]
+
+# metadata field identifying the documents passed on to the document store
+QUEUE_ID = "_ingestion_id"
+# metadata field numbering the versions of a document passed on
+QUEUE_SEQ = "_ingestion_seq"
+
+_queues: list["IngestionQueue"] = []
+
+
+class _QueueSchema(pw.Schema):
+    ingestion_id: str = pw.column_definition(primary_key=True)
+    data: bytes
+    metadata: pw.Json
+
+
+@dataclass
+class _Document:
+    id: str
+    source: int
+    metadata: dict
+    size: int
+    modified_at: float
+    enqueued_at: float
+    seq: int
+    data: bytes | None = None
+    spill_path: str | None = None
+
+
+class IngestionQueue(pw.io.python.ConnectorSubject):
+    """
+    Connector passing the documents of ``sources`` on in the order of ``order``.
+
+    Args:
+        sources: tables of the sources, with the ``data`` and ``_metadata`` columns.
+        order: rules ordering the queued documents, the first one deciding first.
+            ``"source"`` orders by ``source_priorities``, ``"newest"`` and ``"oldest"`` by
+            the ``modified_at`` metadata, ``"smallest"`` and ``"largest"`` by the size
+            of the contents. Documents equal in all rules are passed on as they came.
+        source_priorities: priority of each of ``sources``, the highest first.
+            Defaults to the same priority for all sources.
+        max_in_flight: number of documents passed on and not indexed yet.
+        max_wait_seconds: documents queued for longer are passed on before all others,
+            so that the last ones of the order are not starved. ``None`` to disable.
+        max_queued_bytes: total size of the queued contents kept in memory.
+        spill_dir: directory of the contents written to files. Defaults to a temporary
+            directory.
+        in_flight_timeout_seconds: time after which a document passed on is no longer
+            counted as in flight, e.g. when its parsing failed or gave no text.
+    """
+
+    def __init__(
+        self,
+        sources: list[pw.Table],
+        *,
+        order: list[Rule] = ["source", "newest", "smallest"],
+        source_priorities: list[float] | None = None,
+        max_in_flight: int = 32,
+        max_wait_seconds: float | None = None,
+        max_queued_bytes: int = 256 * 1024 * 1024,
+        spill_dir: str | None = None,
+        in_flight_timeout_seconds: float = 600.0,
+    ):
+        super().__init__(datasource_name="ingestion_queue", session_type="upsert")
+        if source_priorities is not None and len(source_priorities) != len(sources):
+            raise ValueError(
+                f"got {len(source_priorities)} source_priorities for {len(sources)} sources"
+            )
+        unknown = [rule for rule in order if rule not in get_args(Rule)]
+        if unknown:
+            raise ValueError(f"unknown ordering rules {unknown}")
+        self.order = list(order)
+        self.source_priorities = source_priorities or [0.0] * len(sources)
+        self.max_in_flight = max_in_flight
+        self.max_wait_seconds = max_wait_seconds
+        self.max_queued_bytes = max_queued_bytes
+        self.spill_dir = spill_dir
+        self.in_flight_timeout_seconds = in_flight_timeout_seconds
+
+        self._condition = threading.Condition()
+        self._queued: dict[str, _Document] = {}
+        self._heap: list[tuple[tuple, int, str]] = []
+        self._in_memory_bytes = 0
+        # time at which each document in flight was passed on, and its `seq`
+        self._in_flight: dict[str, tuple[float, int]] = {}
+        # `seq` of the versions of each document passed on and not deleted yet
+        self._in_store: dict[str, list[int]] = {}
+        self._seq = 0
+        self._changes: list[dict[str, dict | None]] = [{} for _ in sources]
+        self._running_sources = len(sources)
+
+        for source, table in enumerate(sources):
+            self._subscribe(source, table)
+
+    def _subscribe(self, source: int, table: pw.Table) -> None:
+        changes = self._changes[source]
+
+        def on_change(key, row, time, is_addition):
+            id = f"{source}-{key}"
+            # an update removes the previous row and adds the new one, in any order
+            if is_addition:
+                changes[id] = row
+            else:
+                changes.setdefault(id, None)
+
+        def on_time_end(time):
+            with self._condition:
+                for id, row in changes.items():
+                    if row is None:
+                        self._discard(id)
+                    else:
+                        self._enqueue(id, source, row)
+                changes.clear()
+                self._report()
+                self._condition.notify()
+
+        def on_end():
+            with self._condition:
+                self._running_sources -= 1
+                self._condition.notify()
+
+        if "_metadata" not in table.column_names():
+            table = table.with_columns(_metadata=dict())
+        pw.io.subscribe(
+            table.select(pw.this.data, pw.this._metadata),
+            on_change=on_change,
+            on_time_end=on_time_end,
+            on_end=on_end,
+        )
+
+    def observe(self, document_store: DocumentStore) -> None:
+        """
+        Counts the documents as indexed once the ``document_store`` has split them.
+
+        The chunks are matched by the version passed on, as the ``progress_table`` of the
+        store joins on ``_file_id`` and would count the chunks of the previous version of
+        a modified document. The previous version is then deleted.
+        """
+        versions = (
+            document_store.chunked_docs.select(
+                ingestion_id=pw.this.metadata[QUEUE_ID].as_str(),
+                seq=pw.this.metadata[QUEUE_SEQ].as_int(),
+            )
+            .filter(pw.this.ingestion_id.is_not_none())
+            .groupby(pw.this.ingestion_id, pw.this.seq)
+            .reduce(pw.this.ingestion_id, pw.this.seq)
+        )
+
+        def on_change(key, row, time, is_addition):
+            if is_addition:
+                with self._condition:
+                    id = row["ingestion_id"]
+                    in_flight = self._in_flight.get(id)
+                    if in_flight is not None and in_flight[1] == row["seq"]:
+                        self._release(id)
+                        self._report()
+                        self._condition.notify()
+
+        pw.io.subscribe(versions, on_change=on_change)
+
+    def _key(self, document: _Document) -> tuple:
+        key: list[float] = []
+        for rule in self.order:
+            if rule == "source":
+                key.append(-self.source_priorities[document.source])
+            elif rule == "newest":
+                key.append(-document.modified_at)
+            elif rule == "oldest":
+                key.append(document.modified_at)
+            elif rule == "smallest":
+                key.append(document.size)
+            elif rule == "largest":
+                key.append(-document.size)
+        return tuple(key)
+
+    def _enqueue(self, id: str, source: int, row: dict) -> None:
+        self._drop_queued(id)
+        metadata = row["_metadata"].value if row["_metadata"] is not None else {}
+        data: bytes = row["data"]
+        now = time.time()
+        self._seq += 1
+        document = _Document(
+            id=id,
+            source=source,
+            metadata=dict(metadata),
+            size=len(data),
+            modified_at=metadata.get("modified_at") or now,
+            enqueued_at=now,
+            seq=self._seq,
+        )
+        if self._in_memory_bytes + len(data) <= self.max_queued_bytes:
+            document.data = data
+            self._in_memory_bytes += len(data)
+        else:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="ingestion-queue-")
+            document.spill_path = os.path.join(self.spill_dir, str(document.seq))
+            with open(document.spill_path, "wb") as f:
+                f.write(data)
+        self._queued[id] = document
+        heapq.heappush(self._heap, (self._key(document), document.seq, id))
+
+    def _drop_queued(self, id: str) -> _Document | None:
+        document = self._queued.pop(id, None)
+        if document is not None:
+            if document.data is not None:
+                self._in_memory_bytes -= document.size
+            if document.spill_path is not None:
+                os.remove(document.spill_path)
+        return document
+
+    def _delete_versions(self, id: str, keep: int | None = None) -> None:
+        """Deletes the versions of the document passed on, except for ``keep``."""
+        for seq in self._in_store.pop(id, []):
+            if seq == keep:
+                self._in_store[id] = [seq]
+            else:
+                # the upsert session removes the row by its primary key
+                self.delete(
+                    ingestion_id=_version_key(id, seq), data=b"", metadata=pw.Json({})
+                )
+
+    def _release(self, id: str) -> None:
+        """Stops counting the document as in flight, replacing its previous versions."""
+        _, seq = self._in_flight.pop(id)
+        self._delete_versions(id, keep=seq)
+
+    def _discard(self, id: str) -> None:
+        self._drop_queued(id)
+        self._in_flight.pop(id, None)
+        self._delete_versions(id)
+
+    def _next_document(self) -> _Document | None:
+        """Pops the document to pass on next, if any."""
+        if self.max_wait_seconds is not None and self._queued:
+            # documents are queued in the order of their `seq`, the oldest first
+            oldest = next(iter(self._queued.values()))
+            if time.time() - oldest.enqueued_at > self.max_wait_seconds:
+                return self._pop(oldest.id)
+        while self._heap:
+            _, seq, id = heapq.heappop(self._heap)
+            document = self._queued.get(id)
+            # entries of documents removed or queued again are skipped
+            if document is not None and document.seq == seq:
+                return self._pop(id)
+        return None
+
+    def _pop(self, id: str) -> _Document:
+        document = self._queued.pop(id)
+        if document.data is not None:
+            self._in_memory_bytes -= document.size
+        return document
+
+    def _expire_in_flight(self) -> None:
+        deadline = time.monotonic() - self.in_flight_timeout_seconds
+        for id, (started, _) in list(self._in_flight.items()):
+            if started < deadline:
+                logger.warning(
+                    "Document %s not indexed after %.0f s, no longer waiting for it",
+                    id,
+                    self.in_flight_timeout_seconds,
+                )
+                self._release(id)
+
+    def _report(self) -> None:
+        metrics.REGISTRY.set_gauge("pathway_ingestion_queued", len(self._queued))
+        metrics.REGISTRY.set_gauge("pathway_ingestion_in_flight", len(self._in_flight))
+        metrics.REGISTRY.set_gauge(
+            "pathway_ingestion_queued_bytes_in_memory", self._in_memory_bytes
+        )
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                self._expire_in_flight()
+                if len(self._in_flight) >= self.max_in_flight or not self._queued:
+                    if not self._queued and self._running_sources == 0:
+                        return
+                    self._condition.wait(timeout=1.0)
+                    continue
+                document = self._next_document()
+                if document is None:
+                    continue
+                data = document.data
+                if document.spill_path is not None:
+                    with open(document.spill_path, "rb") as f:
+                        data = f.read()
+                    os.remove(document.spill_path)
+                self._in_flight[document.id] = (time.monotonic(), document.seq)
+                self._in_store.setdefault(document.id, []).append(document.seq)
+                metadata = {
+                    **document.metadata,
+                    QUEUE_ID: document.id,
+                    QUEUE_SEQ: document.seq,
+                }
+                self.next(
+                    ingestion_id=_version_key(document.id, document.seq),
+                    data=data,
+                    metadata=pw.Json(metadata),
+                )
+                self._report()
+
+    def on_stop(self) -> None:
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def _is_internal(self) -> bool:
+        # the documents are persisted by the sources and passed on again after a restart
+        return True
+
+
+def _version_key(id: str, seq: int) -> str:
+    return f"{id}/{seq}"
+
+
+def prioritize(
+    sources: pw.Table | list[pw.Table],
+    *,
+    order: list[Rule] = ["source", "newest", "smallest"],
+    source_priorities: list[float] | None = None,
+    max_in_flight: int = 32,
+    max_wait_seconds: float | None = None,
+    max_queued_bytes: int = 256 * 1024 * 1024,
+    spill_dir: str | None = None,
+    in_flight_timeout_seconds: float = 600.0,
+) -> pw.Table:
+    """
+    Returns the documents of ``sources`` as one table, filled in the order of ``order``.
+
+    The ``DocumentStore`` built on the returned table is connected to the queue with
+    ``observe``. See ``IngestionQueue`` for the arguments.
+    """
+    if isinstance(sources, pw.Table):
+        sources = [sources]
+    queue = IngestionQueue(
+        sources,
+        order=order,
+        source_priorities=source_priorities,
+        max_in_flight=max_in_flight,
+        max_wait_seconds=max_wait_seconds,
+        max_queued_bytes=max_queued_bytes,
+        spill_dir=spill_dir,
+        in_flight_timeout_seconds=in_flight_timeout_seconds,
+    )
+    _queues.append(queue)
+    table = pw.io.python.read(
+        queue, schema=_QueueSchema, autocommit_duration_ms=100, name="ingestion_queue"
+    )
+    return table.select(pw.this.data, _metadata=pw.this.metadata)
+
+
+def queued() -> int:
+    """Number of documents waiting in the queues created with ``prioritize``."""
+    total = 0
+    for queue in _queues:
+        with queue._condition:
+            total += len(queue._queued)
+    return total
+
+
+def observe(document_store: DocumentStore) -> None:
+    """Connects the queues created with ``prioritize`` to the ``document_store``."""
+    for queue in _queues:
+        queue.observe(document_store)
@@ -0,0 +1,175 @@
+"""
+Lazy construction of the heavy components of the pipeline.
+
+``DoclingParser`` imports docling and its models, and ``SentenceTransformerEmbedder``
+imports PyTorch and loads the embedding model, when they are created from ``app.yaml``.
+The index then embeds a text to learn the number of dimensions. All of this happens
+before the pipeline starts, so the webserver does not answer for tens of seconds after
+a restart. ``LazyParser`` and ``LazySentenceTransformerEmbedder`` create and load them
+in a background thread instead, and the UDFs wait for them only when they are first
+called. ``pending()`` lists the components still loading, which ``health`` reports as
+not ready.
+"""
+
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from typing import Any, Callable, Literal
+
+import pathway as pw
+from pathway.xpacks.llm.embedders import SentenceTransformerEmbedder
+
+logger = logging.getLogger(__name__)
+
+_loaders: list["_Loader"] = []
+
+
+class _Loader:
+    """Runs ``load`` once, in a background thread if ``preload`` is set."""
+
+    def __init__(self, name: str, load: Callable[[], Any], preload: bool):
+        self.name = name
+        self._load = load
+        self._lock = threading.Lock()
+        self._value: Any = None
+        self._loaded = False
+        if preload:
+            _loaders.append(self)
+            threading.Thread(target=self._preload, daemon=True, name=name).start()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _preload(self) -> None:
+        try:
+            self.get()
+        except Exception:
+            # loading is retried, and the error raised, on the first use
+            logger.exception("Loading %s failed", self.name)
+
+    def get(self) -> Any:
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                self._value = self._load()
+                self._loaded = True
+                logger.info(
+                    "Loaded %s in %.2f s", self.name, time.perf_counter() - start
+                )
+        return self._value
+
+
+def pending() -> list[str]:
+    """Names of the preloaded components which are still loading."""
+    return [loader.name for loader in _loaders if not loader.loaded]
+
+
+def _import_class(path: type | str) -> type:
+    if isinstance(path, str):
+        module_name, _, class_name = path.rpartition(".")
+        return getattr(importlib.import_module(module_name), class_name)
+    return path
+
+
+class LazyParser(pw.UDF):
+    """
+    Parser created, with its imports, in a background thread or on the first document.
+
+    Args:
+        parser: class of the parser or its import path, e.g.
+            ``"pathway.xpacks.llm.parsers.DoclingParser"``.
+        parser_kwargs: arguments of the parser.
+        preload: whether to create the parser in the background as soon as the pipeline
+            is built, rather than on the first document.
+        cache_strategy: caching of the parse results.
+        async_mode: Mode of execution for the UDF, either ``"batch_async"`` or
+            ``"fully_async"``. Default is ``"batch_async"``.
+    """
+
+    def __init__(
+        self,
+        parser: type[pw.UDF] | str,
+        parser_kwargs: dict = {},
+        preload: bool = True,
+        cache_strategy: pw.udfs.CacheStrategy | None = None,
+        *,
+        async_mode: Literal["batch_async", "fully_async"] = "batch_async",
+    ):
+        if async_mode == "fully_async":
+            executor = pw.udfs.fully_async_executor()
+        else:
+            executor = pw.udfs.async_executor()
+        super().__init__(executor=executor, cache_strategy=cache_strategy)
+        self.parser = parser
+        self.parser_kwargs = dict(parser_kwargs)
+        self._loader = _Loader(
+            f"parser {parser}",
+            lambda: _import_class(parser)(**self.parser_kwargs),
+            preload,
+        )
+
+    async def __wrapped__(self, contents: bytes, **kwargs) -> list[tuple[str, dict]]:
+        if self._loader.loaded:
+            parser = self._loader.get()
+        else:
+            parser = await asyncio.to_thread(self._loader.get)
+        if asyncio.iscoroutinefunction(parser.__wrapped__):
+            return await parser.__wrapped__(contents, **kwargs)
+        return await asyncio.to_thread(parser.__wrapped__, contents, **kwargs)
+
+
+class LazySentenceTransformerEmbedder(SentenceTransformerEmbedder):
+    """
+    ``SentenceTransformerEmbedder`` loading its model in a background thread or when it
+    is first used.
+
+    Args:
+        model: model name or path.
+        call_kwargs: kwargs passed to each call of ``encode``.
+        device: device on which the model runs.
+        batch_size: maximum size of a single batch sent to the embedder.
+        dimensions: number of dimensions of the embeddings. When given, the index is
+            built without waiting for the model.
+        preload: whether to load the model in the background as soon as the pipeline is
+            built, rather than on the first text.
+        sentencetransformer_kwargs: kwargs of ``SentenceTransformer``.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        call_kwargs: dict = {},
+        device: str = "cpu",
+        batch_size: int = 1024,
+        *,
+        dimensions: int | None = None,
+        preload: bool = True,
+        **sentencetransformer_kwargs,
+    ):
+        # `SentenceTransformerEmbedder.__init__` would load the model at once
+        super(SentenceTransformerEmbedder, self).__init__(max_batch_size=batch_size)
+        self.kwargs = {"batch_size": batch_size, **call_kwargs}
+        self.dimensions = dimensions
+
+        def load():
+            from sentence_transformers import SentenceTransformer
+
+            return SentenceTransformer(
+                model_name_or_path=model, device=device, **sentencetransformer_kwargs
+            )
+
+        self._loader = _Loader(f"embedding model {model}", load, preload)
+
+    @property
+    def model(self):
+        return self._loader.get()
+
+    def get_embedding_dimension(self, **kwargs):
+        if self.dimensions is not None and not kwargs:
+            return self.dimensions
+        return super().get_embedding_dimension(**kwargs)
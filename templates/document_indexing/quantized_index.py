@@ -0,0 +1,388 @@
+"""
+Usearch index storing the vectors in reduced precision.
+
+``UsearchKnnFactory`` keeps every vector as float32, which for a 1024-dimensional model
+such as ``mxbai-embed-large-v1`` is 4 KB per chunk and the largest part of the memory used
+by the pipeline. The usearch index of the engine takes no storage type, so
+``QuantizedUsearchKnnFactory`` builds the same HNSW index with the ``usearch`` package,
+whose scalar quantization keeps the vectors as ``f16`` (2 bytes per dimension) or ``i8``
+(1 byte per dimension). Optionally, the best candidates are rescored with the exact
+vectors, which are then kept in a temporary file on disk and read through a memory map,
+so only the rescored rows are loaded.
+"""
+
+import functools
+import logging
+import math
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Any, Literal
+
+import jmespath
+import metrics
+import numpy as np
+import pathway as pw
+from capacity_planning import PlannedUsearchKnnFactory
+from pathway.stdlib.indexing.colnames import _INDEX_REPLY
+from pathway.stdlib.indexing.data_index import InnerIndex
+from pathway.stdlib.ml.classifiers._knn_lsh import _glob_options
+from usearch.index import Index
+
+logger = logging.getLogger(__name__)
+
+ScalarKind = Literal["f32", "f16", "i8"]
+
+# metrics of the engine's usearch index, by their names in the `usearch` package
+_METRICS = {
+    pw.indexing.USearchMetricKind.COS: "cos",
+    pw.indexing.USearchMetricKind.IP: "ip",
+    pw.indexing.USearchMetricKind.L2SQ: "l2sq",
+}
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_filter(metadata_filter: str) -> jmespath.parser.ParsedResult:
+    return jmespath.compile(metadata_filter)
+
+
+class QuantizedUsearchIndex:
+    """
+    Thread-safe usearch HNSW index storing the vectors in reduced precision.
+
+    The calls to usearch share its per-thread contexts, so they are serialized, but each
+    of them takes well under a millisecond. The metadata filter and the rescoring are
+    evaluated outside of the lock.
+
+    Args:
+        dimensions: number of dimensions of the vectors.
+        dtype: precision of the vectors kept in memory, ``"f32"``, ``"f16"`` or ``"i8"``.
+        metric: metric kind that is used to determine distance, ``COS``, ``IP`` or
+            ``L2SQ``.
+        reserved_space: initial capacity of the file of the exact vectors, doubled
+            whenever it is exceeded. The usearch index grows on its own.
+        connectivity: maximum number of edges for a node in the HNSW graph, 0 lets
+            usearch configure it.
+        expansion_add: amount of work spent while adding a vector, 0 lets usearch
+            configure it.
+        expansion_search: amount of work spent while searching, 0 lets usearch
+            configure it.
+        rescore: whether to keep the exact vectors on disk and rescore the best
+            candidates with them.
+        oversampling: number of candidates rescored, as a multiple of the number of
+            requested matches.
+    """
+
+    def __init__(
+        self,
+        dimensions: int,
+        dtype: ScalarKind = "i8",
+        metric: pw.indexing.USearchMetricKind = pw.indexing.USearchMetricKind.COS,
+        reserved_space: int = 1000,
+        connectivity: int = 0,
+        expansion_add: int = 0,
+        expansion_search: int = 0,
+        rescore: bool = True,
+        oversampling: float = 4.0,
+    ):
+        if metric not in _METRICS:
+            raise ValueError(
+                "Only the COS, IP and L2SQ metrics are supported by the quantized index"
+            )
+        self.dimensions = dimensions
+        self.dtype = dtype
+        self.metric = _METRICS[metric]
+        self.rescore = rescore
+        self.oversampling = oversampling
+        # zero tells usearch to configure the parameter on its own, as in the engine
+        options = {
+            name: value
+            for name, value in (
+                ("connectivity", connectivity),
+                ("expansion_add", expansion_add),
+                ("expansion_search", expansion_search),
+            )
+            if value
+        }
+        self._index = Index(ndim=dimensions, metric=self.metric, dtype=dtype, **options)
+        self._lock = threading.Lock()
+        self._capacity = 0
+        self._next_id = 0
+        self._free: list[int] = []
+        self._ids: dict = {}
+        self._keys: dict[int, Any] = {}
+        self._metadata: dict[int, Any] = {}
+        self._exact_file = (
+            tempfile.TemporaryFile(prefix="exact_vectors") if rescore else None
+        )
+        self._exact: np.memmap | None = None
+        self._grow_exact(max(reserved_space, 1))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the index, without the exact vectors kept on disk."""
+        return self._index.memory_usage
+
+    def _grow_exact(self, capacity: int) -> None:
+        # the earlier memory maps stay valid for the searches still reading them, as
+        # the file only grows
+        if self._exact_file is not None:
+            self._exact_file.truncate(capacity * self.dimensions * 4)
+            self._exact = np.memmap(
+                self._exact_file,
+                dtype=np.float32,
+                mode="r+",
+                shape=(capacity, self.dimensions),
+            )
+        self._capacity = capacity
+
+    def _prepare(self, vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dimensions,):
+            raise ValueError(
+                f"Expected a vector with {self.dimensions} dimensions, got {vector.shape}"
+            )
+        if self.metric == "cos":
+            # normalized once, so that rescoring is a dot product
+            norm = np.linalg.norm(vector)
+            return vector / norm if norm > 0 else vector
+        return vector
+
+    def add(self, key, vector, metadata=None) -> None:
+        # called only from the subscription to the indexed table, so not concurrently
+        # with other updates
+        vector = self._prepare(vector)
+        id = self._ids.get(key)
+        if id is None:
+            if self._free:
+                id = self._free.pop()
+            else:
+                if self._next_id == self._capacity:
+                    self._grow_exact(2 * self._capacity)
+                id = self._next_id
+                self._next_id += 1
+        if self._exact is not None:
+            self._exact[id] = vector
+        with self._lock:
+            if key in self._ids:
+                self._index.remove(id)
+            self._index.add(id, vector, threads=1)
+        self._metadata[id] = metadata
+        self._keys[id] = key
+        self._ids[key] = id
+
+    def remove(self, key) -> None:
+        id = self._ids.pop(key, None)
+        if id is None:
+            return
+        # unmapped first, so that concurrent searches skip the removed vector
+        del self._keys[id]
+        del self._metadata[id]
+        with self._lock:
+            self._index.remove(id)
+        self._free.append(id)
+
+    def _exact_distances(self, ids: np.ndarray, query: np.ndarray) -> np.ndarray:
+        assert self._exact is not None
+        exact = np.asarray(self._exact[ids])
+        if self.metric == "l2sq":
+            return ((exact - query) ** 2).sum(axis=1)
+        # cosine of the normalized vectors, or the inner product, as usearch computes it
+        return 1.0 - exact @ query
+
+    def search(
+        self, vector, k: int, metadata_filter: str | None = None
+    ) -> list[tuple[Any, float]]:
+        """
+        Returns up to ``k`` pairs of the key and the distance of the vectors nearest to
+        ``vector``, the nearest first.
+
+        With ``metadata_filter``, the filter is evaluated only on the candidates returned
+        by the index, whose number is increased until enough of them match it.
+        """
+        if k <= 0 or not self._ids:
+            return []
+        query = self._prepare(vector)
+        wanted = max(k, math.ceil(k * self.oversampling)) if self.rescore else k
+        expression = _compile_filter(metadata_filter) if metadata_filter else None
+        checked: dict[int, bool] = {}
+        count = wanted
+        while True:
+            with self._lock:
+                matches = self._index.search(query, count, threads=1)
+                size = len(self._index)
+            candidates = []
+            for id, distance in zip(matches.keys.tolist(), matches.distances.tolist()):
+                key = self._keys.get(id)
+                if key is None:
+                    continue
+                if expression is not None:
+                    if id not in checked:
+                        checked[id] = _matches(expression, self._metadata.get(id))
+                    if not checked[id]:
+                        continue
+                candidates.append((id, key, distance))
+                if len(candidates) == wanted:
+                    break
+            if len(candidates) == wanted or len(matches.keys) < count or count >= size:
+                break
+            count *= 4
+
+        if self._exact is not None and candidates:
+            ids = np.array([id for id, _, _ in candidates])
+            distances = self._exact_distances(ids, query).tolist()
+            candidates = [
+                (id, key, distance)
+                for (id, key, _), distance in zip(candidates, distances)
+            ]
+        candidates.sort(key=lambda candidate: candidate[2])
+        return [(key, distance) for _, key, distance in candidates[:k]]
+
+
+def _matches(expression: jmespath.parser.ParsedResult, metadata) -> bool:
+    try:
+        return expression.search(metadata, options=_glob_options) is True
+    except jmespath.exceptions.JMESPathError:
+        return False
+
+
+@dataclass(frozen=True, kw_only=True)
+class QuantizedUsearchKnn(InnerIndex):
+    """
+    KNN index over a ``QuantizedUsearchIndex``, supported only in the as-of-now variant,
+    as ``USearchKnn``.
+    """
+
+    index: QuantizedUsearchIndex
+    embedder: pw.UDF | None = None
+
+    def __post_init__(self):
+        data_column = self.data_column
+        if self.embedder is not None:
+            data_column = data_column.table.select(
+                _pw_embedding=self.embedder(data_column)
+            )._pw_embedding
+        table = data_column.table.select(
+            vector=data_column,
+            metadata=self.metadata_column if self.metadata_column is not None else None,
+        )
+        index = self.index
+
+        def on_change(key, row, time, is_addition):
+            if is_addition:
+                metadata = row["metadata"]
+                index.add(
+                    key, row["vector"], metadata.value if metadata is not None else None
+                )
+            else:
+                index.remove(key)
+            metrics.REGISTRY.set_gauge("pathway_index_vectors_bytes", index.nbytes)
+
+        pw.io.subscribe(table, on_change=on_change)
+
+    def query(
+        self,
+        query_column: pw.ColumnReference,
+        *,
+        number_of_matches: pw.ColumnExpression | int = 3,
+        metadata_filter: pw.ColumnExpression | None = None,
+    ) -> pw.Table:
+        """Currently, usearch knn index is supported only in the as-of-now variant"""
+        raise NotImplementedError(
+            "Currently, usearch knn index is supported only in the as-of-now variant"
+        )
+
+    def query_as_of_now(
+        self,
+        query_column: pw.ColumnReference,
+        *,
+        number_of_matches: pw.ColumnExpression | int = 3,
+        metadata_filter: pw.ColumnExpression | None = None,
+    ) -> pw.Table:
+        index = self.index
+
+        @pw.udf
+        def search(
+            vector: np.ndarray, k: int, metadata_filter: str | None
+        ) -> list[tuple[pw.Pointer, float]]:
+            # the score is the negated distance, as in `UsearchKnnFactory`
+            return [
+                (key, -distance)
+                for key, distance in index.search(vector, k, metadata_filter)
+            ]
+
+        if self.embedder is not None:
+            query_column = query_column.table.select(
+                _pw_query_embedding=self.embedder(query_column)
+            )._pw_query_embedding
+        return query_column.table.select(
+            **{
+                _INDEX_REPLY: search(
+                    query_column,
+                    number_of_matches,
+                    metadata_filter if metadata_filter is not None else None,
+                )
+            }
+        )
+
+
+@dataclass(kw_only=True)
+class QuantizedUsearchKnnFactory(PlannedUsearchKnnFactory):
+    """
+    ``PlannedUsearchKnnFactory`` keeping the vectors in reduced precision.
+
+    With ``dtype: f32`` and no rescoring, the engine's usearch index is used as by
+    ``UsearchKnnFactory``. See ``benchmarks/knn_quantization.py`` for the recall and
+    latency of each setting.
+
+    Args:
+        dtype: precision of the vectors kept in memory, ``"f32"``, ``"f16"`` or
+            ``"i8"``.
+        rescore: whether to rescore the best candidates with the exact vectors, kept on
+            disk.
+        oversampling: number of candidates rescored, as a multiple of the number of
+            requested matches.
+        kwargs: arguments of ``PlannedUsearchKnnFactory``.
+    """
+
+    dtype: ScalarKind = "i8"
+    rescore: bool = True
+    oversampling: float = 4.0
+
+    def build_inner_index(
+        self,
+        data_column: pw.ColumnReference,
+        metadata_column: pw.ColumnExpression | None = None,
+    ) -> InnerIndex:
+        if self.dtype == "f32" and not self.rescore:
+            return super().build_inner_index(data_column, metadata_column)
+        assert isinstance(
+            self.dimensions, int
+        ), "`dimensions` is not set, this may indicate something is wrong with embedder."
+        self._observe_fill(data_column.table)
+        index = QuantizedUsearchIndex(
+            self.dimensions,
+            dtype=self.dtype,
+            metric=self.metric,
+            reserved_space=self.reserved_space,
+            connectivity=self.connectivity,
+            expansion_add=self.expansion_add,
+            expansion_search=self.expansion_search,
+            rescore=self.rescore,
+            oversampling=self.oversampling,
+        )
+        logger.info(
+            "Keeping %d-dimensional vectors as %s in memory%s",
+            self.dimensions,
+            self.dtype,
+            ", rescored with the exact ones kept on disk" if self.rescore else "",
+        )
+        return QuantizedUsearchKnn(
+            data_column,
+            metadata_column,
+            index=index,
+            embedder=self.embedder,
+        )
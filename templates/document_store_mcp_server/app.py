@@ -1,5 +1,6 @@
 import logging
 
+import metrics
 import pathway as pw
 from dotenv import load_dotenv
 from pathway.xpacks.llm.mcp_server import PathwayMcp
@@ -22,8 +23,12 @@ class App(BaseModel):
     terminate_on_error: bool = False
     persistence_backend: pw.persistence.Backend | None = None
     persistence_mode: pw.PersistenceMode | None = pw.PersistenceMode.UDF_CACHING
+    metrics_port: int | None = None
 
     def run(self) -> None:
+        if self.metrics_port is not None:
+            metrics.start_metrics_server(self.host, self.metrics_port)
+
         if self.persistence_mode is not None:
             if self.persistence_backend is None:
                 persistence_backend = pw.persistence.Backend.filesystem("./Cache")
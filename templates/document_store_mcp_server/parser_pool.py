@@ -0,0 +1,138 @@
+"""
+Parsing of documents in a pool of worker processes.
+
+Parsers such as ``DoclingParser`` or ``UnstructuredParser`` spend most of their time on
+CPU-bound work - layout analysis, OCR, table detection - which holds the GIL, so running
+them asynchronously does not use more than one core. ``ProcessPoolParser`` creates
+the parser in each of ``max_workers`` processes and sends every document to one of them.
+
+The contents of large documents are handed to the workers through shared memory instead
+of being pickled and sent through a pipe.
+"""
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Literal
+
+import pathway as pw
+
+logger = logging.getLogger(__name__)
+
+# parser and event loop of a worker process, set by `_init_worker`
+_worker_parser: pw.UDF | None = None
+_worker_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _import_parser(parser: type[pw.UDF] | str) -> type[pw.UDF]:
+    if isinstance(parser, str):
+        module_name, _, class_name = parser.rpartition(".")
+        return getattr(importlib.import_module(module_name), class_name)
+    return parser
+
+
+def _init_worker(parser: type[pw.UDF] | str, parser_kwargs: dict) -> None:
+    global _worker_parser, _worker_loop
+    _worker_parser = _import_parser(parser)(**parser_kwargs)
+    _worker_loop = asyncio.new_event_loop()
+
+
+def _parse_in_worker(
+    contents: bytes | tuple[str, int], kwargs: dict
+) -> list[tuple[str, dict]]:
+    assert _worker_parser is not None and _worker_loop is not None
+    if isinstance(contents, tuple):
+        name, size = contents
+        shared_memory = SharedMemory(name=name)
+        try:
+            contents = bytes(shared_memory.buf[:size])
+        finally:
+            shared_memory.close()
+
+    result = _worker_parser.__wrapped__(contents, **kwargs)
+    if asyncio.iscoroutine(result):
+        # e.g. DoclingParser, which may also call a vision LLM
+        result = _worker_loop.run_until_complete(result)
+    return result
+
+
+class ProcessPoolParser(pw.UDF):
+    """
+    Runs a parser in a bounded pool of worker processes.
+
+    The parser is created in every worker from its class and ``parser_kwargs``, so the
+    arguments must be picklable, and models are loaded by the workers only. The workers
+    are started with the first document and live as long as the pipeline.
+
+    Args:
+        parser: class of the parser or its import path, e.g.
+            ``"pathway.xpacks.llm.parsers.DoclingParser"``.
+        parser_kwargs: arguments of the parser.
+        max_workers: number of worker processes. Defaults to the number of CPUs.
+        shared_memory_threshold: size in bytes from which the contents of a document are
+            handed to the worker through shared memory.
+        cache_strategy: caching of the parse results.
+        async_mode: Mode of execution for the UDF, either ``"batch_async"`` or
+            ``"fully_async"``. Default is ``"batch_async"``.
+    """
+
+    def __init__(
+        self,
+        parser: type[pw.UDF] | str,
+        parser_kwargs: dict = {},
+        max_workers: int | None = None,
+        shared_memory_threshold: int = 1 << 20,
+        cache_strategy: pw.udfs.CacheStrategy | None = None,
+        *,
+        async_mode: Literal["batch_async", "fully_async"] = "batch_async",
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        if async_mode == "fully_async":
+            executor = pw.udfs.fully_async_executor(capacity=self.max_workers)
+        else:
+            executor = pw.udfs.async_executor(capacity=self.max_workers)
+        super().__init__(executor=executor, cache_strategy=cache_strategy)
+        self.parser = parser
+        self.parser_kwargs = dict(parser_kwargs)
+        self.shared_memory_threshold = shared_memory_threshold
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # not forked, as the engine runs many threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.parser, self.parser_kwargs),
+            )
+            logger.info(
+                "Started %d parser processes for %s", self.max_workers, self.parser
+            )
+        return self._pool
+
+    async def __wrapped__(self, contents: bytes, **kwargs) -> list[tuple[str, dict]]:
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        if (
+            not isinstance(contents, bytes)
+            or len(contents) < self.shared_memory_threshold
+        ):
+            return await loop.run_in_executor(pool, _parse_in_worker, contents, kwargs)
+
+        shared_memory = SharedMemory(create=True, size=len(contents))
+        try:
+            shared_memory.buf[: len(contents)] = contents
+            return await loop.run_in_executor(
+                pool,
+                _parse_in_worker,
+                (shared_memory.name, len(contents)),
+                kwargs,
+            )
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
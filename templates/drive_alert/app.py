@@ -32,6 +32,7 @@ import os
 
 import dotenv
 import pathway as pw
+from parser_pool import ProcessPoolParser
 from pathway.stdlib.ml.index import KNNIndex
 from pathway.xpacks.llm.embedders import OpenAIEmbedder
 from pathway.xpacks.llm.llms import OpenAIChat, prompt_chat_single_qa
@@ -141,6 +142,7 @@ def run(
     service_user_credentials_file=os.environ.get(
         "GOOGLE_CREDS", "templates/drive_alert/secrets.json"
     ),
+    parser_processes: int = int(os.environ.get("PARSER_PROCESSES", "0")),
     **kwargs,
 ):
     # Part I: Build index
@@ -165,7 +167,11 @@ def run(
         service_user_credentials_file=service_user_credentials_file,
         refresh_interval=30,  # interval between fetch operations in seconds, lower this for more responsiveness
     )
-    parser = UnstructuredParser()
+    if parser_processes > 0:
+        # parse the documents in parallel, in a pool of worker processes
+        parser = ProcessPoolParser(UnstructuredParser, max_workers=parser_processes)
+    else:
+        parser = UnstructuredParser()
     documents = files.select(texts=parser(pw.this.data))
     documents = documents.flatten(pw.this.texts)
     documents = documents.select(texts=pw.this.texts[0])
@@ -0,0 +1,119 @@
+"""
+Capacity planning of the usearch index.
+
+The usearch index starts with room for ``reserved_space`` vectors and has to be resized
+whenever it fills up, which stalls the updates and causes spikes of memory usage.
+``PlannedUsearchKnnFactory`` sizes the index up front from a quick scan of the local
+sources, leaving room for the corpus to grow, and reports how full the index is.
+"""
+
+import functools
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+
+import metrics
+import pathway as pw
+from pathway.stdlib.indexing.data_index import InnerIndex
+from pathway.stdlib.indexing.nearest_neighbors import UsearchKnnFactory
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def estimate_chunks(paths: tuple[str, ...], bytes_per_chunk: int) -> int:
+    """
+    Estimates the number of chunks of the files under ``paths``, from their total size,
+    counting at least one chunk per file. Paths which do not exist are skipped.
+    """
+    files = 0
+    total_size = 0
+    for path in paths:
+        if os.path.isfile(path):
+            files += 1
+            total_size += os.path.getsize(path)
+            continue
+        for root, _, names in os.walk(path):
+            for name in names:
+                try:
+                    total_size += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    continue
+                files += 1
+    return max(files, math.ceil(total_size / bytes_per_chunk))
+
+
+@dataclass(kw_only=True)
+class PlannedUsearchKnnFactory(UsearchKnnFactory):
+    """
+    ``UsearchKnnFactory`` which reserves space for the chunks of the local sources.
+
+    The reserved space is the estimated number of chunks of ``source_paths`` multiplied
+    by ``growth_factor``, but not less than ``reserved_space``. The capacity and the fill
+    ratio of the index are reported to the metrics, and a warning is logged when the index
+    is about to outgrow the reserved space.
+
+    Args:
+        source_paths: local files and directories read by the sources, e.g. ``["data"]``.
+            Other sources, e.g. Google Drive, cannot be scanned, so set ``reserved_space``
+            for them directly.
+        bytes_per_chunk: average size of the source files per chunk, used to estimate the
+            number of chunks.
+        growth_factor: room left for the corpus to grow, as a multiple of its current
+            estimated number of chunks.
+        kwargs: arguments of ``UsearchKnnFactory``.
+    """
+
+    source_paths: list[str] = field(default_factory=list)
+    bytes_per_chunk: int = 4096
+    growth_factor: float = 2.0
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.source_paths:
+            # cached, as wrapping factories copy this one with `dataclasses.replace`
+            estimated_chunks = estimate_chunks(
+                tuple(self.source_paths), self.bytes_per_chunk
+            )
+            self.reserved_space = max(
+                self.reserved_space, math.ceil(estimated_chunks * self.growth_factor)
+            )
+            logger.info(
+                "Reserved space for %d vectors in the index, about %d chunks found in %s",
+                self.reserved_space,
+                estimated_chunks,
+                ", ".join(self.source_paths),
+            )
+
+    def build_inner_index(
+        self,
+        data_column: pw.ColumnReference,
+        metadata_column: pw.ColumnExpression | None = None,
+    ) -> InnerIndex:
+        self._observe_fill(data_column.table)
+        return super().build_inner_index(data_column, metadata_column)
+
+    def _observe_fill(self, table: pw.Table) -> None:
+        reserved_space = self.reserved_space
+        metrics.REGISTRY.set_gauge("pathway_index_reserved_space", reserved_space)
+        vectors = 0
+        warned_at = 0.0
+
+        def on_change(key, row, time, is_addition):
+            nonlocal vectors, warned_at
+            vectors += 1 if is_addition else -1
+            fill_ratio = vectors / reserved_space
+            metrics.REGISTRY.set_gauge("pathway_index_fill_ratio", fill_ratio)
+            for threshold in (0.9, 1.0):
+                if warned_at < threshold <= fill_ratio:
+                    warned_at = threshold
+                    logger.warning(
+                        "The index holds %d vectors, %d%% of the space reserved for it, "
+                        "beyond which it is resized as it grows. Increase "
+                        "`reserved_space` or `growth_factor` to avoid resizing.",
+                        vectors,
+                        round(fill_ratio * 100),
+                    )
+
+        pw.io.subscribe(table.select(), on_change=on_change)
@@ -0,0 +1,209 @@
+"""
+Per-stage metrics of the template, exposed in the Prometheus text format.
+
+Stages are instrumented in ``app.yaml`` by wrapping a UDF with ``!metrics.instrument``,
+the HTTP endpoints and the document store are observed by the ``App`` when
+``metrics_port`` is set. Metrics are then served on ``http://<host>:<metrics_port>/metrics``.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pathway as pw
+from aiohttp import web
+from pathway.xpacks.llm.document_store import DocumentStore
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class StageMetrics:
+    """Thread-safe registry of per-stage counters, latency histograms and gauges."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._calls: dict[str, int] = {}
+        self._errors: dict[str, int] = {}
+        self._rows: dict[str, int] = {}
+        self._in_flight: dict[str, int] = {}
+        self._latency_buckets: dict[str, list[int]] = {}
+        self._latency_sum: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+
+    @contextmanager
+    def track(self, stage: str, rows: int = 1) -> Iterator[None]:
+        """Measures the latency of the wrapped block and counts it as a call of ``stage``."""
+        with self._lock:
+            self._in_flight[stage] = self._in_flight.get(stage, 0) + 1
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        except asyncio.CancelledError:
+            # the caller gave up on the call, which did not fail
+            failed = False
+            raise
+        finally:
+            self._observe(stage, time.perf_counter() - start, rows, failed)
+
+    def _observe(self, stage: str, seconds: float, rows: int, failed: bool) -> None:
+        with self._lock:
+            self._in_flight[stage] -= 1
+            self._calls[stage] = self._calls.get(stage, 0) + 1
+            self._rows[stage] = self._rows.get(stage, 0) + rows
+            if failed:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+            buckets = self._latency_buckets.setdefault(stage, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self._latency_sum[stage] = self._latency_sum.get(stage, 0.0) + seconds
+
+    def count_rows(self, stage: str, rows: int) -> None:
+        """Counts rows processed by a stage which cannot be timed, e.g. index inserts."""
+        with self._lock:
+            self._rows[stage] = self._rows.get(stage, 0) + rows
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self._gauges[name] = value
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# TYPE pathway_stage_calls_total counter",
+                *_samples("pathway_stage_calls_total", self._calls),
+                "# TYPE pathway_stage_errors_total counter",
+                *_samples("pathway_stage_errors_total", self._errors),
+                "# TYPE pathway_stage_rows_total counter",
+                *_samples("pathway_stage_rows_total", self._rows),
+                "# TYPE pathway_stage_in_flight gauge",
+                *_samples("pathway_stage_in_flight", self._in_flight),
+                "# TYPE pathway_stage_latency_seconds histogram",
+            ]
+            for stage, buckets in sorted(self._latency_buckets.items()):
+                for bound, count in zip(self.buckets, buckets):
+                    lines.append(
+                        f'pathway_stage_latency_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}'
+                    )
+                lines += [
+                    f'pathway_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {self._calls[stage]}',
+                    f'pathway_stage_latency_seconds_sum{{stage="{stage}"}} {self._latency_sum[stage]}',
+                    f'pathway_stage_latency_seconds_count{{stage="{stage}"}} {self._calls[stage]}',
+                ]
+            for name, value in sorted(self._gauges.items()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+def _samples(name: str, values: dict[str, int]) -> list[str]:
+    return [
+        f'{name}{{stage="{stage}"}} {value}' for stage, value in sorted(values.items())
+    ]
+
+
+REGISTRY = StageMetrics()
+
+
+def _batch_size(args: tuple) -> int:
+    # batched UDFs (e.g. embedders) receive a list of values per argument
+    if args and isinstance(args[0], list):
+        return len(args[0])
+    return 1
+
+
+def instrument(udf: pw.UDF, stage: str) -> pw.UDF:
+    """
+    Records latency, calls and errors of every invocation of ``udf`` under ``stage``.
+
+    The UDF is modified in place, so the wrapped object keeps its type, and only
+    the actual work is measured - results served from the ``cache_strategy``
+    are not counted.
+
+    Args:
+        udf: UDF to be instrumented, e.g. a parser, a splitter, an embedder or an LLM.
+        stage: name of the stage reported in the ``stage`` label.
+    """
+    wrapped = udf.__wrapped__
+
+    if inspect.iscoroutinefunction(wrapped):
+
+        @functools.wraps(wrapped)
+        async def timed(*args, **kwargs):
+            with REGISTRY.track(stage, _batch_size(args)):
+                return await wrapped(*args, **kwargs)
+
+    else:
+
+        @functools.wraps(wrapped)
+        def timed(*args, **kwargs):
+            with REGISTRY.track(stage, _batch_size(args)):
+                return wrapped(*args, **kwargs)
+
+    udf.__wrapped__ = timed
+    udf.func = udf._wrap_function()
+    return udf
+
+
+def observe_webserver(webserver: pw.io.http.PathwayWebserver) -> None:
+    """Records the latency of every HTTP request with its route as the stage name."""
+
+    @web.middleware
+    async def track_request(request: web.Request, handler):
+        with REGISTRY.track(request.path):
+            return await handler(request)
+
+    webserver._app.middlewares.append(track_request)
+
+
+def observe_document_store(document_store: DocumentStore) -> None:
+    """Reports the number of pending and indexed documents and the index inserts."""
+    documents = {True: 0, False: 0}
+    chunks = 0
+
+    def on_progress_change(key, row, time, is_addition):
+        documents[row["is_parsed"]] += 1 if is_addition else -1
+        REGISTRY.set_gauge("pathway_documents_indexed", documents[True])
+        REGISTRY.set_gauge("pathway_documents_pending", documents[False])
+
+    def on_chunk_change(key, row, time, is_addition):
+        nonlocal chunks
+        chunks += 1 if is_addition else -1
+        if is_addition:
+            REGISTRY.count_rows("index", 1)
+        REGISTRY.set_gauge("pathway_index_chunks", chunks)
+
+    pw.io.subscribe(document_store.progress_table, on_change=on_progress_change)
+    pw.io.subscribe(document_store.chunked_docs, on_change=on_chunk_change)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Serves the metrics on a side port in a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info("Serving pipeline metrics on http://%s:%d/metrics", host, port)
+    return server
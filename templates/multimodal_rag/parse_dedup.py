@@ -0,0 +1,163 @@
+"""
+Content-addressed deduplication of the parser calls.
+
+A document copied, renamed or moved in the sources is a new row for the ``DocumentStore``,
+so it would be parsed again from scratch. ``deduplicate`` keys the parser calls by the
+SHA-256 of the document contents, so a document with the same bytes as one parsed before,
+or being parsed right now, reuses its result whatever its path or metadata.
+
+Unlike ``pw.udfs.DefaultCache``, which works only with persistence enabled, the results are
+kept in memory, and identical documents arriving together are parsed only once.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import logging
+import threading
+from collections import OrderedDict
+
+import metrics
+import pathway as pw
+
+logger = logging.getLogger(__name__)
+
+
+class ContentDeduplicator:
+    """
+    Thread-safe store of parse results looked up by the hash of the parsed contents.
+
+    Args:
+        max_entries: number of results kept, the least recently used ones are evicted first.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.parses = 0
+        self.saved_parses = 0
+        self._lock = threading.Lock()
+        self._results: OrderedDict[str, list] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._in_flight_sync: dict[str, threading.Event] = {}
+
+    @staticmethod
+    def key(contents: bytes | str, kwargs: dict) -> str:
+        if isinstance(contents, str):
+            contents = contents.encode()
+        digest = hashlib.sha256(contents)
+        if kwargs:
+            digest.update(repr(sorted(kwargs.items())).encode())
+        return digest.hexdigest()
+
+    def _lookup(self, key: str) -> list | None:
+        # called with the lock held
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def _store(self, key: str, result: list) -> None:
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    def _count_saved(self, key: str) -> None:
+        # called with the lock held
+        self.saved_parses += 1
+        metrics.REGISTRY.count_rows("parse_deduplicated", 1)
+        logger.info(
+            "Reused the parse of identical contents (sha256 %s), %d parses saved so far",
+            key[:12],
+            self.saved_parses,
+        )
+
+    async def parse_async(self, key: str, parse) -> list:
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                self._count_saved(key)
+                return result
+            task = self._in_flight.get(key)
+            if task is None:
+                self.parses += 1
+                task = asyncio.ensure_future(parse())
+                self._in_flight[key] = task
+                task.add_done_callback(functools.partial(self._finish, key))
+            else:
+                self._count_saved(key)
+        # a cancelled row must not cancel the parse awaited by the other ones
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self._store(key, task.result())
+
+    def parse_sync(self, key: str, parse) -> list:
+        while True:
+            with self._lock:
+                result = self._lookup(key)
+                if result is not None:
+                    self._count_saved(key)
+                    return result
+                event = self._in_flight_sync.get(key)
+                if event is None:
+                    self.parses += 1
+                    event = self._in_flight_sync[key] = threading.Event()
+                    break
+            # the result is stored when the parse succeeds, otherwise parse it here
+            event.wait()
+
+        try:
+            result = parse()
+            self._store(key, result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight_sync[key]
+            event.set()
+
+
+def deduplicate(
+    udf: pw.UDF,
+    max_entries: int = 1000,
+    deduplicator: ContentDeduplicator | None = None,
+) -> pw.UDF:
+    """
+    Reuses the result of ``udf`` for contents identical to the ones it already parsed.
+
+    The UDF is modified in place, so the wrapped object keeps its type. Every saved parse
+    is logged and reported to the metrics as the ``parse_deduplicated`` stage.
+
+    Args:
+        udf: parser taking the contents of a document as the first argument.
+        max_entries: maximal number of parse results kept in memory.
+        deduplicator: store of the parse results, with the number of parses done in
+            ``parses`` and saved in ``saved_parses``. Defaults to a new one.
+    """
+    if deduplicator is None:
+        deduplicator = ContentDeduplicator(max_entries)
+    wrapped = udf.__wrapped__
+
+    if inspect.iscoroutinefunction(wrapped):
+
+        @functools.wraps(wrapped)
+        async def deduplicated(contents, **kwargs):
+            key = deduplicator.key(contents, kwargs)
+            return await deduplicator.parse_async(
+                key, lambda: wrapped(contents, **kwargs)
+            )
+
+    else:
+
+        @functools.wraps(wrapped)
+        def deduplicated(contents, **kwargs):
+            key = deduplicator.key(contents, kwargs)
+            return deduplicator.parse_sync(key, lambda: wrapped(contents, **kwargs))
+
+    udf.__wrapped__ = deduplicated
+    udf.func = udf._wrap_function()
+    return udf
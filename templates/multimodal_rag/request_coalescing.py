@@ -0,0 +1,57 @@
+"""
+Single-flight coalescing of identical concurrent requests to the REST endpoints.
+
+When the same payload is sent to an endpoint while an earlier request with this payload
+is still being answered, the new request does not start another computation (e.g. a
+retrieval and an LLM call), but waits for the answer of the earlier one. Nothing is kept
+once the answer is returned, so later requests are computed again.
+"""
+
+import asyncio
+import functools
+from collections.abc import Awaitable, Callable
+from typing import ParamSpec, TypeVar
+
+import pathway as pw
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class SingleFlight(pw.udfs.CacheStrategy):
+    """
+    Request "cache" sharing the result of a computation between all requests with
+    the same payload sent while it is in progress.
+
+    Pass it as ``cache_strategy`` to ``pw.io.http.rest_connector``, or to one of
+    the servers from ``pw.xpacks.llm.servers``, which forward it to each endpoint.
+    The in-flight requests are tracked separately for every endpoint.
+    """
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.coalesced = 0
+
+    def wrap_async(self, func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+        in_flight: dict[tuple, asyncio.Future[T]] = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            # the rest connector passes the payload as JSON with sorted keys
+            key = (args, tuple(sorted(kwargs.items())))
+            self.requests += 1
+            task = in_flight.get(key)
+            if task is None:
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                in_flight[key] = task
+                task.add_done_callback(lambda _: in_flight.pop(key, None))
+            else:
+                self.coalesced += 1
+            # a disconnected client must not cancel the answer of the others
+            return await asyncio.shield(task)
+
+        return wrapper
+
+    def wrap_sync(self, func: Callable[P, T]) -> Callable[P, T]:
+        # synchronous calls cannot overlap within the event loop of the webserver
+        return func
@@ -0,0 +1,140 @@
+"""
+CPU inference of Sentence-Transformers models with ONNX Runtime.
+
+On machines without a GPU, ``SentenceTransformerEmbedder`` runs the model with PyTorch,
+and embedding takes most of the indexing time. ``OnnxSentenceTransformerEmbedder`` runs
+the same model with ONNX Runtime, optionally with its weights dynamically quantized to
+int8 for the instruction set of the CPU. The quantized model is exported once and kept
+in ``cache_dir``. Texts are embedded in batches of similar lengths, so that short texts
+are not padded to the length of the longest one, and the batches are limited by their
+total length rather than their number of texts.
+"""
+
+import logging
+import os
+from typing import Literal
+
+import numpy as np
+from pathway.xpacks.llm.embedders import SentenceTransformerEmbedder
+
+logger = logging.getLogger(__name__)
+
+Quantization = Literal["arm64", "avx2", "avx512", "avx512_vnni"]
+
+
+def _quantized_model(
+    model: str, quantization: Quantization | None, cache_dir: str
+) -> tuple[str, str | None]:
+    """
+    Returns the path of the model to load and the name of its ONNX file, exporting the
+    quantized model to ``cache_dir`` if it is not there yet.
+    """
+    if quantization is None:
+        return model, None
+    from sentence_transformers import (
+        SentenceTransformer,
+        export_dynamic_quantized_onnx_model,
+    )
+
+    path = os.path.join(cache_dir, model.replace("/", "--"))
+    file_name = f"onnx/model_qint8_{quantization}.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        logger.info("Exporting %s quantized for %s to %s", model, quantization, path)
+        float_model = SentenceTransformer(model, device="cpu", backend="onnx")
+        float_model.save(path)
+        export_dynamic_quantized_onnx_model(float_model, quantization, path)
+    return path, file_name
+
+
+class OnnxSentenceTransformerEmbedder(SentenceTransformerEmbedder):
+    """
+    ``SentenceTransformerEmbedder`` running the model with ONNX Runtime on the CPU.
+
+    It needs the ONNX extra of Sentence-Transformers,
+    ``pip install "sentence-transformers[onnx]"``.
+
+    Args:
+        model: model name or path.
+        quantization: instruction set for which the weights are quantized to int8, one
+            of ``"arm64"``, ``"avx2"``, ``"avx512"`` and ``"avx512_vnni"``, or ``None``
+            to run the model in float32.
+        num_threads: number of threads used by ONNX Runtime. Defaults to the number of
+            cores.
+        max_batch_characters: maximum total length of the texts of a batch, counted as
+            the number of texts times the length of the longest of them.
+        max_batch_texts: maximum number of texts of a batch.
+        cache_dir: directory of the exported quantized models.
+        call_kwargs: kwargs passed to each call of ``encode``.
+        batch_size: maximum number of texts sent to the embedder at once, which are then
+            split into batches of similar lengths.
+        sentencetransformer_kwargs: kwargs of ``SentenceTransformer``.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        quantization: Quantization | None = "avx2",
+        num_threads: int | None = None,
+        max_batch_characters: int = 64_000,
+        max_batch_texts: int = 64,
+        cache_dir: str = "onnx-models",
+        call_kwargs: dict = {},
+        batch_size: int = 1024,
+        **sentencetransformer_kwargs,
+    ):
+        import onnxruntime
+
+        path, file_name = _quantized_model(model, quantization, cache_dir)
+        session_options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            session_options.intra_op_num_threads = num_threads
+        model_kwargs = {
+            "provider": "CPUExecutionProvider",
+            "session_options": session_options,
+            **sentencetransformer_kwargs.pop("model_kwargs", {}),
+        }
+        if file_name is not None:
+            model_kwargs["file_name"] = file_name
+        super().__init__(
+            path,
+            call_kwargs=call_kwargs,
+            device="cpu",
+            batch_size=batch_size,
+            backend="onnx",
+            model_kwargs=model_kwargs,
+            **sentencetransformer_kwargs,
+        )
+        self.max_batch_characters = max_batch_characters
+        self.max_batch_texts = max_batch_texts
+
+    def _length_batches(self, input: list[str]) -> list[list[int]]:
+        """Groups the indices of the texts into batches of similar lengths."""
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        for i in sorted(range(len(input)), key=lambda i: len(input[i])):
+            # sorted by length, so the new text is the longest of the batch
+            if batch and (
+                len(batch) == self.max_batch_texts
+                or (len(batch) + 1) * len(input[i]) > self.max_batch_characters
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __wrapped__(self, input: list[str], **kwargs) -> list[np.ndarray]:
+        # a single text, e.g. from `BaseEmbedder.get_embedding_dimension`, is encoded
+        # into a single vector by the base class
+        if kwargs or isinstance(input, str):
+            return super().__wrapped__(input, **kwargs)
+        result: list = [None] * len(input)
+        for batch in self._length_batches(input):
+            embeddings = self.model.encode(
+                [input[i] for i in batch], **{**self.kwargs, "batch_size": len(batch)}
+            )
+            for i, embedding in zip(batch, embeddings):
+                result[i] = embedding
+        return result
@@ -0,0 +1,269 @@
+"""
+Statistics and self-tuning of adaptive RAG.
+
+``n_starting_documents``, ``factor`` and ``max_iterations`` of adaptive RAG are usually
+guessed. When most questions need more documents than the first iteration gets, every
+question pays for LLM calls which end with no answer, and when most are answered with
+fewer documents, every question pays for needless prompt tokens.
+``SelfTuningAdaptiveRAGQuestionAnswerer`` records how many iterations each question
+needed and how many tokens each LLM call used, and can pick the number of documents of
+the first iteration which minimizes the expected cost on the recent questions.
+"""
+
+import functools
+import logging
+import random
+import threading
+from collections import Counter, deque
+
+import metrics
+import pathway as pw
+from speculative_rag import SpeculativeAdaptiveRAGQuestionAnswerer
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def _encoding(encoding_name: str):
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+class IterationStats:
+    """
+    Thread-safe statistics of the questions answered with adaptive RAG.
+
+    Args:
+        window: number of the most recent questions whose outcome is kept for tuning.
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.unanswered = 0
+        self.iterations = 0
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.answered_with: Counter[int] = Counter()
+        # number of documents of the first iteration and of the answering one, if any
+        self.outcomes: deque[tuple[int, int | None]] = deque(maxlen=window)
+        # sums for the least squares fit of the prompt tokens to the number of documents
+        self._fit = [0.0] * 5
+
+    def record_call(self, documents: int, prompt_tokens: int) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            for i, value in enumerate(
+                (
+                    1,
+                    documents,
+                    prompt_tokens,
+                    documents * documents,
+                    documents * prompt_tokens,
+                )
+            ):
+                self._fit[i] += value
+
+    def record_completion(self, completion_tokens: int) -> None:
+        with self._lock:
+            self.completion_tokens += completion_tokens
+
+    def record_question(
+        self, first_documents: int, answered_documents: int | None, iterations: int
+    ) -> None:
+        with self._lock:
+            self.questions += 1
+            self.iterations += iterations
+            if answered_documents is None:
+                self.unanswered += 1
+            else:
+                self.answered_with[answered_documents] += 1
+            self.outcomes.append((first_documents, answered_documents))
+
+    def prompt_tokens_model(self) -> tuple[float, float]:
+        """
+        Returns the prompt tokens of an LLM call without documents and per document,
+        fitted to the recorded calls.
+        """
+        with self._lock:
+            n, documents, tokens, documents_squared, products = self._fit
+        if n == 0:
+            return 0.0, 0.0
+        variance = n * documents_squared - documents * documents
+        if variance <= 0:
+            return 0.0, tokens / documents if documents else 0.0
+        per_document = max((n * products - documents * tokens) / variance, 0.0)
+        return max((tokens - per_document * documents) / n, 0.0), per_document
+
+    def summary(self) -> dict:
+        with self._lock:
+            questions = max(self.questions, 1)
+            return {
+                "questions": self.questions,
+                "llm_calls": self.calls,
+                "iterations_per_question": self.iterations / questions,
+                "unanswered_ratio": self.unanswered / questions,
+                "prompt_tokens_per_question": self.prompt_tokens / questions,
+                "completion_tokens_per_question": self.completion_tokens / questions,
+                "answered_with_documents": dict(sorted(self.answered_with.items())),
+            }
+
+
+class SelfTuningAdaptiveRAGQuestionAnswerer(SpeculativeAdaptiveRAGQuestionAnswerer):
+    """
+    ``SpeculativeAdaptiveRAGQuestionAnswerer`` which records the iterations and tokens of
+    every question, and optionally tunes the number of documents of the first iteration.
+
+    The numbers of documents of the iterations are ``n_starting_documents``, multiplied by
+    ``factor`` up to ``max_iterations`` times, and the number of retrieved documents is
+    the last of them. With ``adapt``, the first iteration may start at any of these
+    numbers, or at a smaller one, down to ``min_starting_documents``, dividing by
+    ``factor``. Every ``tune_every`` questions, the start with the lowest expected cost on
+    the last ``window`` questions is chosen. The cost of a question is its prompt tokens,
+    fitted to the recorded calls, plus ``latency_weight`` tokens per LLM call waited for.
+
+    A question answered by the first iteration tells only that fewer documents might do,
+    so with the probability ``exploration`` a question starts with the fewest documents.
+
+    The statistics are available with ``stats.summary()``, and reported to the metrics as
+    ``pathway_adaptive_rag_*`` gauges.
+
+    Args:
+        adapt: whether to tune the number of documents of the first iteration.
+        min_starting_documents: the fewest documents of the first iteration.
+        latency_weight: cost of waiting for an LLM call, in prompt tokens.
+        exploration: probability of starting a question with the fewest documents.
+        window: number of the most recent questions used for tuning.
+        tune_every: number of questions between tunings.
+        min_questions: number of questions recorded before the first tuning.
+        encoding_name: name of the ``tiktoken`` encoding used to count tokens.
+        kwargs: arguments of ``SpeculativeAdaptiveRAGQuestionAnswerer``.
+    """
+
+    def __init__(
+        self,
+        *args,
+        adapt: bool = False,
+        min_starting_documents: int = 1,
+        latency_weight: float = 1000.0,
+        exploration: float = 0.05,
+        window: int = 1000,
+        tune_every: int = 50,
+        min_questions: int = 100,
+        encoding_name: str = "cl100k_base",
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.adapt = adapt
+        self.latency_weight = latency_weight
+        self.exploration = exploration
+        self.tune_every = tune_every
+        self.min_questions = min_questions
+        self.encoding_name = encoding_name
+        self.stats = IterationStats(window)
+        self.starting_documents = self.n_starting_documents
+        self._random = random.Random()
+
+        max_documents = self.n_starting_documents * self.factor ** (
+            self.max_iterations - 1
+        )
+        ladder = {max_documents}
+        count = max_documents
+        while self.factor > 1 and count // self.factor >= min_starting_documents:
+            count //= self.factor
+            ladder.add(count)
+        ladder.add(self.n_starting_documents)
+        self._ladder = sorted(ladder)
+        metrics.REGISTRY.set_gauge(
+            "pathway_adaptive_rag_starting_documents", self.starting_documents
+        )
+
+    def _count_tokens(self, text: str) -> int:
+        return len(_encoding(self.encoding_name).encode(text, disallowed_special=()))
+
+    async def _chat(self, prompt: str, documents: int) -> str | None:
+        self.stats.record_call(documents, self._count_tokens(prompt))
+        answer = await super()._chat(prompt, documents)
+        if answer is not None:
+            self.stats.record_completion(self._count_tokens(answer))
+        return answer
+
+    def _counts_from(self, start: int, retrieved: int) -> list[int]:
+        counts: list[int] = []
+        for count in self._ladder:
+            count = min(count, retrieved)
+            if count >= min(start, retrieved) and (not counts or count != counts[-1]):
+                counts.append(count)
+        return counts
+
+    async def _answer_speculatively(
+        self, query: str, documents: list[str], prompt_udf: pw.UDF
+    ) -> tuple[str | None, list[dict]]:
+        docs = [{"text": doc} for doc in documents]
+        start = self.starting_documents
+        if self.adapt and self._random.random() < self.exploration:
+            start = self._ladder[0]
+        counts = self._counts_from(start, len(docs))
+        answer, count = await self._run_iterations(query, docs, counts, prompt_udf)
+
+        answered = count if answer is not None else None
+        iterations = counts.index(count) + 1 if answered is not None else len(counts)
+        self.stats.record_question(counts[0], answered, iterations)
+        self._report()
+        if (
+            self.adapt
+            and self.stats.questions >= self.min_questions
+            and self.stats.questions % self.tune_every == 0
+        ):
+            self._tune()
+        return answer, docs[:count]
+
+    def _expected_cost(
+        self,
+        start: int,
+        outcomes: list[tuple[int, int | None]],
+        prompt_tokens_model: tuple[float, float],
+    ) -> float:
+        overhead, per_document = prompt_tokens_model
+        iterations = [count for count in self._ladder if count >= start]
+        cost = 0.0
+        # a question answered by its first iteration is assumed to need all its documents
+        for _, answered in outcomes:
+            for count in iterations:
+                cost += overhead + per_document * count + self.latency_weight
+                if answered is not None and count >= answered:
+                    break
+        return cost / max(len(outcomes), 1)
+
+    def _tune(self) -> None:
+        prompt_tokens_model = self.stats.prompt_tokens_model()
+        outcomes = list(self.stats.outcomes)
+        costs = {
+            start: self._expected_cost(start, outcomes, prompt_tokens_model)
+            for start in self._ladder
+        }
+        best = min(costs, key=costs.__getitem__)
+        if best != self.starting_documents:
+            logger.info(
+                "Starting adaptive RAG with %d documents instead of %d, "
+                "expected cost %.0f instead of %.0f tokens per question",
+                best,
+                self.starting_documents,
+                costs[best],
+                costs[self.starting_documents],
+            )
+            self.starting_documents = best
+        metrics.REGISTRY.set_gauge("pathway_adaptive_rag_starting_documents", best)
+
+    def _report(self) -> None:
+        summary = self.stats.summary()
+        for name in (
+            "iterations_per_question",
+            "unanswered_ratio",
+            "prompt_tokens_per_question",
+            "completion_tokens_per_question",
+        ):
+            metrics.REGISTRY.set_gauge(f"pathway_adaptive_rag_{name}", summary[name])
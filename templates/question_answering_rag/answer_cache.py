@@ -0,0 +1,237 @@
+"""
+Semantic cache of answers, placed in front of the retrieval and the LLM call.
+
+Queries are embedded and compared with the queries answered before. If one of them is
+similar enough, and was asked with the same filters and model, its answer is returned
+without retrieving documents or calling the LLM. An answer is dropped from the cache as soon
+as any document it was built from is modified or removed from the ``DocumentStore``.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import pathway as pw
+from pathway.xpacks.llm.question_answering import BaseRAGQuestionAnswerer
+
+
+@dataclass
+class _Entry:
+    embedding: np.ndarray
+    filters: str | None
+    model: str | None
+    answer: pw.Json
+    file_ids: frozenset[str]
+
+
+class SemanticAnswerCache:
+    """
+    Thread-safe in-memory store of answers looked up by the cosine similarity of queries.
+
+    Args:
+        similarity_threshold: minimal cosine similarity of a stored query to reuse its answer.
+        max_entries: number of answers kept, the least recently used ones are evicted first.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 10_000):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._by_file: dict[str, set[int]] = {}
+        self._next_key = 0
+        # number of invalidations so far and the number at which each file last changed,
+        # so that answers built from a document modified in the meantime are not stored
+        self._epoch = 0
+        self._changed_at: dict[str, int] = {}
+
+    @property
+    def epoch(self) -> int:
+        return self._epoch
+
+    def lookup(
+        self, embedding: np.ndarray, filters: str | None, model: str | None
+    ) -> pw.Json | None:
+        embedding = _normalize(embedding)
+        with self._lock:
+            best_key, best_similarity = None, self.similarity_threshold
+            for key, entry in self._entries.items():
+                if entry.filters != filters or entry.model != model:
+                    continue
+                similarity = float(np.dot(entry.embedding, embedding))
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key].answer
+
+    def store(
+        self,
+        embedding: np.ndarray,
+        filters: str | None,
+        model: str | None,
+        answer: pw.Json,
+        file_ids: frozenset[str],
+        epoch: int,
+    ) -> None:
+        """Stores an answer unless one of its documents changed after ``epoch``."""
+        with self._lock:
+            if any(self._changed_at.get(file_id, -1) >= epoch for file_id in file_ids):
+                return
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = _Entry(
+                _normalize(embedding), filters, model, answer, file_ids
+            )
+            for file_id in file_ids:
+                self._by_file.setdefault(file_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._forget(*self._entries.popitem(last=False))
+
+    def invalidate(self, file_id: str) -> None:
+        """Drops all answers built from the document ``file_id``."""
+        with self._lock:
+            self._changed_at[file_id] = self._epoch
+            self._epoch += 1
+            for key in self._by_file.pop(file_id, set()):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self.invalidations += 1
+                    self._forget(key, entry)
+
+    def _forget(self, key: int, entry: _Entry) -> None:
+        for file_id in entry.file_ids:
+            self._by_file.get(file_id, set()).discard(key)
+
+
+def _normalize(embedding: np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+class SemanticCacheRAGQuestionAnswerer(BaseRAGQuestionAnswerer):
+    """
+    ``BaseRAGQuestionAnswerer`` which reuses answers of semantically similar questions.
+
+    Only the queries that miss the cache are retrieved and sent to the LLM. Answers are
+    invalidated when any of their context documents changes in the ``indexer``.
+
+    Args:
+        embedder: embedder used to compare the queries, e.g. the one used by the index.
+        similarity_threshold: minimal cosine similarity of two queries to share an answer.
+        max_cache_entries: maximal number of cached answers.
+        kwargs: arguments of ``BaseRAGQuestionAnswerer``.
+    """
+
+    def __init__(
+        self,
+        *args,
+        embedder: pw.UDF,
+        similarity_threshold: float = 0.95,
+        max_cache_entries: int = 10_000,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.embedder = embedder
+        self.cache = SemanticAnswerCache(similarity_threshold, max_cache_entries)
+
+        def on_document_change(key, row, time, is_addition):
+            self.cache.invalidate(row["file_id"])
+
+        # metadata is kept, so that a modification (e.g. of `modified_at`) is not
+        # consolidated away for a document which keeps its id
+        pw.io.subscribe(
+            self.indexer.input_docs.select(
+                pw.this.metadata, file_id=pw.this.metadata["_file_id"].as_str()
+            ),
+            on_change=on_document_change,
+        )
+
+    @pw.table_transformer
+    def answer_query(self, pw_ai_queries: pw.Table) -> pw.Table:
+        """Answer a question, reusing the answer of a similar question if there is one."""
+        cache = self.cache
+
+        @pw.udf
+        def lookup(
+            embedding: np.ndarray, filters: str | None, model: str | None
+        ) -> pw.Json | None:
+            return cache.lookup(embedding, filters, model)
+
+        @pw.udf
+        def current_epoch(prompt: str) -> int:
+            # taken before the retrieval, see `SemanticAnswerCache.store`
+            return cache.epoch
+
+        @pw.udf
+        def store(
+            embedding: np.ndarray,
+            filters: str | None,
+            model: str | None,
+            response: str | None,
+            docs: pw.Json,
+            epoch: int,
+            result: pw.Json,
+        ) -> pw.Json:
+            if response is not None:
+                context_docs = docs.as_list()
+                file_ids = frozenset(
+                    doc["metadata"]["_file_id"]
+                    for doc in context_docs
+                    if "_file_id" in doc.get("metadata", {})
+                )
+                answer = pw.Json({"response": response, "context_docs": context_docs})
+                cache.store(embedding, filters, model, answer, file_ids, epoch)
+            return result
+
+        @pw.udf
+        def cached_result(answer: pw.Json, return_context_docs: bool) -> pw.Json:
+            if return_context_docs:
+                return answer
+            return pw.Json({"response": answer["response"].as_str()})
+
+        queries = pw_ai_queries.with_columns(
+            _pw_query_embedding=self.embedder(pw.this.prompt),
+            _pw_cache_epoch=current_epoch(pw.this.prompt),
+        )
+        queries = queries.with_columns(
+            _pw_cached_answer=lookup(
+                pw.this._pw_query_embedding, pw.this.filters, pw.this.model
+            )
+        )
+
+        hits = queries.filter(pw.this._pw_cached_answer.is_not_none()).select(
+            result=cached_result(
+                pw.unwrap(pw.this._pw_cached_answer), pw.this.return_context_docs
+            )
+        )
+
+        misses = queries.filter(pw.this._pw_cached_answer.is_none()).without(
+            pw.this._pw_cached_answer
+        )
+        answered = (
+            super()
+            .answer_query(misses)
+            .select(
+                result=store(
+                    pw.this._pw_query_embedding,
+                    pw.this.filters,
+                    pw.this.model,
+                    pw.this.response,
+                    pw.this.docs,
+                    pw.this._pw_cache_epoch,
+                    pw.this.result,
+                )
+            )
+        )
+
+        hits.promise_universes_are_disjoint(answered)
+        return hits.concat(answered)
@@ -1,9 +1,16 @@
 import logging
 from warnings import warn
 
+import document_listing
+import metrics
 import pathway as pw
+import request_coalescing
+import streaming
 from dotenv import load_dotenv
-from pathway.xpacks.llm.question_answering import SummaryQuestionAnswerer
+from pathway.xpacks.llm.question_answering import (
+    BaseRAGQuestionAnswerer,
+    SummaryQuestionAnswerer,
+)
 from pathway.xpacks.llm.servers import QASummaryRestServer
 from pydantic import BaseModel, ConfigDict, InstanceOf
 
@@ -30,11 +37,32 @@ class App(BaseModel):
     persistence_backend: pw.persistence.Backend | None = None
     persistence_mode: pw.PersistenceMode | None = pw.PersistenceMode.UDF_CACHING
     terminate_on_error: bool = False
+    metrics_port: int | None = None
+    coalesce_requests: bool = True
 
     def run(self) -> None:
-        server = QASummaryRestServer(  # noqa: F841
-            self.host, self.port, self.question_answerer
+        cache_strategy = (
+            request_coalescing.SingleFlight() if self.coalesce_requests else None
+        )
+        server = QASummaryRestServer(
+            self.host, self.port, self.question_answerer, cache_strategy=cache_strategy
         )
+        listing = document_listing.DocumentListing()
+        listing.observe(self.question_answerer.indexer)
+        document_listing.serve(server, listing, cache_strategy=cache_strategy)
+        if isinstance(self.question_answerer, BaseRAGQuestionAnswerer):
+            streaming.serve_streaming_answers(
+                server,
+                self.question_answerer,
+                self.host,
+                self.port,
+                cache_strategy=cache_strategy,
+            )
+
+        if self.metrics_port is not None:
+            metrics.observe_webserver(server.webserver)
+            metrics.observe_document_store(self.question_answerer.indexer)
+            metrics.start_metrics_server(self.host, self.metrics_port)
 
         if self.persistence_mode is None:
             if self.with_cache is True:
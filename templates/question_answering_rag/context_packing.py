@@ -0,0 +1,128 @@
+"""
+Packing of the retrieved chunks into a token budget.
+
+``BaseRAGQuestionAnswerer`` puts all ``search_topk`` retrieved chunks into the prompt,
+however long they are. Chunks of similar documents often repeat the same text, e.g.
+headers, footers and disclaimers, or each other. ``TokenBudgetContextProcessor`` drops
+the repeated lines and the chunks mostly made of text already in the context. It then
+adds the chunks, the most relevant first, as long as they fit in ``max_tokens``.
+"""
+
+import functools
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+
+from pathway.xpacks.llm import Doc
+from pathway.xpacks.llm.question_answering import SimpleContextProcessor
+
+_WORD = re.compile(r"\w+")
+
+
+@functools.cache
+def _encoding(encoding_name: str):
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def _relevance(doc: dict) -> float:
+    """Reranker score if the chunk was reranked, otherwise the negated distance."""
+    if "reranker_score" in doc:
+        return doc["reranker_score"]
+    return -doc.get("dist", 0.0)
+
+
+@dataclass
+class TokenBudgetContextProcessor(SimpleContextProcessor):
+    """
+    Context processor which fits the most relevant chunks into ``max_tokens`` tokens.
+
+    The chunks are ordered by their reranker score, or by their distance to the query.
+    A line already in the context is dropped from the later chunks if it is at least
+    ``min_line_length`` characters long. A chunk is dropped as a near-duplicate when at
+    least ``duplicate_threshold`` of its word ``shingle_size``-grams are already in the
+    context. The remaining chunks are added as long as they fit, and the first chunk is
+    truncated if it does not fit on its own.
+
+    Args:
+        max_tokens: token budget of the context.
+        encoding_name: name of the ``tiktoken`` encoding used to count tokens, the one of
+            the splitter and the LLM.
+        duplicate_threshold: share of the shingles of a chunk found in the context above
+            which the chunk is dropped.
+        shingle_size: number of words in a shingle.
+        min_line_length: length of the shortest lines dropped when repeated.
+        context_metadata_keys: metadata fields kept in the context.
+        context_joiner: separator of the chunks.
+    """
+
+    max_tokens: int = 2000
+    encoding_name: str = "cl100k_base"
+    duplicate_threshold: float = 0.9
+    shingle_size: int = 5
+    min_line_length: int = 20
+
+    def _count_tokens(self, text: str) -> int:
+        return len(_encoding(self.encoding_name).encode(text, disallowed_special=()))
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        encoding = _encoding(self.encoding_name)
+        return encoding.decode(
+            encoding.encode(text, disallowed_special=())[: max(max_tokens, 0)]
+        )
+
+    def _shingles(self, text: str) -> set[int]:
+        words = _WORD.findall(text.lower())
+        if not words:
+            return set()
+        size = min(self.shingle_size, len(words))
+        return {hash(tuple(words[i : i + size])) for i in range(len(words) - size + 1)}
+
+    def pack(self, docs: list[dict] | list[Doc]) -> list[dict]:
+        """Returns the chunks to put into the context, with the repeated lines removed."""
+        ordered = sorted(docs, key=_relevance, reverse=True)
+        seen_lines: set[bytes] = set()
+        seen_shingles: set[int] = set()
+        packed: list[dict] = []
+        budget = self.max_tokens
+        for doc in ordered:
+            lines = []
+            digests: set[bytes] = set()
+            for line in doc["text"].splitlines():
+                normalized = " ".join(line.split()).lower()
+                if len(normalized) >= self.min_line_length:
+                    digest = hashlib.blake2b(
+                        normalized.encode(), digest_size=8
+                    ).digest()
+                    if digest in seen_lines or digest in digests:
+                        continue
+                    digests.add(digest)
+                lines.append(line)
+            text = "\n".join(lines).strip()
+            shingles = self._shingles(text)
+            if not shingles or (
+                len(shingles & seen_shingles)
+                >= self.duplicate_threshold * len(shingles)
+            ):
+                continue
+
+            [simplified] = self.simplify_context_metadata([{**doc, "text": text}])
+            tokens = self._count_tokens(json.dumps(simplified, ensure_ascii=False))
+            if packed:
+                tokens += self._count_tokens(self.context_joiner)
+            if tokens > budget:
+                if packed:
+                    continue
+                overflow = tokens - budget
+                text = self._truncate(text, self._count_tokens(text) - overflow)
+                tokens = budget
+            packed.append({**doc, "text": text})
+            seen_lines |= digests
+            seen_shingles |= shingles
+            budget -= tokens
+        return packed
+
+    def docs_to_context(self, docs: list[dict] | list[Doc]) -> str:
+        return super().docs_to_context(self.pack(docs))
@@ -0,0 +1,297 @@
+"""
+Paginated and incremental listing of the documents.
+
+``/v2/list_documents`` replies with the metadata of every document, so a UI refreshing
+the list downloads the whole corpus each time. ``DocumentListing`` keeps the metadata and
+indexing status of the documents with the version of their last change, and
+``/v2/list_documents/changes`` serves them in pages, with only the requested
+``metadata_keys``. Every reply carries a change token. Sent back as ``since``, it gets only the
+documents changed since then and the ids of the ones deleted, so a refresh costs as
+much as the changes rather than the corpus.
+"""
+
+import bisect
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+
+import jmespath
+import pathway as pw
+from pathway.stdlib.ml.classifiers._knn_lsh import _glob_options
+from pathway.xpacks.llm.document_store import DocumentStore, IndexingStatus
+from pathway.xpacks.llm.servers import BaseRestServer
+
+logger = logging.getLogger(__name__)
+
+
+class ListDocumentsQuerySchema(pw.Schema):
+    metadata_filter: str | None = pw.column_definition(default_value=None)
+    filepath_globpattern: str | None = pw.column_definition(default_value=None)
+    metadata_keys: pw.Json | None = pw.column_definition(default_value=None)
+    return_status: bool = pw.column_definition(default_value=False)
+    limit: int = pw.column_definition(default_value=1000)
+    cursor: str | None = pw.column_definition(default_value=None)
+    since: str | None = pw.column_definition(default_value=None)
+
+
+class DocumentListing:
+    """
+    Metadata of the documents of a ``DocumentStore``, in the order of their changes.
+
+    Every change of a document, i.e. its addition, a change of its metadata or indexing
+    status, or its deletion, gets the next version number and is appended to a log.
+    A listing returns the documents whose last change is newer than ``since``, in the
+    order of the log. Deletions are remembered for the ``max_deleted`` most recently
+    deleted documents, and a listing since an older version starts over from scratch.
+
+    Args:
+        max_deleted: number of deleted documents remembered for the incremental listings.
+    """
+
+    def __init__(self, max_deleted: int = 10000):
+        self.max_deleted = max_deleted
+        self._lock = threading.Lock()
+        # tokens of another run of the app are not valid
+        self._epoch = uuid.uuid4().hex[:8]
+        self._version = 0
+        # versions up to this one may have lost their deletions
+        self._forgotten = 0
+        self._documents: dict[str, tuple[int, dict, bool]] = {}
+        self._deleted: OrderedDict[str, int] = OrderedDict()
+        self._log: list[tuple[int, str]] = []
+
+    def observe(self, document_store: DocumentStore) -> None:
+        """Keeps the listing up to date with the ``progress_table`` of the store."""
+        changes: dict[str, tuple[dict, bool] | None] = {}
+
+        def on_change(key, row, time, is_addition):
+            metadata = row["metadata"].as_dict()
+            id = metadata.pop("_file_id")
+            # an update removes the previous row and adds the new one, in any order
+            if is_addition:
+                changes[id] = (metadata, row["is_parsed"])
+            else:
+                changes.setdefault(id, None)
+
+        def on_time_end(time):
+            with self._lock:
+                for id, change in changes.items():
+                    if change is None:
+                        self._delete(id)
+                    else:
+                        self._update(id, *change)
+                self._compact()
+            changes.clear()
+
+        pw.io.subscribe(
+            document_store.progress_table,
+            on_change=on_change,
+            on_time_end=on_time_end,
+        )
+
+    def _update(self, id: str, metadata: dict, is_parsed: bool) -> None:
+        current = self._documents.get(id)
+        if current is not None and current[1:] == (metadata, is_parsed):
+            return
+        self._version += 1
+        self._documents[id] = (self._version, metadata, is_parsed)
+        self._deleted.pop(id, None)
+        self._log.append((self._version, id))
+
+    def _delete(self, id: str) -> None:
+        if self._documents.pop(id, None) is None:
+            return
+        self._version += 1
+        self._deleted[id] = self._version
+        self._log.append((self._version, id))
+        while len(self._deleted) > self.max_deleted:
+            _, version = self._deleted.popitem(last=False)
+            self._forgotten = version
+
+    def _current_version(self, id: str) -> int | None:
+        if id in self._documents:
+            return self._documents[id][0]
+        return self._deleted.get(id)
+
+    def _compact(self) -> None:
+        # entries of documents changed again since are skipped, drop them once they
+        # make up half of the log
+        if len(self._log) > 2 * (len(self._documents) + len(self._deleted)) + 1000:
+            self._log = [
+                (version, id)
+                for version, id in self._log
+                if self._current_version(id) == version
+            ]
+
+    def _token(self, version: int) -> str:
+        return f"{self._epoch}.{version}"
+
+    def _parse_cursor(self, cursor: str | None) -> tuple[int, int, bool] | None:
+        """Token version, position and mode of a cursor of this run of the app."""
+        if cursor is None:
+            return None
+        parts = cursor.split(".")
+        if len(parts) != 4 or parts[0] != self._epoch:
+            return None
+        if not all(part.isdigit() for part in parts[1:]):
+            return None
+        return int(parts[1]), int(parts[2]), parts[3] == "1"
+
+    def _parse_version(self, token: str | None) -> int | None:
+        """Version of a token of this run of the app, ``None`` for other tokens."""
+        if token is None:
+            return None
+        epoch, _, version = token.partition(".")
+        if epoch != self._epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def list(
+        self,
+        metadata_filter: str | None = None,
+        keys: list[str] | None = None,
+        return_status: bool = False,
+        limit: int = 1000,
+        cursor: str | None = None,
+        since: str | None = None,
+    ) -> dict:
+        """
+        Returns a page of the listing.
+
+        Without ``since``, the page holds the documents matching ``metadata_filter``.
+        With ``since``, a token returned before, it holds the documents changed since
+        then, and ``deleted`` holds the ids of the documents deleted or no longer
+        matching the filter. ``full`` tells whether the listing is complete rather than
+        the changes, e.g. because ``since`` was too old, so that the client has to
+        replace what it has. ``next_cursor`` gets the next page, if any. ``token`` is
+        the version the listing is up to date with once all its pages are read.
+        A malformed ``metadata_filter`` or a ``limit`` below 1 gets only an ``error``.
+
+        Args:
+            metadata_filter: JMESPath filter of the listed documents.
+            keys: metadata keys included in the documents, all of them if ``None``.
+                Every document also has its ``_id``.
+            return_status: whether to include the ``_indexing_status`` of the documents.
+            limit: maximum number of documents and deleted ids of the page, at least 1.
+            cursor: ``next_cursor`` of the previous page.
+            since: ``token`` of a previous listing.
+        """
+        if limit < 1:
+            # an empty page would keep the cursor in place and the client would loop
+            return {"error": f"invalid limit: {limit}, must be at least 1"}
+        try:
+            expression = jmespath.compile(metadata_filter) if metadata_filter else None
+        except jmespath.exceptions.JMESPathError as e:
+            # a malformed filter of one client must not stop the pipeline
+            return {"error": f"invalid metadata_filter: {e}"}
+        with self._lock:
+            state = self._parse_cursor(cursor)
+            if state is None or (not state[2] and state[1] < self._forgotten):
+                since_version = self._parse_version(since)
+                full = since_version is None or since_version < self._forgotten
+                position = 0 if full or since_version is None else since_version
+                # changes made while the pages are read are also in the next listing
+                token_version = self._version
+            else:
+                token_version, position, full = state
+            documents: list[dict] = []
+            deleted: list[str] = []
+            next_cursor = None
+            index = bisect.bisect_right(self._log, position, key=lambda entry: entry[0])
+            for version, id in self._log[index:]:
+                if self._current_version(id) != version:
+                    continue
+                if len(documents) + len(deleted) >= limit:
+                    next_cursor = (
+                        f"{self._epoch}.{token_version}.{position}.{int(full)}"
+                    )
+                    break
+                position = version
+                document = self._documents.get(id)
+                if document is not None and _matches(expression, document[1]):
+                    documents.append(
+                        _project(id, document[1], document[2], keys, return_status)
+                    )
+                elif not full:
+                    deleted.append(id)
+            token = self._token(token_version)
+        return {
+            "documents": documents,
+            "deleted": deleted,
+            "full": full,
+            "next_cursor": next_cursor,
+            "token": token,
+        }
+
+
+def _matches(expression, metadata: dict) -> bool:
+    if expression is None:
+        return True
+    try:
+        return expression.search(metadata, options=_glob_options) is True
+    except jmespath.exceptions.JMESPathError:
+        return False
+
+
+def _project(
+    id: str,
+    metadata: dict,
+    is_parsed: bool,
+    keys: list[str] | None,
+    return_status: bool,
+) -> dict:
+    document = {"_id": id}
+    if return_status:
+        document["_indexing_status"] = (
+            IndexingStatus.INDEXED if is_parsed else IndexingStatus.INGESTED
+        )
+    if keys is None:
+        document.update(metadata)
+    else:
+        document.update((key, metadata[key]) for key in keys if key in metadata)
+    return document
+
+
+def serve(
+    server: BaseRestServer,
+    listing: DocumentListing,
+    route: str = "/v2/list_documents/changes",
+    **rest_kwargs,
+) -> None:
+    """Serves the pages of ``listing`` at ``route``, see ``DocumentListing.list``."""
+
+    @pw.udf
+    def list_page(
+        metadata_filter: str | None,
+        metadata_keys: pw.Json | None,
+        return_status: bool,
+        limit: int,
+        cursor: str | None,
+        since: str | None,
+    ) -> pw.Json:
+        return pw.Json(
+            listing.list(
+                metadata_filter,
+                metadata_keys.as_list() if metadata_keys is not None else None,
+                return_status,
+                limit,
+                cursor,
+                since,
+            )
+        )
+
+    def list_documents_query(queries: pw.Table) -> pw.Table:
+        queries = DocumentStore.merge_filters(queries)
+        return queries.select(
+            result=list_page(
+                pw.this.metadata_filter,
+                pw.this.metadata_keys,
+                pw.this.return_status,
+                pw.this.limit,
+                pw.this.cursor,
+                pw.this.since,
+            )
+        )
+
+    server.serve(route, ListDocumentsQuerySchema, list_documents_query, **rest_kwargs)
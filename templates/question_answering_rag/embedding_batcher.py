@@ -0,0 +1,225 @@
+"""
+Micro-batching of the embedder calls made while indexing documents.
+
+Pathway already passes all chunks of one minibatch to a batched embedder at once. When
+documents are parsed with a fully asynchronous parser, each of them is emitted in its own
+minibatch, so a large folder ends up as one embedding request per document. The
+``BatchingRetrieverFactory`` collects the chunks arriving within ``max_wait_ms`` and embeds
+them together in requests of up to ``max_batch_size`` texts.
+"""
+
+import asyncio
+import dataclasses
+from dataclasses import dataclass
+
+import numpy as np
+import pathway as pw
+from pathway.stdlib.indexing.data_index import DataIndex, InnerIndex
+from pathway.stdlib.indexing.nearest_neighbors import KnnIndexFactory
+from pathway.stdlib.indexing.retrievers import AbstractRetrieverFactory
+
+
+class BatchingEmbedder(pw.UDF):
+    """
+    Fully asynchronous UDF embedding a single text, which waits for other texts to send
+    them to ``embedder`` in one call.
+
+    A batch is sent when it has ``max_batch_size`` texts or ``max_wait_ms`` after its
+    first text arrived, whichever comes first.
+
+    Args:
+        embedder: embedder doing the actual work. If it is batched (has ``max_batch_size``
+            set), it gets the list of texts, otherwise the texts are embedded concurrently.
+            It is called with its executor, so e.g. its ``capacity`` and retries apply,
+            and with its ``cache_strategy``, keyed on the whole batch if it is batched.
+        max_batch_size: maximal number of texts in one call of ``embedder``.
+        max_wait_ms: maximal time a text waits for the batch to fill up.
+        max_concurrent_batches: number of batches embedded at the same time. Defaults
+            to None, indicating no limit other than the ``capacity`` of ``embedder``.
+        cache_strategy: caching of the embeddings of single texts.
+    """
+
+    def __init__(
+        self,
+        embedder: pw.UDF,
+        *,
+        max_batch_size: int = 128,
+        max_wait_ms: int = 50,
+        max_concurrent_batches: int | None = None,
+        cache_strategy: pw.udfs.CacheStrategy | None = None,
+    ):
+        super().__init__(
+            # frequent commits, so that the index does not hold back the queries
+            executor=pw.udfs.fully_async_executor(autocommit_duration_ms=10),
+            cache_strategy=cache_strategy,
+        )
+        self.embedder = embedder
+        self.batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_concurrent_batches = max_concurrent_batches
+        self.batches = 0
+        self.embedded_texts = 0
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def __wrapped__(self, text: str) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+        self._pending.append((text, result))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await result
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._embed_batch(batch))
+
+    async def _embed_batch(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        if self._semaphore is None and self.max_concurrent_batches is not None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+        texts = [text for text, _ in batch]
+        try:
+            if self._semaphore is not None:
+                async with self._semaphore:
+                    embeddings = await self._embed(texts)
+            else:
+                embeddings = await self._embed(texts)
+        except Exception as e:
+            for _, result in batch:
+                if not result.done():
+                    result.set_exception(e)
+            return
+
+        self.batches += 1
+        self.embedded_texts += len(texts)
+        for (_, result), embedding in zip(batch, embeddings):
+            if not result.done():
+                result.set_result(embedding)
+
+    async def _embed(self, texts: list[str]) -> list[np.ndarray]:
+        # `func` is `__wrapped__` with the executor and the cache of the embedder
+        embed = self.embedder.func
+        if self.embedder.max_batch_size is None:
+            return await asyncio.gather(*(_call(embed, text) for text in texts))
+        return await _call(embed, texts)
+
+
+async def _call(func, *args):
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args)
+    # e.g. SentenceTransformerEmbedder, run outside of the event loop
+    return await asyncio.to_thread(func, *args)
+
+
+@dataclass(frozen=True, kw_only=True)
+class _QueryEmbeddingIndex(InnerIndex):
+    """Index over precomputed embeddings, which embeds the queries with ``embedder``."""
+
+    inner_index: InnerIndex
+    embedder: pw.UDF
+
+    def _embed_queries(self, query_column: pw.ColumnReference) -> pw.ColumnReference:
+        queries = query_column.table.with_columns(
+            _pw_query_embedding=self.embedder(query_column)
+        )
+        return queries._pw_query_embedding
+
+    def query(
+        self,
+        query_column: pw.ColumnReference,
+        *,
+        number_of_matches: pw.ColumnExpression | int = 3,
+        metadata_filter: pw.ColumnExpression | None = None,
+    ) -> pw.Table:
+        return self.inner_index.query(
+            self._embed_queries(query_column),
+            number_of_matches=number_of_matches,
+            metadata_filter=metadata_filter,
+        )
+
+    def query_as_of_now(
+        self,
+        query_column: pw.ColumnReference,
+        *,
+        number_of_matches: pw.ColumnExpression | int = 3,
+        metadata_filter: pw.ColumnExpression | None = None,
+    ) -> pw.Table:
+        return self.inner_index.query_as_of_now(
+            self._embed_queries(query_column),
+            number_of_matches=number_of_matches,
+            metadata_filter=metadata_filter,
+        )
+
+
+@dataclass(kw_only=True)
+class BatchingRetrieverFactory(AbstractRetrieverFactory):
+    """
+    Wraps a KNN retriever factory, so that the indexed texts are embedded in batches.
+
+    The queries are embedded with the embedder of ``retriever_factory`` as before.
+
+    Args:
+        retriever_factory: factory of the index, e.g. ``UsearchKnnFactory``, with
+            the ``embedder`` set.
+        max_batch_size: maximal number of texts in one embedding request.
+        max_wait_ms: maximal time a text waits for the batch to fill up.
+        max_concurrent_batches: number of embedding requests sent at the same time.
+            Defaults to None, indicating no specific limit.
+        cache_strategy: caching of the embeddings of the indexed texts.
+    """
+
+    retriever_factory: KnnIndexFactory
+    max_batch_size: int = 128
+    max_wait_ms: int = 50
+    max_concurrent_batches: int | None = None
+    cache_strategy: pw.udfs.CacheStrategy | None = None
+
+    def build_index(
+        self,
+        data_column: pw.ColumnReference,
+        data_table: pw.Table,
+        metadata_column: pw.ColumnExpression | None = None,
+    ) -> DataIndex:
+        embedder = self.retriever_factory.embedder
+        if embedder is None:
+            raise ValueError(
+                "`retriever_factory` of `BatchingRetrieverFactory` needs an `embedder`."
+            )
+        batching_embedder = BatchingEmbedder(
+            embedder,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait_ms,
+            max_concurrent_batches=self.max_concurrent_batches,
+            cache_strategy=self.cache_strategy,
+        )
+
+        embedded = data_table.select(
+            _pw_embedding=batching_embedder(data_column), _pw_metadata=metadata_column
+        ).await_futures()
+
+        # dimensions were already computed by the factory from its embedder
+        factory = dataclasses.replace(
+            self.retriever_factory,
+            embedder=None,
+            dimensions=self.retriever_factory.dimensions,
+        )
+        inner_index = factory.build_inner_index(
+            embedded._pw_embedding,
+            embedded._pw_metadata if metadata_column is not None else None,
+        )
+        return DataIndex(
+            data_table,
+            _QueryEmbeddingIndex(
+                data_column=inner_index.data_column,
+                metadata_column=inner_index.metadata_column,
+                inner_index=inner_index,
+                embedder=embedder,
+            ),
+        )
@@ -0,0 +1,140 @@
+"""
+Page-level incremental parsing of PDFs.
+
+A modified file is parsed again as a whole, even if only one of its pages changed.
+``PagewiseParser`` splits PDFs into single pages, keys them by the hash of the page, and
+sends only the pages it has not seen before to the wrapped parser. Unchanged pages reuse
+their previous results, so they are also split into the same chunks as before, whose
+embeddings are then served from the cache of the embedder.
+"""
+
+import asyncio
+import hashlib
+import inspect
+import io
+import logging
+import threading
+from collections import OrderedDict
+from typing import Literal
+
+import metrics
+import pathway as pw
+
+logger = logging.getLogger(__name__)
+
+
+def split_pages(contents: bytes) -> list[bytes]:
+    """Splits a PDF into single-page PDFs, which are the same for identical pages."""
+    from pypdf import PdfReader, PdfWriter
+
+    pages = []
+    for page in PdfReader(io.BytesIO(contents)).pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages.append(buffer.getvalue())
+    return pages
+
+
+class PagewiseParser(pw.UDF):
+    """
+    Parses each page of a PDF separately, reusing the results of pages parsed before.
+
+    Each page of the result has its number, starting from 1, in the ``pages`` metadata
+    field. Other documents, as well as single-page PDFs, are passed to ``parser`` as they
+    are. Note that elements spanning pages, e.g. tables, are parsed as separate parts.
+
+    Args:
+        parser: parser of the pages, e.g. ``DoclingParser``.
+        max_cached_pages: number of parsed pages kept in memory, the least recently
+            used ones are evicted first.
+        max_concurrent_pages: number of pages parsed at the same time, in all documents.
+        cache_strategy: caching of the results for whole documents.
+        async_mode: Mode of execution for the UDF, either ``"batch_async"`` or
+            ``"fully_async"``. Default is ``"batch_async"``.
+    """
+
+    def __init__(
+        self,
+        parser: pw.UDF,
+        max_cached_pages: int = 10_000,
+        max_concurrent_pages: int = 8,
+        cache_strategy: pw.udfs.CacheStrategy | None = None,
+        *,
+        async_mode: Literal["batch_async", "fully_async"] = "batch_async",
+    ):
+        if async_mode == "fully_async":
+            executor = pw.udfs.fully_async_executor()
+        else:
+            executor = pw.udfs.async_executor()
+        super().__init__(executor=executor, cache_strategy=cache_strategy)
+        self.parser = parser
+        self.max_cached_pages = max_cached_pages
+        self.max_concurrent_pages = max_concurrent_pages
+        self.parsed_pages = 0
+        self.reused_pages = 0
+        self._lock = threading.Lock()
+        self._pages: OrderedDict[str, list[tuple[str, dict]]] = OrderedDict()
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def _parse(self, contents: bytes, kwargs: dict) -> list[tuple[str, dict]]:
+        # through `func`, to keep the executor, e.g. its capacity and retries, and the
+        # cache of the parser
+        parse = self.parser.func
+        if inspect.iscoroutinefunction(parse):
+            return await parse(contents, **kwargs)
+        result = await asyncio.to_thread(parse, contents, **kwargs)
+        # the function of an asynchronous UDF, wrapped e.g. by `metrics.instrument`,
+        # returns an awaitable
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _parse_page(self, page: bytes, kwargs: dict) -> list[tuple[str, dict]]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_pages)
+        async with self._semaphore:
+            return await self._parse(page, kwargs)
+
+    async def __wrapped__(self, contents: bytes, **kwargs) -> list[tuple[str, dict]]:
+        if not isinstance(contents, bytes) or not contents.startswith(b"%PDF-"):
+            return await self._parse(contents, kwargs)
+        try:
+            pages = await asyncio.to_thread(split_pages, contents)
+        except Exception:
+            logger.warning("Could not split a PDF into pages, parsing it as a whole")
+            return await self._parse(contents, kwargs)
+        if len(pages) <= 1:
+            return await self._parse(contents, kwargs)
+
+        keys = [hashlib.sha256(page).hexdigest() for page in pages]
+        with self._lock:
+            results = {key: self._pages.get(key) for key in keys}
+        changed = {key: page for key, page in zip(keys, pages) if results[key] is None}
+        parsed = await asyncio.gather(
+            *(self._parse_page(page, kwargs) for page in changed.values())
+        )
+
+        with self._lock:
+            for key, result in zip(changed, parsed):
+                results[key] = self._pages[key] = result
+            for key in keys:
+                if key in self._pages:
+                    self._pages.move_to_end(key)
+            while len(self._pages) > self.max_cached_pages:
+                self._pages.popitem(last=False)
+            self.parsed_pages += len(changed)
+            self.reused_pages += len(pages) - len(changed)
+        metrics.REGISTRY.count_rows("parse_page_reused", len(pages) - len(changed))
+        logger.info(
+            "Parsed %d of %d pages of a document, reused the results of the other ones",
+            len(changed),
+            len(pages),
+        )
+
+        docs = []
+        for page_number, key in enumerate(keys, start=1):
+            for text, metadata in results[key] or []:
+                docs.append((text, metadata | {"pages": [page_number]}))
+        return docs
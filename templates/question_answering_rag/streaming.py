@@ -0,0 +1,184 @@
+"""
+Streaming answers of the RAG as server-sent events.
+
+The ``/v2/answer`` endpoint replies once the whole LLM completion is ready. The
+``/v2/answer/stream`` endpoint added here takes the same payload, but sends the retrieved
+context documents as soon as they are known and then the tokens of the answer as the LLM
+produces them. The retrieval, reranking and prompt building are done by the Pathway
+pipeline, served on ``/v2/answer/context``, so that both endpoints build the same prompt.
+
+The stream consists of the following events, each with a JSON object as ``data``:
+
+- ``context``: ``{"context_docs": [...]}``, the documents used as the context;
+- ``token``: ``{"text": "..."}``, the next part of the answer;
+- ``done``: ``{"response": "..."}``, the complete answer, sent last;
+- ``error``: ``{"error": "..."}``, sent instead of ``done`` if the answer failed.
+
+Tokens are streamed for ``OpenAIChat``. Other LLMs are called as usual and their whole
+answer is sent as a single ``token`` event.
+"""
+
+import asyncio
+import json
+import logging
+from collections.abc import AsyncIterator
+
+import aiohttp
+import pathway as pw
+from aiohttp import web
+from pathway.xpacks.llm import llms
+from pathway.xpacks.llm.question_answering import BaseRAGQuestionAnswerer
+from pathway.xpacks.llm.servers import BaseRestServer
+
+logger = logging.getLogger(__name__)
+
+
+@pw.udf
+def _prepared_context(docs: pw.Json, rag_prompt: str) -> pw.Json:
+    return pw.Json({"context_docs": docs, "rag_prompt": rag_prompt})
+
+
+def prepare_context(
+    question_answerer: BaseRAGQuestionAnswerer, pw_ai_queries: pw.Table
+) -> pw.Table:
+    """Retrieves the context documents of the queries and builds the prompts for the LLM."""
+    qa = question_answerer
+    pw_ai_results = pw_ai_queries + qa.indexer.retrieve_query(
+        pw_ai_queries.select(
+            metadata_filter=pw.this.filters,
+            filepath_globpattern=pw.cast(str | None, None),
+            query=pw.this.prompt,
+            k=qa.search_topk,
+        )
+    ).select(
+        docs=pw.this.result,
+    )
+
+    if qa.reranker is not None:
+        pw_ai_results = qa._apply_reranking(pw_ai_results)
+
+    pw_ai_results += pw_ai_results.select(
+        context=qa.docs_to_context_transformer(pw.this.docs)
+    )
+    pw_ai_results += pw_ai_results.select(
+        rag_prompt=qa.prompt_udf(pw.this.context, pw.this.prompt)
+    )
+    return pw_ai_results.select(
+        result=_prepared_context(pw.this.docs, pw.this.rag_prompt)
+    )
+
+
+async def stream_completion(
+    llm: pw.UDF, messages: list[dict], model: str | None = None
+) -> AsyncIterator[str]:
+    """Yields the answer of ``llm`` in parts, as soon as they are generated."""
+    kwargs = {} if model is None else {"model": model}
+
+    if not isinstance(llm, llms.OpenAIChat):
+        if asyncio.iscoroutinefunction(llm.__wrapped__):
+            response = await llm.__wrapped__(messages, **kwargs)
+        else:
+            response = await asyncio.to_thread(llm.__wrapped__, messages, **kwargs)
+        if response:
+            yield response
+        return
+
+    import openai
+
+    # a client of its own, as the one of the LLM belongs to the event loop of the UDFs
+    client = openai.AsyncOpenAI(
+        api_key=llm.client.api_key, base_url=llm.client.base_url, max_retries=0
+    )
+    kwargs = {**llm.kwargs, **kwargs}
+    kwargs.pop("verbose", None)
+    try:
+        stream = await llm.retry_strategy.invoke(
+            client.chat.completions.create, messages=messages, stream=True, **kwargs
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await client.close()
+
+
+def _event(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def serve_streaming_answers(
+    server: BaseRestServer,
+    question_answerer: BaseRAGQuestionAnswerer,
+    host: str,
+    port: int,
+    route: str = "/v2/answer/stream",
+    context_route: str = "/v2/answer/context",
+    **rest_kwargs,
+) -> None:
+    """
+    Adds the streaming answer endpoint, and the endpoint it gets the context from,
+    to ``server``.
+
+    Args:
+        server: server of ``question_answerer``, e.g. ``QASummaryRestServer``.
+        question_answerer: RAG answering the questions.
+        host: host the server listens on, used to reach ``context_route``.
+        port: port the server listens on.
+        route: route of the streaming endpoint.
+        context_route: route of the endpoint returning the context documents and the
+            prompt built from them.
+        rest_kwargs: optional kwargs passed to ``pw.io.http.rest_connector`` of
+            ``context_route``.
+    """
+    server.serve(
+        context_route,
+        question_answerer.AnswerQuerySchema,
+        lambda queries: prepare_context(question_answerer, queries),
+        **rest_kwargs,
+    )
+
+    loopback_host = "127.0.0.1" if host in ("0.0.0.0", "", "::") else host
+    context_url = f"http://{loopback_host}:{port}{context_route}"
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        try:
+            payload = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest(reason="the payload is not a valid JSON")
+        if not isinstance(payload, dict) or not isinstance(payload.get("prompt"), str):
+            raise web.HTTPBadRequest(reason="`prompt` is required")
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"}
+        )
+        await response.prepare(request)
+
+        answer = ""
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(context_url, json=payload) as context_response:
+                    context_response.raise_for_status()
+                    context = await context_response.json()
+            await response.write(
+                _event("context", {"context_docs": context["context_docs"]})
+            )
+
+            # the same message as built with `llms.prompt_chat_single_qa` in `/v2/answer`
+            messages = [{"role": "user", "content": context["rag_prompt"]}]
+            async for token in stream_completion(
+                question_answerer.llm, messages, payload.get("model")
+            ):
+                answer += token
+                await response.write(_event("token", {"text": token}))
+        except ConnectionResetError:
+            # the client went away, there is nobody to send the answer to
+            return response
+        except Exception as e:
+            logger.exception("Error while streaming the answer")
+            await response.write(_event("error", {"error": str(e)}))
+        else:
+            await response.write(_event("done", {"response": answer}))
+        await response.write_eof()
+        return response
+
+    server.webserver._add_endpoint_to_app("POST", route, handle)
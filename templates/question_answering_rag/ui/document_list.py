@@ -0,0 +1,38 @@
+# Copyright © 2026 Pathway
+
+from streaming_client import StreamingRAGClient
+
+
+class DocumentList:
+    """
+    Copy of the list of documents of the app, kept up to date with the changes.
+
+    The first ``refresh`` lists all documents, and the next ones only get the documents
+    changed since the previous one.
+
+    Args:
+        filters: Optional metadata filter for the documents.
+        keys: List of metadata keys kept for each document.
+    """
+
+    def __init__(self, filters: str | None = None, keys: list[str] | None = ["path"]):
+        self.filters = filters
+        self.keys = keys
+        self.token: str | None = None
+        self.documents: dict[str, dict] = {}
+
+    def refresh(self, conn: StreamingRAGClient) -> int:
+        """Applies the changes since the last refresh and returns their number."""
+        documents, deleted, full, self.token = conn.list_document_changes(
+            since=self.token, filters=self.filters, keys=self.keys, return_status=True
+        )
+        if full:
+            self.documents = {}
+        for document_id in deleted:
+            self.documents.pop(document_id, None)
+        for document in documents:
+            self.documents[document["_id"]] = document
+        return len(documents) + len(deleted)
+
+    def metadata_list(self) -> list[dict]:
+        return list(self.documents.values())
@@ -0,0 +1,136 @@
+# Copyright © 2026 Pathway
+
+import json
+from collections.abc import Iterator
+
+import requests
+from pathway.xpacks.llm.question_answering import RAGClient, send_post_request
+
+
+class StreamingRAGClient(RAGClient):
+    """
+    ``RAGClient`` which can also consume the ``/v2/answer/stream`` and
+    ``/v2/list_documents/changes`` endpoints of the question answering template.
+    """
+
+    def list_documents_page(
+        self,
+        filters: str | None = None,
+        keys: list[str] | None = ["path"],
+        return_status: bool = True,
+        limit: int = 1000,
+        cursor: str | None = None,
+        since: str | None = None,
+    ) -> dict:
+        """
+        Return a page of the documents, or of the changes since a previous listing.
+
+        The reply has the ``documents``, each with its ``_id`` and the metadata
+        ``keys``, the ``deleted`` ids, ``full`` telling whether it lists all documents
+        rather than the changes, ``next_cursor`` for the next page, if any, and the
+        ``token`` to pass as ``since`` to get the changes made after this listing.
+
+        Args:
+            filters: Optional metadata filter for the documents.
+            keys: List of metadata keys to be included in the response.
+                Defaults to ``["path"]``. Setting to ``None`` will retrieve all available metadata.
+            return_status: Whether to include the ``_indexing_status`` of the documents.
+            limit: Maximum number of documents and deleted ids in the page.
+            cursor: ``next_cursor`` of the previous page.
+            since: ``token`` of a previous listing, to get only the changes since then.
+        """
+        api_url = f"{self.url}/v2/list_documents/changes"
+        payload: dict = {
+            "return_status": return_status,
+            "limit": limit,
+            "metadata_keys": keys,
+        }
+
+        if filters:
+            payload["metadata_filter"] = filters
+
+        if cursor:
+            payload["cursor"] = cursor
+
+        if since:
+            payload["since"] = since
+
+        return send_post_request(
+            api_url, payload, self.additional_headers, self.timeout
+        )
+
+    def list_document_changes(
+        self, since: str | None = None, **kwargs
+    ) -> tuple[list[dict], list[str], bool, str]:
+        """
+        Return the documents changed since ``since``, reading all the pages.
+
+        Returns the changed documents, the ids of the deleted ones, whether the listing
+        is complete rather than the changes, and the token of the listing.
+        Without ``since`` all documents are listed. The other arguments are the ones of
+        ``list_documents_page``.
+        """
+        documents: list[dict] = []
+        deleted: list[str] = []
+        full: bool | None = None
+        cursor = None
+        while True:
+            page = self.list_documents_page(cursor=cursor, since=since, **kwargs)
+            if "error" in page:
+                raise ValueError(page["error"])
+            if full is None:
+                full = page["full"]
+            elif page["full"] and not full:
+                # the server started the listing over, e.g. after a restart
+                documents, deleted, full = [], [], True
+            documents.extend(page["documents"])
+            deleted.extend(page["deleted"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return documents, deleted, full, page["token"]
+
+    def answer_stream(
+        self,
+        prompt: str,
+        filters: str | None = None,
+        model: str | None = None,
+    ) -> Iterator[tuple[str, dict]]:
+        """
+        Return RAG answer based on a given prompt as a stream of ``(event, data)`` pairs.
+
+        The first event is ``"context"`` with the ``context_docs`` used by the LLM,
+        followed by ``"token"`` events with the consecutive parts of the answer in ``text``.
+        The stream ends with ``"done"`` with the whole ``response``, or with ``"error"``.
+
+        Args:
+            prompt: Question to be asked.
+            filters: Optional metadata filter for the documents. Defaults to ``None``, which
+                means there will be no filter.
+            model: Optional LLM model. If ``None``, app default will be used by the server.
+        """
+        api_url = f"{self.url}/v2/answer/stream"
+        payload: dict = {"prompt": prompt}
+
+        if filters:
+            payload["filters"] = filters
+
+        if model:
+            payload["model"] = model
+
+        with requests.post(
+            api_url,
+            json=payload,
+            headers=self.additional_headers,
+            timeout=self.timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            event, data = "message", ""
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:") :].strip()
+                elif line.startswith("data:"):
+                    data += line[len("data:") :].strip()
+                elif not line and data:
+                    yield event, json.loads(data)
+                    event, data = "message", ""
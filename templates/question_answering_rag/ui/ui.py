@@ -4,9 +4,10 @@ import logging
 import os
 
 import streamlit as st
+from document_list import DocumentList
 from dotenv import load_dotenv
 from pathway.xpacks.llm.document_store import IndexingStatus
-from pathway.xpacks.llm.question_answering import RAGClient
+from streaming_client import StreamingRAGClient
 
 load_dotenv()
 
@@ -27,7 +28,7 @@ logging.basicConfig(
 logger = logging.getLogger("streamlit")
 logger.setLevel(logging.INFO)
 
-conn = RAGClient(url=f"http://{PATHWAY_HOST}:{PATHWAY_PORT}")
+conn = StreamingRAGClient(url=f"http://{PATHWAY_HOST}:{PATHWAY_PORT}")
 
 note = """
 <H4><b>Ask a question"""
@@ -95,11 +96,17 @@ def get_ingested_files(metadata_list: list[dict], opt_key: str) -> list:
     return list(options)
 
 
-logger.info("Requesting list_documents...")
-document_meta_list = conn.list_documents(keys=[])
-logger.info("Received response list_documents")
+# only the documents changed since the previous run of the script are requested
+if "document_list" not in st.session_state:
+    st.session_state["document_list"] = DocumentList(keys=["path"])
 
-st.session_state["document_meta_list"] = document_meta_list
+logger.info("Requesting document changes...")
+changes = st.session_state["document_list"].refresh(conn)
+logger.info(f"Received {changes} document changes")
+
+st.session_state["document_meta_list"] = st.session_state[
+    "document_list"
+].metadata_list()
 
 indexed_files = get_indexed_files(st.session_state["document_meta_list"], "path")
 ingested_files = get_ingested_files(st.session_state["document_meta_list"], "path")
@@ -184,10 +191,21 @@ if question:
         }
     )
 
-    with st.spinner("Retrieving response..."):
-        api_response = conn.answer(question, return_context_docs=True)
-        response = api_response["response"]
-        context_docs = api_response["context_docs"]
+    st.markdown(f"**Answering question:** {question}")
+
+    context_docs: list[dict] = []
+
+    def stream_response():
+        # the context arrives first, then the answer is shown as it is generated
+        for event, data in conn.answer_stream(question):
+            if event == "context":
+                context_docs.extend(data["context_docs"])
+            elif event == "token":
+                yield data["text"]
+            elif event == "error":
+                raise RuntimeError(data["error"])
+
+    response = st.write_stream(stream_response())
 
     logger.info(
         {
@@ -197,10 +215,6 @@ if question:
         }
     )
 
-    logger.info(type(response))
-
-    st.markdown(f"**Answering question:** {question}")
-    st.markdown(f"""{response}""")
     with st.expander(label="Context documents"):
         st.markdown("Documents sent to LLM as context:\n")
         for i, doc in enumerate(context_docs):
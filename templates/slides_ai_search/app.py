@@ -14,8 +14,20 @@ import pathway as pw
 from dotenv import load_dotenv
 from pathway.xpacks import llm
 from pathway.xpacks.llm.document_store import SlidesDocumentStore
-from pathway_slides_ai_search import DeckRetrieverWithFileSave, add_slide_id, get_model
-from pydantic import BaseModel, ConfigDict, FilePath, InstanceOf
+from pathway_slides_ai_search import (
+    BlobStore,
+    DeckRetrieverWithFileSave,
+    FileWriter,
+    SlideThumbnails,
+    add_slide_id,
+    facets,
+    get_model,
+    metrics,
+    request_coalescing,
+)
+from pathway_slides_ai_search.blob_store import externalize_images
+from pathway_slides_ai_search.slide_cache import SlideResultCache, reuse_slide_results
+from pydantic import BaseModel, ConfigDict, Field, FilePath, InstanceOf
 
 
 class App(BaseModel):
@@ -28,6 +40,15 @@ class App(BaseModel):
     retriever_factory: InstanceOf[pw.indexing.AbstractRetrieverFactory]
 
     search_topk: int = 6
+    facet_fields: list[str] | None = list(facets.DEFAULT_FIELDS)
+    file_writer: InstanceOf[FileWriter] | None = None
+    thumbnails: InstanceOf[SlideThumbnails] | None = Field(
+        default_factory=SlideThumbnails
+    )
+    blob_store: InstanceOf[BlobStore] | None = Field(default_factory=BlobStore)
+    slide_cache: InstanceOf[SlideResultCache] | None = Field(
+        default_factory=SlideResultCache
+    )
 
     details_schema: FilePath | dict[str, Any] | None = None
 
@@ -35,6 +56,8 @@ class App(BaseModel):
     persistence_backend: pw.persistence.Backend | None = None
     persistence_mode: pw.PersistenceMode | None = pw.PersistenceMode.UDF_CACHING
     terminate_on_error: bool = False
+    metrics_port: int | None = None
+    coalesce_requests: bool = True
 
     def run(self) -> None:
         if self.details_schema is not None:
@@ -46,10 +69,15 @@ class App(BaseModel):
             detail_parse_schema=detail_schema,
             run_mode="parallel",
             include_schema_in_text=False,
-            llm=self.llm,
+            llm=metrics.instrument(self.llm, "llm"),
             cache_strategy=pw.udfs.DefaultCache(),
             async_mode="fully_async",
         )
+        if self.slide_cache is not None:
+            reuse_slide_results(parser, self.slide_cache)
+        metrics.instrument(parser, "parse")
+        if self.blob_store is not None:
+            externalize_images(parser, self.blob_store)
 
         doc_store = SlidesDocumentStore(
             self.sources,
@@ -58,13 +86,41 @@ class App(BaseModel):
             parser=parser,
             doc_post_processors=[add_slide_id],
         )
+        if self.blob_store is not None:
+            self.blob_store.observe(doc_store.parsed_docs)
+
+        if self.facet_fields:
+            facet_index = facets.FacetIndex(self.facet_fields)
+            facet_index.observe(doc_store.chunked_docs)
+        else:
+            facet_index = None
 
         app = DeckRetrieverWithFileSave(
             indexer=doc_store,
             search_topk=self.search_topk,
+            facet_index=facet_index,
+            file_writer=self.file_writer,
+            thumbnails=self.thumbnails,
+            blob_store=self.blob_store,
         )
 
-        app.build_server(host=self.host, port=self.port)
+        app.build_server(
+            host=self.host,
+            port=self.port,
+            cache_strategy=(
+                request_coalescing.SingleFlight() if self.coalesce_requests else None
+            ),
+        )
+
+        if facet_index is not None:
+            assert app.server is not None
+            facets.serve(app.server, facet_index)
+
+        if self.metrics_port is not None:
+            assert app.server is not None
+            metrics.observe_webserver(app.server.webserver)
+            metrics.observe_document_store(doc_store)
+            metrics.start_metrics_server(self.host, self.metrics_port)
 
         if self.persistence_mode is None:
             if self.with_cache is True:
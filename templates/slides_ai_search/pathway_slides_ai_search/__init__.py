@@ -9,6 +9,10 @@ from typing import Any, Literal
 import pathway as pw
 import yaml
 from pathway.xpacks.llm.question_answering import DeckRetriever
+from pathway_slides_ai_search.blob_store import IMAGE_FIELD, REF_FIELD, BlobStore
+from pathway_slides_ai_search.facets import FacetIndex
+from pathway_slides_ai_search.file_writer import FileWriter, remove_temporary_files
+from pathway_slides_ai_search.thumbnails import SlideThumbnails
 from pydantic import BaseModel, Field, create_model
 
 CUSTOM_FIELDS = {"option": Literal}
@@ -94,41 +98,120 @@ class DeckRetrieverWithFileSave(DeckRetriever):
         metadata = row["data"]
         slide_id = metadata["slide_id"].value
         file_path = IMAGE_DUMP_FOLDER / slide_id
+        # an update removes the previous row and adds the new one, in any order
         if is_addition:
-            data = base64.b64decode(metadata["b64_image"].value)
-            file_path.write_bytes(data)
+            self._image_changes[file_path] = metadata.as_dict()
         else:
-            try:
-                file_path.unlink()
-                logging.info("Removed %s", file_path)
-            except Exception as e:
-                logging.info("Error removing %s: %s", file_path, e)
+            self._image_changes.setdefault(file_path, None)
 
     def dump_file_callback(self, key, row, time, is_addition):
         # save parsed files
         file_name = row["path"].value.rpartition("/")[-1]  # XXX
         file_path = FILE_DUMP_FOLDER / file_name
         if is_addition:
-            file_path.write_bytes(row["data"])
+            self._file_changes[file_path] = row["data"]
         else:
-            try:
-                file_path.unlink()
-                logging.info("Removed %s", file_path)
-            except Exception as e:
-                logging.info("Error removing %s: %s", file_path, e)
-
-    def __init__(self, *args, **kwargs):
+            self._file_changes.setdefault(file_path, None)
+
+    def dump_img_changes(self, time):
+        # written in the background, so that the dataflow does not wait for the disk
+        derive = self.thumbnails.render if self.thumbnails is not None else None
+        for file_path, metadata in self._image_changes.items():
+            if metadata is None:
+                # queued with the image, so that it is not raced by a later write
+                thumbnail_paths = (
+                    self.thumbnails.paths(file_path)
+                    if self.thumbnails is not None
+                    else []
+                )
+                self.file_writer.remove(file_path, derived=thumbnail_paths)
+            elif REF_FIELD in metadata and self.blob_store is not None:
+                source = self.blob_store.path(metadata[REF_FIELD])
+                self.file_writer.copy(file_path, source, derive=derive)
+            else:
+                self.file_writer.write_base64(
+                    file_path, metadata[IMAGE_FIELD], derive=derive
+                )
+        self._image_changes.clear()
+
+    def dump_file_changes(self, time):
+        for file_path, data in self._file_changes.items():
+            if data is None:
+                self.file_writer.remove(file_path)
+            else:
+                self.file_writer.write(file_path, data)
+        self._file_changes.clear()
+
+    def __init__(
+        self,
+        *args,
+        facet_index: FacetIndex | None = None,
+        file_writer: FileWriter | None = None,
+        thumbnails: SlideThumbnails | None = None,
+        blob_store: BlobStore | None = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
+        self.facet_index = facet_index
+        self.file_writer = file_writer if file_writer is not None else FileWriter()
+        self.thumbnails = thumbnails
+        self.blob_store = blob_store
+        self._image_changes: dict[Path, dict | None] = {}
+        self._file_changes: dict[Path, bytes | None] = {}
 
         IMAGE_DUMP_FOLDER.mkdir(parents=True, exist_ok=True)
         FILE_DUMP_FOLDER.mkdir(parents=True, exist_ok=True)
+        remove_temporary_files(IMAGE_DUMP_FOLDER)
+        remove_temporary_files(FILE_DUMP_FOLDER)
 
         chunked_docs = self.indexer.chunked_docs
         t = chunked_docs.select(
             data=pw.this.metadata,
         )
-        pw.io.subscribe(t, on_change=self.dump_img_callback)
+        pw.io.subscribe(
+            t, on_change=self.dump_img_callback, on_time_end=self.dump_img_changes
+        )
 
         docs = self.indexer.input_docs
         t = docs.select(data=docs.text, path=docs.metadata["path"])
-        pw.io.subscribe(t, on_change=self.dump_file_callback)
+        pw.io.subscribe(
+            t, on_change=self.dump_file_callback, on_time_end=self.dump_file_changes
+        )
+
+    @pw.table_transformer
+    def answer_query(self, pw_ai_queries: pw.Table) -> pw.Table:
+        """Return slides similar to the given query, filtered with the facet index."""
+        if self.facet_index is None:
+            return super().answer_query(pw_ai_queries)
+        facet_index = self.facet_index
+
+        @pw.udf
+        def plan_filter(filters: str | None) -> tuple[str | None, bool]:
+            return facet_index.plan(filters)
+
+        # a filter matching no slide is answered without searching the index
+        planned = pw_ai_queries.select(plan=plan_filter(pw.this.filters))
+        pw_ai_results = pw_ai_queries + self.indexer.retrieve_query(
+            planned.select(
+                metadata_filter=pw.this.plan[0],
+                filepath_globpattern=None,
+                query=pw_ai_queries.prompt,
+                k=pw.if_else(pw.this.plan[1], self.search_topk, 0),
+            )
+        ).select(
+            docs=pw.this.result,
+        )
+
+        @pw.udf
+        def _format_results(docs: pw.Json) -> pw.Json:
+            docs_ls = docs.as_list()
+            for docs_dc in docs_ls:
+                metadata: dict = docs_dc["metadata"]
+                for metadata_key in self.excluded_response_metadata:
+                    metadata.pop(metadata_key, None)
+                docs_dc["metadata"] = metadata
+            return pw.Json(docs_ls)
+
+        return pw_ai_results + pw_ai_results.select(
+            result=_format_results(pw.this.docs)
+        )
@@ -0,0 +1,176 @@
+"""
+Content-addressed store of the slide images.
+
+``SlideParser`` returns every slide with its whole image, base64 encoded, in the
+``b64_image`` metadata field. The metadata is kept in the tables of the document store
+and in the index, and serialized whenever the documents are listed, so a large library
+of decks takes gigabytes of memory for images which are only needed to save them to
+disk. ``externalize_images`` moves the images of the parsed slides into a ``BlobStore``
+on disk, named by the SHA-256 hash of their contents, and leaves only the ``image_ref``
+and ``image_size`` of each in the metadata. Identical slides share one file, and a file
+is removed once no slide has referred to it for a while.
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pathway as pw
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FIELD = "b64_image"
+REF_FIELD = "image_ref"
+SIZE_FIELD = "image_size"
+
+
+class BlobStore:
+    """
+    Files named by the hash of their contents.
+
+    A blob ``<sha256>.png`` is stored as ``<root>/<first two hex digits>/<sha256>.png``,
+    so that no directory holds too many files.
+
+    Args:
+        root: directory of the blobs.
+        grace_seconds: time for which a blob is kept after the last slide referring to
+            it is removed, and after it was last stored. A slide being parsed stores
+            its blob before the slide is counted as referring to it, so that a blob
+            released meanwhile by another slide is not removed under it.
+    """
+
+    def __init__(
+        self,
+        root: str | os.PathLike[str] = "storage/blobs",
+        grace_seconds: float = 60.0,
+    ):
+        self.root = Path(root)
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        self._references: dict[str, int] = {}
+        # time at which each blob no longer referred to was released
+        self._released: dict[str, float] = {}
+
+    def path(self, ref: str) -> Path:
+        """Path of the blob ``ref``."""
+        return self.root / ref[:2] / ref
+
+    def put(self, data: bytes, suffix: str = "") -> str:
+        """Stores ``data``, unless it is stored already, and returns its reference."""
+        ref = hashlib.sha256(data).hexdigest() + suffix
+        path = self.path(ref)
+        try:
+            # the modification time tells that the blob is in use again
+            os.utime(path)
+        except FileNotFoundError:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # written under a unique name and renamed, so that a reader never sees a
+            # partial blob, even if two parsers store the same slide at once
+            temporary = path.with_name(f".tmp-{uuid.uuid4().hex}-{ref}")
+            temporary.write_bytes(data)
+            os.replace(temporary, path)
+        return ref
+
+    def get(self, ref: str) -> bytes:
+        return self.path(ref).read_bytes()
+
+    def observe(self, table: pw.Table) -> None:
+        """
+        Counts the references to the blobs in the ``metadata`` column of ``table``,
+        and removes the blobs no longer referred to, with the next change of the table
+        after ``grace_seconds``.
+        """
+
+        def on_change(key, row, time, is_addition):
+            ref = row["metadata"].value.get(REF_FIELD)
+            if ref is None:
+                return
+            with self._lock:
+                count = self._references.get(ref, 0) + (1 if is_addition else -1)
+                if count > 0:
+                    self._references[ref] = count
+                    self._released.pop(ref, None)
+                else:
+                    self._references.pop(ref, None)
+                    self._released[ref] = _now()
+
+        def on_time_end(time):
+            self.collect_garbage()
+
+        pw.io.subscribe(
+            table.select(pw.this.metadata), on_change=on_change, on_time_end=on_time_end
+        )
+
+    def collect_garbage(self) -> None:
+        """Removes the blobs released and not stored for ``grace_seconds``."""
+        deadline = _now() - self.grace_seconds
+        with self._lock:
+            expired = [
+                ref
+                for ref, released_at in self._released.items()
+                if released_at < deadline
+            ]
+            for ref in expired:
+                del self._released[ref]
+                path = self.path(ref)
+                try:
+                    if path.stat().st_mtime < deadline:
+                        path.unlink()
+                except FileNotFoundError:
+                    pass
+
+
+def _now() -> float:
+    return time.time()
+
+
+def _externalize(blob_store: BlobStore, documents: list) -> list:
+    externalized = []
+    for text, metadata in documents:
+        b64_image = metadata.get(IMAGE_FIELD)
+        if b64_image is not None:
+            data = base64.b64decode(b64_image)
+            metadata = {
+                key: value for key, value in metadata.items() if key != IMAGE_FIELD
+            }
+            metadata[REF_FIELD] = blob_store.put(data, ".png")
+            metadata[SIZE_FIELD] = len(data)
+        externalized.append((text, metadata))
+    return externalized
+
+
+def externalize_images(parser: pw.UDF, blob_store: BlobStore) -> pw.UDF:
+    """
+    Moves the images returned by ``parser`` into ``blob_store``.
+
+    The images are stored after the cache of the parser, so the blobs of the slides
+    read from the cache are stored again if they were removed. The UDF is modified in
+    place, after any wrapping of its ``__wrapped__``, e.g. by ``metrics.instrument``.
+
+    Args:
+        parser: parser returning ``b64_image`` in the metadata, e.g. ``SlideParser``.
+        blob_store: store of the images.
+    """
+    func = parser.func
+
+    async def externalize_async(documents):
+        return await asyncio.to_thread(_externalize, blob_store, await documents)
+
+    @functools.wraps(func)
+    def externalized(*args, **kwargs):
+        documents = func(*args, **kwargs)
+        # the function of an asynchronous UDF returns an awaitable
+        if inspect.isawaitable(documents):
+            return externalize_async(documents)
+        return _externalize(blob_store, documents)
+
+    parser.func = externalized
+    return parser
@@ -0,0 +1,355 @@
+"""
+Inverted index over the metadata fields of the slides.
+
+The UI filters the search by category and language with JMESPath expressions, which
+the vector index evaluates slide by slide while it searches. ``FacetIndex`` keeps, for
+each value of the chosen fields, a bitmap of the slides having it. Filters made of
+``contains``, ``==``, ``!=``, ``globmatch``, ``&&``, ``||`` and ``!`` over these fields
+are turned into a bitmap of candidate slides before the search: a filter matching
+no slide is answered without searching, and one matching all slides is dropped. The
+index also counts the slides per value, which the UI shows as the filter options.
+"""
+
+import fnmatch
+import logging
+import threading
+
+import jmespath
+import jmespath.functions
+import pathway as pw
+from pathway.xpacks.llm.servers import BaseRestServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIELDS = ("path", "category", "language", "tags")
+
+
+class FacetsQuerySchema(pw.Schema):
+    fields: pw.Json | None = pw.column_definition(default_value=None)
+    metadata_filter: str | None = pw.column_definition(default_value=None)
+
+
+class FacetIndex:
+    """
+    Bitmaps of the slides having each value of the metadata ``fields``.
+
+    For list fields, e.g. ``tags``, each element of the list is a value. Slides are
+    numbered as they are added, and every bitmap is a Python ``int`` with the bits of
+    the numbers of the slides set. The bitmaps are keyed on the kind and the value, as
+    ``true`` and ``1`` are equal in Python but not in the comparisons of JMESPath.
+
+    Args:
+        fields: metadata fields to index.
+    """
+
+    def __init__(self, fields: list[str] | tuple[str, ...] = DEFAULT_FIELDS):
+        self.fields = tuple(fields)
+        self._lock = threading.Lock()
+        self._rows: dict = {}
+        self._free: list[int] = []
+        self._next_row = 0
+        self._all = 0
+        self._values: dict[str, dict] = {field: {} for field in self.fields}
+        self._postings: dict[str, dict] = {field: {} for field in self.fields}
+        # fields holding lists in some slides, matched by element
+        self._list_fields: set[str] = set()
+
+    def observe(self, chunks: pw.Table) -> None:
+        """Keeps the index up to date with ``chunks``, e.g. ``chunked_docs`` of the store."""
+        table = chunks.select(
+            **{
+                field: pw.this.metadata.get(field, default=None)
+                for field in self.fields
+            }
+        )
+
+        def on_change(key, row, time, is_addition):
+            if is_addition:
+                self.add(key, {field: _unwrap(row[field]) for field in self.fields})
+            else:
+                self.remove(key)
+
+        pw.io.subscribe(table, on_change=on_change)
+
+    def add(self, key, metadata: dict) -> None:
+        with self._lock:
+            self._remove(key)
+            row = self._free.pop() if self._free else self._next_row
+            if row == self._next_row:
+                self._next_row += 1
+            self._rows[key] = row
+            self._all |= 1 << row
+            for field in self.fields:
+                value = metadata.get(field)
+                self._values[field][row] = value
+                if isinstance(value, list):
+                    self._list_fields.add(field)
+                for item in _items(value):
+                    postings = self._postings[field]
+                    postings[item] = postings.get(item, 0) | 1 << row
+
+    def remove(self, key) -> None:
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key) -> None:
+        # called with the lock held
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        self._all &= ~(1 << row)
+        for field in self.fields:
+            postings = self._postings[field]
+            for item in _items(self._values[field].pop(row, None)):
+                bitmap = postings[item] & ~(1 << row)
+                if bitmap:
+                    postings[item] = bitmap
+                else:
+                    del postings[item]
+        self._free.append(row)
+
+    def counts(
+        self, fields: list[str] | None = None, metadata_filter: str | None = None
+    ) -> dict[str, dict[str, int]]:
+        """
+        Counts the slides having each value of ``fields``, among the slides matching
+        ``metadata_filter`` if it is given. The filter may only refer to the indexed fields.
+        """
+        fields = [field for field in fields or self.fields if field in self.fields]
+        with self._lock:
+            candidates = self._all
+            if metadata_filter:
+                expression = jmespath.compile(metadata_filter)
+                bitmap, exact = self._plan(expression.parsed)
+                candidates &= bitmap
+                if not exact:
+                    candidates = self._evaluate(expression, candidates)
+            return {
+                field: {
+                    str(value): (bitmap & candidates).bit_count()
+                    for (_, value), bitmap in sorted(self._postings[field].items())
+                    if bitmap & candidates
+                }
+                for field in fields
+            }
+
+    def _evaluate(self, expression, candidates: int) -> int:
+        # called with the lock held
+        matching = 0
+        for row in self._rows.values():
+            if not candidates >> row & 1:
+                continue
+            metadata = {field: self._values[field].get(row) for field in self.fields}
+            try:
+                if expression.search(metadata, options=_GLOB_OPTIONS) is True:
+                    matching |= 1 << row
+            except (jmespath.exceptions.JMESPathError, TypeError):
+                # e.g. `contains` of a string and null raises a TypeError
+                continue
+        return matching
+
+    def plan(self, metadata_filter: str | None) -> tuple[str | None, bool]:
+        """
+        Returns the filter to pass to the vector index, ``None`` if all slides match it,
+        and whether any slide can match it at all.
+        """
+        if not metadata_filter:
+            return None, True
+        try:
+            tree = jmespath.compile(metadata_filter).parsed
+        except jmespath.exceptions.JMESPathError:
+            return metadata_filter, True
+        with self._lock:
+            bitmap, exact = self._plan(tree)
+            if bitmap & self._all == 0:
+                return metadata_filter, False
+            if exact and bitmap & self._all == self._all:
+                return None, True
+        return metadata_filter, True
+
+    def _plan(self, node: dict) -> tuple[int, bool]:
+        """
+        Returns a bitmap of the slides which may match the expression, and whether exactly
+        these slides match it. Called with the lock held.
+        """
+        children = node.get("children", [])
+        match node["type"], node.get("value"):
+            case "and_expression", _:
+                (left, left_exact), (right, right_exact) = map(self._plan, children)
+                return left & right, left_exact and right_exact
+            case "or_expression", _:
+                (left, left_exact), (right, right_exact) = map(self._plan, children)
+                return left | right, left_exact and right_exact
+            case "not_expression", _:
+                bitmap, exact = self._plan(children[0])
+                if exact:
+                    return self._all & ~bitmap, True
+            case "comparator", ("eq" | "ne") as comparator:
+                literal, field = _literal_and_field(children)
+                # slides without the field are not in the postings, so comparisons
+                # with null are evaluated slide by slide
+                if (
+                    field in self._postings
+                    and field not in self._list_fields
+                    and literal is not None
+                    and not isinstance(literal, dict)
+                ):
+                    bitmap = self._postings[field].get(_key(literal), 0)
+                    return (bitmap if comparator == "eq" else self._all & ~bitmap), True
+            case "function_expression", "contains":
+                return self._plan_contains(children)
+            case "function_expression", "globmatch":
+                pattern, field = _literal_and_field(children)
+                if (
+                    isinstance(pattern, str)
+                    and field in self._postings
+                    and field not in self._list_fields
+                ):
+                    bitmap, _ = self._union(
+                        field,
+                        lambda item: isinstance(item, str)
+                        and _globmatch(pattern, item),
+                    )
+                    return bitmap, self._all_of(field, str)
+        return self._all, False
+
+    def _plan_contains(self, children: list[dict]) -> tuple[int, bool]:
+        if len(children) != 2:
+            return self._all, False
+        subject, search = children
+        if subject["type"] == "literal" and search["type"] == "field":
+            # the value of the field is an element, or a substring, of the literal
+            field, literal = search["value"], subject["value"]
+            if field in self._postings and field not in self._list_fields:
+                if isinstance(literal, list) and None not in literal:
+                    return self._union(field, lambda value: value in literal)
+                if isinstance(literal, str):
+                    bitmap, _ = self._union(
+                        field, lambda value: isinstance(value, str) and value in literal
+                    )
+                    return bitmap, self._all_of(field, str)
+        elif subject["type"] == "field" and search["type"] == "literal":
+            # the value of a list field has the literal as an element
+            field, literal = subject["value"], search["value"]
+            if (
+                field in self._postings
+                and literal is not None
+                and not isinstance(literal, dict)
+                and all(
+                    isinstance(value, list) or value is None
+                    for value in self._values[field].values()
+                )
+            ):
+                # `contains` compares as Python does, so `true` matches `1` here
+                literal = _hashable(literal)
+                bitmap, _ = self._union(field, lambda value: value == literal)
+                return bitmap, self._all_of(field, list)
+        return self._all, False
+
+    def _all_of(self, field: str, kind: type) -> bool:
+        """
+        Whether all slides have a ``kind`` value of ``field``. A function raises on the
+        other slides rather than returning false, so its negation does not match them.
+        """
+        return all(isinstance(value, kind) for value in self._values[field].values())
+
+    def _union(self, field: str, predicate) -> tuple[int, bool]:
+        bitmap = 0
+        for (_, value), item_bitmap in self._postings[field].items():
+            if predicate(value):
+                bitmap |= item_bitmap
+        return bitmap, True
+
+
+def _globmatch(pattern: str, path: str) -> bool:
+    """
+    Whether ``path`` matches ``pattern``, with ``fnmatch`` at every level and ``**``
+    matching any number of levels. It must agree with the ``globmatch`` of pathway,
+    which evaluates the filters in the vector index, so a ``**`` ending the pattern
+    matches nothing, as there.
+    """
+    pattern_parts = pattern.split("/")
+    path_parts = path.split("/")
+    memo: dict[tuple[int, int], bool] = {}
+
+    def matches(i: int, j: int) -> bool:
+        if (i, j) not in memo:
+            if i == len(pattern_parts):
+                memo[i, j] = j == len(path_parts)
+            elif j == len(path_parts):
+                memo[i, j] = False
+            elif pattern_parts[i] == "**":
+                memo[i, j] = matches(i, j + 1) or matches(i + 1, j)
+            else:
+                memo[i, j] = fnmatch.fnmatch(
+                    path_parts[j], pattern_parts[i]
+                ) and matches(i + 1, j + 1)
+        return memo[i, j]
+
+    return matches(0, 0)
+
+
+class _GlobFunctions(jmespath.functions.Functions):
+    @jmespath.functions.signature({"types": ["string"]}, {"types": ["string"]})
+    def _func_globmatch(self, pattern, string):
+        return _globmatch(pattern, string)
+
+
+_GLOB_OPTIONS = jmespath.Options(custom_functions=_GlobFunctions())
+
+
+def _literal_and_field(children: list[dict]) -> tuple[object, str | None]:
+    """Returns the literal and the field name of a binary expression on a field."""
+    if len(children) == 2:
+        for literal, field in (children, reversed(children)):
+            if literal["type"] == "literal" and field["type"] == "field":
+                return _hashable(literal["value"]), field["value"]
+    return None, None
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _key(value) -> tuple[str, object]:
+    """Key of a value in the postings, which does not equal ``1`` to ``true``."""
+    if isinstance(value, bool):
+        return "boolean", value
+    if isinstance(value, (int, float)):
+        return "number", value
+    return type(value).__name__, value
+
+
+def _items(value) -> list[tuple[str, object]]:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [_key(_hashable(item)) for item in value if not isinstance(item, dict)]
+    if isinstance(value, dict):
+        return []
+    return [_key(value)]
+
+
+def _unwrap(value):
+    return value.value if isinstance(value, pw.Json) else value
+
+
+def serve(server: BaseRestServer, facet_index: FacetIndex) -> None:
+    """
+    Serves the facet counts at ``/v1/facets``. The optional ``fields`` and
+    ``metadata_filter`` of the request restrict the counted fields and slides.
+    """
+
+    @pw.udf
+    def count_facets(fields: pw.Json | None, metadata_filter: str | None) -> pw.Json:
+        counts: dict = facet_index.counts(
+            fields.as_list() if fields is not None else None, metadata_filter
+        )
+        return pw.Json(counts)
+
+    def facets_query(queries: pw.Table) -> pw.Table:
+        return queries.select(
+            result=count_facets(pw.this.fields, pw.this.metadata_filter)
+        )
+
+    server.serve("/v1/facets", FacetsQuerySchema, facets_query)
@@ -0,0 +1,256 @@
+"""
+Background writer of the slide images and files served to the UI.
+
+``DeckRetrieverWithFileSave`` dumps every parsed slide as a PNG file, and every
+document as a file, from ``pw.io.subscribe`` callbacks. Decoding and writing them in
+the callbacks stalls the dataflow while a large deck is indexed. ``FileWriter`` takes
+the writes and removals in a bounded queue and applies them in worker threads, in
+batches: the files of a batch are written to temporary files, synced to disk together
+and renamed into place, so the UI never sees a partially written file. The operations on
+a path are applied in the order in which they were queued. A write can also derive
+other files from the contents, e.g. thumbnails, which are written in the same way, and
+a removal can remove them too, so that they are handled by the worker of the path
+they come from.
+"""
+
+import atexit
+import base64
+import logging
+import os
+import queue
+import threading
+import uuid
+import zlib
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+from pathway_slides_ai_search.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# temporary files are hidden, and removed by `remove_temporary_files` after a crash
+TEMPORARY_PREFIX = ".tmp-"
+
+# returns the contents of the files derived from a file by their paths
+Derive = Callable[[Path, bytes], dict[Path, bytes]]
+
+
+@dataclass
+class _Operation:
+    path: Path
+    # without `data` nor `source` the file is removed
+    data: bytes | str | None
+    base64_encoded: bool = False
+    # file whose contents are copied
+    source: Path | None = None
+    derive: Derive | None = None
+    # files derived from `path`, removed together with it
+    derived: tuple[Path, ...] = ()
+
+    @property
+    def removes(self) -> bool:
+        return self.data is None and self.source is None
+
+
+class FileWriter:
+    """
+    Writes and removes files in background threads.
+
+    Args:
+        workers: number of threads writing the files. The paths are split between
+            them, so that the operations on each path stay in order.
+        max_queued: maximum number of operations waiting to be applied. Once it is
+            reached, a new operation waits for a free place in the queue, so the memory
+            taken by the queued contents stays bounded.
+        batch_size: maximum number of operations applied, and synced to disk, together.
+        fsync: whether to sync the files and their directories to disk before the
+            operations are counted as done.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queued: int = 1024,
+        batch_size: int = 64,
+        fsync: bool = True,
+    ):
+        if workers < 1:
+            raise ValueError("`workers` must be at least 1")
+        self.workers = workers
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self._closed = False
+        self._queues: list[queue.Queue[_Operation | None]] = [
+            queue.Queue(maxsize=max(1, max_queued // workers)) for _ in range(workers)
+        ]
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(operations,),
+                daemon=True,
+                name=f"file-writer-{i}",
+            )
+            for i, operations in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+        # the queued operations are applied before the interpreter exits
+        atexit.register(self.close)
+
+    def write(self, path: Path, data: bytes, derive: Derive | None = None) -> None:
+        """
+        Queues writing ``data`` to ``path``, and the files returned by ``derive``
+        before it.
+        """
+        self._put(_Operation(path, data, derive=derive))
+
+    def write_base64(self, path: Path, data: str, derive: Derive | None = None) -> None:
+        """Queues writing the base64 encoded ``data`` to ``path``, decoded by a worker."""
+        self._put(_Operation(path, data, base64_encoded=True, derive=derive))
+
+    def copy(self, path: Path, source: Path, derive: Derive | None = None) -> None:
+        """Queues writing the contents of ``source`` to ``path``, read by a worker."""
+        self._put(_Operation(path, None, source=source, derive=derive))
+
+    def remove(self, path: Path, derived: Iterable[Path] = ()) -> None:
+        """
+        Queues removing ``path``, and the files in ``derived``, e.g. the ones written
+        by its ``derive``, before it.
+        """
+        self._put(_Operation(path, None, derived=tuple(derived)))
+
+    def queued(self) -> int:
+        """Number of operations not applied yet."""
+        return sum(operations.unfinished_tasks for operations in self._queues)
+
+    def flush(self) -> None:
+        """Waits until all the queued operations are applied."""
+        for operations in self._queues:
+            operations.join()
+
+    def close(self) -> None:
+        """Applies the queued operations and stops the workers."""
+        if self._closed:
+            return
+        self._closed = True
+        for operations in self._queues:
+            operations.put(None)
+        for thread in self._threads:
+            thread.join()
+        atexit.unregister(self.close)
+
+    def _put(self, operation: _Operation) -> None:
+        shard = zlib.crc32(str(operation.path).encode()) % self.workers
+        self._queues[shard].put(operation)
+        self._report()
+
+    def _report(self) -> None:
+        REGISTRY.set_gauge("pathway_file_writer_queued", self.queued())
+
+    def _work(self, operations: queue.Queue) -> None:
+        while True:
+            batch = [operations.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(operations.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            pending = [operation for operation in batch if operation is not None]
+            if pending:
+                try:
+                    with REGISTRY.track("file_write", rows=len(pending)):
+                        self._apply(pending)
+                except Exception:
+                    logger.exception("Error applying %d file operations", len(pending))
+            for _ in batch:
+                operations.task_done()
+            self._report()
+            if stop:
+                return
+
+    def _apply(self, batch: list[_Operation]) -> None:
+        temporary: dict[int, list[tuple[Path, Path]]] = {}
+        for i, operation in enumerate(batch):
+            if operation.removes:
+                continue
+            try:
+                temporary[i] = self._write_temporary(operation)
+            except Exception:
+                logger.exception("Error writing %s", operation.path)
+        if self.fsync:
+            for files in temporary.values():
+                for path, _ in files:
+                    _fsync(path)
+
+        directories = set()
+        for i, operation in enumerate(batch):
+            if not operation.removes:
+                if i not in temporary:
+                    continue
+                try:
+                    # the derived files are in place before the file they come from
+                    for path, target in temporary[i]:
+                        os.replace(path, target)
+                        directories.add(target.parent)
+                except Exception:
+                    logger.exception("Error writing %s", operation.path)
+                    for path, _ in temporary[i]:
+                        path.unlink(missing_ok=True)
+                    continue
+            else:
+                for path in (*operation.derived, operation.path):
+                    try:
+                        path.unlink()
+                        logger.info("Removed %s", path)
+                    except Exception as e:
+                        logger.info("Error removing %s: %s", path, e)
+                    directories.add(path.parent)
+            directories.add(operation.path.parent)
+        if self.fsync:
+            # the renames and removals are durable once their directories are synced
+            for directory in directories:
+                _fsync(directory)
+
+    def _write_temporary(self, operation: _Operation) -> list[tuple[Path, Path]]:
+        """Writes the temporary files of ``operation`` and returns them with targets."""
+        data = operation.data
+        if operation.source is not None:
+            data = operation.source.read_bytes()
+        assert data is not None
+        if operation.base64_encoded:
+            data = base64.b64decode(data)
+        assert isinstance(data, bytes)
+        files = {}
+        if operation.derive is not None:
+            files.update(operation.derive(operation.path, data))
+        files[operation.path] = data
+        written = []
+        try:
+            for target, contents in files.items():
+                path = target.with_name(
+                    f"{TEMPORARY_PREFIX}{uuid.uuid4().hex}-{target.name}"
+                )
+                path.write_bytes(contents)
+                written.append((path, target))
+        except Exception:
+            for path, _ in written:
+                path.unlink(missing_ok=True)
+            raise
+        return written
+
+
+def _fsync(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def remove_temporary_files(directory: Path) -> None:
+    """Removes the temporary files left in ``directory`` by a writer which was killed."""
+    for path in directory.glob(f"{TEMPORARY_PREFIX}*"):
+        path.unlink(missing_ok=True)
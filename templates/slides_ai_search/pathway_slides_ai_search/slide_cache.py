@@ -0,0 +1,296 @@
+"""
+Reuse of the vision LLM results of unchanged and near-duplicate slides.
+
+The cache of ``SlideParser`` is keyed on the whole document, so when a deck of 60 slides
+is uploaded again with three of them changed, all 60 images are sent to the LLM again.
+``reuse_slide_results`` wraps the functions of the parser which describe a slide and
+extract its ``details_schema``, so that their results are stored in a
+``SlideResultCache`` keyed on the SHA-256 hash of the rendered slide image, the model and
+the prompt or schema. Slides rendered to the same image, in the same deck or another
+one, reuse the stored results, and only the changed slides go to the LLM.
+
+Decks are also full of slides which differ in a few pixels, e.g. the agenda or the
+"Thank you" slide of a company template. With ``max_distance`` set, the cache also
+keeps a perceptual hash of each parsed slide, and a slide whose hash differs from
+the hash of a parsed one in at most ``max_distance`` bits reuses its results. Slides of
+one deck are parsed at the same time, so a slide also waits for a near-duplicate being
+parsed instead of sending its own request.
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import diskcache
+from pathway.xpacks.llm.parsers import SlideParser
+from pathway_slides_ai_search.metrics import REGISTRY
+from PIL import Image
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# width and height of the grid of the perceptual hash, which has HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+# prefix of the cache entries with the perceptual hashes of the stored results
+_HASH_PREFIX = "phash/"
+
+
+def perceptual_hash(b64_image: str, hash_size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of the image: the image is scaled down to a grayscale grid, and
+    each bit tells whether a cell is brighter than the cell on its right.
+    """
+    image = Image.open(io.BytesIO(base64.b64decode(b64_image)))
+    grid = image.convert("L").resize(
+        (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+    )
+    pixels = grid.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            offset = row * (hash_size + 1) + column
+            bits = bits << 1 | (pixels[offset] > pixels[offset + 1])
+    return bits
+
+
+class _HammingIndex:
+    """
+    Hashes searchable by Hamming distance up to ``max_distance``.
+
+    The bits are split into ``max_distance + 1`` bands. Two hashes differing in at most
+    ``max_distance`` bits are equal in at least one band, so only the hashes sharing
+    a band with the searched one are compared.
+    """
+
+    def __init__(self, bits: int, max_distance: int):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        bounds = [bits * i // bands for i in range(bands + 1)]
+        self._bands = list(zip(bounds[:-1], bounds[1:]))
+        self._tables: list[defaultdict[int, list[tuple[int, str]]]] = [
+            defaultdict(list) for _ in self._bands
+        ]
+
+    def _parts(self, value: int) -> list[int]:
+        return [(value >> low) & ((1 << (high - low)) - 1) for low, high in self._bands]
+
+    def add(self, value: int, key: str) -> None:
+        for table, part in zip(self._tables, self._parts(value)):
+            table[part].append((value, key))
+
+    def nearest(self, value: int) -> tuple[int, str] | None:
+        """Distance and key of the nearest hash within ``max_distance``, if any."""
+        best = None
+        for table, part in zip(self._tables, self._parts(value)):
+            for other, key in table.get(part, ()):
+                distance = (value ^ other).bit_count()
+                if distance <= self.max_distance and (
+                    best is None or distance < best[0]
+                ):
+                    best = (distance, key)
+        return best
+
+
+class SlideResultCache:
+    """
+    Results of the LLM calls for the slides, stored on disk.
+
+    Args:
+        directory: directory of the cache.
+        size_limit: size of the cache in bytes, after which the least recently used
+            results are evicted.
+        max_distance: number of bits, out of 256, in which the perceptual hashes of two
+            slides may differ for one to reuse the results of the other. ``None``
+            reuses the results of identical slides only.
+    """
+
+    def __init__(
+        self,
+        directory: str | os.PathLike[str] = "storage/slide_cache",
+        size_limit: int = 2**30,
+        max_distance: int | None = None,
+    ):
+        self.directory = directory
+        self.size_limit = size_limit
+        self.max_distance = max_distance
+        self._cache = diskcache.Cache(
+            str(directory), size_limit=size_limit, eviction_policy="least-recently-used"
+        )
+        self._lock = threading.Lock()
+        self._indexes: dict[str, _HammingIndex] = {}
+        self._in_flight: dict[tuple[int, str], list[tuple[str, int | None, Any]]] = {}
+        self.hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+        if max_distance is not None:
+            self._load_hashes()
+
+    @property
+    def calls_avoided(self) -> int:
+        """Number of LLM calls answered from the cache."""
+        return self.hits + self.near_duplicate_hits
+
+    def _load_hashes(self) -> None:
+        for entry in self._cache.iterkeys():
+            if isinstance(entry, str) and entry.startswith(_HASH_PREFIX):
+                stored = self._cache.get(entry)
+                if stored is not None:
+                    namespace, value = stored
+                    self._index(namespace).add(value, entry[len(_HASH_PREFIX) :])
+
+    def _index(self, namespace: str) -> _HammingIndex:
+        assert self.max_distance is not None
+        if namespace not in self._indexes:
+            self._indexes[namespace] = _HammingIndex(HASH_SIZE**2, self.max_distance)
+        return self._indexes[namespace]
+
+    def _count(self, outcome: str) -> None:
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            REGISTRY.set_gauge("pathway_slide_cache_hits", self.hits)
+            REGISTRY.set_gauge(
+                "pathway_slide_cache_near_duplicate_hits", self.near_duplicate_hits
+            )
+            REGISTRY.set_gauge("pathway_slide_cache_misses", self.misses)
+            REGISTRY.set_gauge("pathway_slide_llm_calls_avoided", self.calls_avoided)
+
+    def _find_near(self, namespace: str, value: int) -> Any:
+        with self._lock:
+            nearest = self._index(namespace).nearest(value)
+        if nearest is None:
+            return None
+        distance, key = nearest
+        result = self._cache.get(key)
+        if result is not None:
+            logger.info(
+                "Reusing the results of a slide %d bits away from the parsed one",
+                distance,
+            )
+        return result
+
+    def _store(self, namespace: str, key: str, value: int | None, result: Any) -> None:
+        self._cache.set(key, result)
+        if value is not None:
+            self._cache.set(_HASH_PREFIX + key, (namespace, value))
+            with self._lock:
+                self._index(namespace).add(value, key)
+
+    async def get_or_compute(
+        self, namespace: str, b64_image: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Returns the result stored for the slide, or for a near-duplicate of it, or
+        waits for a near-duplicate being computed, and otherwise computes and stores it.
+        """
+        key = _digest(namespace, b64_image)
+        result = self._cache.get(key)
+        if result is not None:
+            self._count("hits")
+            return result
+
+        value = None
+        if self.max_distance is not None:
+            value = await asyncio.to_thread(perceptual_hash, b64_image)
+            result = self._find_near(namespace, value)
+            if result is not None:
+                self._count("near_duplicate_hits")
+                return result
+
+        # computations are awaited only within their own event loop
+        in_flight = self._in_flight.setdefault(
+            (id(asyncio.get_running_loop()), namespace), []
+        )
+        for other_key, other_value, future in in_flight:
+            near = (
+                value is not None
+                and other_value is not None
+                and self.max_distance is not None
+                and (value ^ other_value).bit_count() <= self.max_distance
+            )
+            if other_key == key or near:
+                # `None` if the computation failed, then this slide is parsed itself
+                result = await future
+                if result is not None:
+                    self._count("hits" if other_key == key else "near_duplicate_hits")
+                    return result
+                break
+
+        self._count("misses")
+        future = asyncio.get_running_loop().create_future()
+        entry = (key, value, future)
+        in_flight.append(entry)
+        try:
+            result = await compute()
+            self._store(namespace, key, value, result)
+        finally:
+            in_flight.remove(entry)
+            future.set_result(result)
+        return result
+
+
+def _digest(*parts: str | None) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode())
+        # separates the parts, so that they cannot shift into each other
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def reuse_slide_results(parser: SlideParser, cache: SlideResultCache) -> SlideParser:
+    """
+    Makes ``parser`` reuse the results of the slides found in ``cache``.
+
+    The parser is modified in place. The descriptions are keyed on the parse prompt
+    and the details on the JSON schema of ``detail_parse_schema``, so changing either
+    in ``app.yaml`` parses all the slides again.
+
+    Args:
+        parser: parser of the slides.
+        cache: store of the results.
+    """
+    model = parser.llm.kwargs.get("model")  # type: ignore[attr-defined]
+    parse_fn = parser.parse_fn
+
+    @functools.wraps(parse_fn)
+    async def parse_with_cache(b64_image, llm, prompt, *args, **kwargs) -> str:
+        return await cache.get_or_compute(
+            _digest("description", model, prompt),
+            b64_image,
+            lambda: parse_fn(b64_image, llm, prompt, *args, **kwargs),
+        )
+
+    parser.parse_fn = parse_with_cache
+
+    parse_details_fn = parser.parse_image_details_fn
+    if parse_details_fn is None:
+        return parser
+
+    @functools.wraps(parse_details_fn)
+    async def parse_details_with_cache(
+        b64_image, parse_schema: type[BaseModel], **kwargs
+    ) -> BaseModel:
+        schema = json.dumps(parse_schema.model_json_schema(), sort_keys=True)
+
+        async def parse_details() -> dict:
+            parsed = await parse_details_fn(
+                b64_image, parse_schema=parse_schema, **kwargs
+            )
+            return parsed.model_dump(mode="json")
+
+        details = await cache.get_or_compute(
+            _digest("details", model, schema), b64_image, parse_details
+        )
+        return parse_schema.model_validate(details)
+
+    parser.parse_image_details_fn = parse_details_with_cache
+    return parser
@@ -0,0 +1,63 @@
+"""
+Compressed thumbnails of the slide images.
+
+The UI shows each result as one large slide with up to four adjacent slides as small
+previews, and loading all of them as full-size PNG files makes a page of results weigh
+tens of megabytes. ``SlideThumbnails`` renders every slide image, when it is written
+by ``FileWriter``, in a few smaller widths and a compressed format, next to the full
+image: ``<slide_id stem>.<size>.<format>``, e.g. ``a2V5_3_12.small.webp``. The UI
+requests the size matching each of its slots.
+"""
+
+import io
+from pathlib import Path
+from typing import Literal
+
+from PIL import Image
+
+DEFAULT_SIZES = {"small": 192, "medium": 800}
+
+
+class SlideThumbnails:
+    """
+    Renders the thumbnails of a slide image.
+
+    Args:
+        sizes: width in pixels of each size of the thumbnails, by name. Images narrower
+            than a size are not enlarged.
+        format: image format of the thumbnails.
+        quality: compression quality of the thumbnails, from 1 to 100.
+    """
+
+    def __init__(
+        self,
+        sizes: dict[str, int] = DEFAULT_SIZES,
+        format: Literal["webp", "jpeg"] = "webp",
+        quality: int = 75,
+    ):
+        self.sizes = dict(sizes)
+        self.format = format
+        self.quality = quality
+
+    def path(self, image_path: Path, size: str) -> Path:
+        """Path of the thumbnail of ``image_path`` in ``size``."""
+        return image_path.with_name(f"{image_path.stem}.{size}.{self.format}")
+
+    def paths(self, image_path: Path) -> list[Path]:
+        """Paths of all the thumbnails of ``image_path``."""
+        return [self.path(image_path, size) for size in self.sizes]
+
+    def render(self, image_path: Path, data: bytes) -> dict[Path, bytes]:
+        """Returns the contents of the thumbnails of the image ``data`` by their paths."""
+        # JPEG has no alpha channel, and WebP is smaller without it
+        image = Image.open(io.BytesIO(data)).convert("RGB")
+        thumbnails = {}
+        for size, width in self.sizes.items():
+            thumbnail = image
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                thumbnail = image.resize((width, height), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, format=self.format.upper(), quality=self.quality)
+            thumbnails[self.path(image_path, size)] = buffer.getvalue()
+        return thumbnails
@@ -0,0 +1,134 @@
+import jmespath
+import pytest
+from pathway_slides_ai_search.facets import _GLOB_OPTIONS, FacetIndex
+
+SLIDES: list[dict] = [
+    {"path": "decks/a.pdf", "category": "sales", "flag": True, "tags": ["q1", "eu"]},
+    {"path": "decks/b.pdf", "category": "sales", "flag": 1, "tags": ["q2"]},
+    {"path": "decks/c.pdf", "category": "hr", "flag": False, "tags": []},
+    {"path": "notes/d.pdf", "category": None, "flag": 0, "tags": None},
+    {"path": "notes/e.pdf", "flag": "1"},
+]
+FIELDS = ["path", "category", "flag", "tags"]
+
+
+@pytest.fixture
+def index() -> FacetIndex:
+    index = FacetIndex(FIELDS)
+    for key, slide in enumerate(SLIDES):
+        index.add(key, slide)
+    return index
+
+
+def matches(metadata_filter: str, slide: dict) -> bool:
+    # as in the vector index, a filter failing on a slide does not match it
+    metadata = {field: slide.get(field) for field in FIELDS}
+    try:
+        return jmespath.search(metadata_filter, metadata, options=_GLOB_OPTIONS) is True
+    except (jmespath.exceptions.JMESPathError, TypeError):
+        return False
+
+
+def expected_paths(metadata_filter: str) -> set[str]:
+    return {slide["path"] for slide in SLIDES if matches(metadata_filter, slide)}
+
+
+def matched_paths(index: FacetIndex, metadata_filter: str) -> set[str]:
+    return set(index.counts(["path"], metadata_filter)["path"])
+
+
+@pytest.mark.parametrize(
+    "metadata_filter",
+    [
+        "category == 'sales'",
+        "category != 'sales'",
+        "category == null",
+        "category != null",
+        "flag == `true`",
+        "flag == `1`",
+        "flag != `1`",
+        "flag == '1'",
+        "flag == `false`",
+        "flag == `0`",
+        "contains(tags, 'q1')",
+        "contains(tags, 'missing')",
+        "tags == 'q1'",
+        "contains(['sales', 'hr'], category)",
+        "contains('sales and marketing', category)",
+        "globmatch('decks/*.pdf', path)",
+        "globmatch('**/d.pdf', path)",
+        "!(category == 'sales')",
+        "!(category == null)",
+        "!contains(tags, 'q2')",
+        "category == 'sales' && !(flag == `1`)",
+        "category == 'hr' || contains(tags, 'q2')",
+    ],
+)
+def test_counts_match_the_filter(index, metadata_filter):
+    assert matched_paths(index, metadata_filter) == expected_paths(metadata_filter)
+
+
+@pytest.mark.parametrize(
+    "metadata_filter",
+    [
+        "category == 'sales'",
+        "category == null",
+        "flag == `1`",
+        "contains(tags, 'q1')",
+        "tags == 'q1'",
+        "!(category == 'sales')",
+        "globmatch('decks/**', path)",
+    ],
+)
+def test_plan_keeps_the_matching_slides(index, metadata_filter):
+    planned, any_match = index.plan(metadata_filter)
+    if not any_match:
+        assert expected_paths(metadata_filter) == set()
+    elif planned is None:
+        assert len(expected_paths(metadata_filter)) == len(SLIDES)
+    else:
+        assert planned == metadata_filter
+
+
+def test_boolean_and_number_are_distinct(index):
+    assert matched_paths(index, "flag == `true`") == {"decks/a.pdf"}
+    assert matched_paths(index, "flag == `1`") == {"decks/b.pdf"}
+    assert matched_paths(index, "flag == `false`") == {"decks/c.pdf"}
+    assert matched_paths(index, "flag == `0`") == {"notes/d.pdf"}
+
+
+def test_comparison_with_null_is_not_planned(index):
+    # slides without the field are not in the postings
+    assert index.plan("category == null") == ("category == null", True)
+    assert matched_paths(index, "category == null") == {"notes/d.pdf", "notes/e.pdf"}
+    assert matched_paths(index, "category != null") == {
+        "decks/a.pdf",
+        "decks/b.pdf",
+        "decks/c.pdf",
+    }
+
+
+def test_list_fields_are_matched_by_element(index):
+    assert matched_paths(index, "contains(tags, 'eu')") == {"decks/a.pdf"}
+    assert matched_paths(index, "tags == 'q2'") == set()
+    assert index.plan("tags == 'q2'") == ("tags == 'q2'", True)
+    assert index.plan("contains(tags, 'missing')") == (
+        "contains(tags, 'missing')",
+        False,
+    )
+
+
+def test_not_is_the_complement(index):
+    assert matched_paths(index, "!(category == 'sales')") == {
+        "decks/c.pdf",
+        "notes/d.pdf",
+        "notes/e.pdf",
+    }
+    assert index.plan("!(category == 'nothing')") == (None, True)
+    assert index.plan("!(category != 'nothing')") == ("!(category != 'nothing')", False)
+
+
+def test_removed_slides_are_not_matched(index):
+    index.remove(0)
+    assert matched_paths(index, "category == 'sales'") == {"decks/b.pdf"}
+    assert index.plan("contains(tags, 'eu')") == ("contains(tags, 'eu')", False)
@@ -36,6 +36,9 @@ file_server_base_url = os.environ.get("FILE_SERVER_URL", "http://localhost:8080/
 file_server_image_base_url = f"{file_server_base_url}images"
 
 file_server_pdf_base_url = f"{file_server_base_url}documents"
+
+# format of the thumbnails saved by the app, an empty string to show the full images
+thumbnail_format = os.environ.get("SLIDE_THUMBNAIL_FORMAT", "webp")
 internal_file_server_pdf_base_url = "http://nginx:8080/"
 
 note = """
@@ -82,10 +85,15 @@ div[data-testid="stHorizontalBlock"]:has(button[data-testid="baseButton-primary"
 question = st.text_input(label="", placeholder="What are you searching for?")
 
 
-def get_options_list(metadata_list: list[dict], opt_key: str) -> list:
-    """Get all available options in a specific metadata key."""
-    options = set(map(lambda x: x[opt_key], metadata_list))
-    return list(options)
+def get_facets(fields: list[str]) -> dict[str, dict[str, int]]:
+    """Get the number of slides with each value of the metadata `fields`."""
+    response = requests.post(
+        f"http://{PATHWAY_HOST}:{PATHWAY_PORT}/v1/facets",
+        json={"fields": fields},
+        timeout=90,
+    )
+    response.raise_for_status()
+    return response.json()
 
 
 def parse_slide_id_components(slide_id: str) -> tuple[str, int, int]:
@@ -95,13 +103,17 @@ def parse_slide_id_components(slide_id: str) -> tuple[str, int, int]:
     return (name, int(page), int(page_count))
 
 
-def create_slide_url(name: str, page: int, page_count: int) -> str:
+def create_slide_url(
+    name: str, page: int, page_count: int, size: str | None = None
+) -> str:
+    if size is not None and thumbnail_format:
+        return f"{file_server_image_base_url}/{name}_{page}_{page_count}.{size}.{thumbnail_format}"
     return f"{file_server_image_base_url}/{name}_{page}_{page_count}.png"
 
 
-def get_image_serve_url(metadata: dict) -> str:
+def get_image_serve_url(metadata: dict, size: str | None = "medium") -> str:
     name, page, page_count = parse_slide_id_components(metadata["slide_id"])
-    return create_slide_url(name, page, page_count)
+    return create_slide_url(name, page, page_count, size)
 
 
 def get_adjacent_image_urls(metadata: dict) -> list[str]:
@@ -115,28 +127,28 @@ def get_adjacent_image_urls(metadata: dict) -> list[str]:
     for page in range(page - 2, page + 3):
         if page < 0 or page >= page_count:
             continue
-        ret_images.append(create_slide_url(name, page, page_count))
+        ret_images.append(create_slide_url(name, page, page_count, "small"))
     return ret_images
 
 
 st.session_state["available_categories"] = None
 st.session_state["available_languages"] = None
 
-logger.info("Requesting list_documents...")
-document_meta_list = conn.list_documents(keys=[])
-logger.info("Received response list_documents")
+logger.info("Requesting facets...")
+facets = get_facets(["category", "language", "path"])
+logger.info("Received response facets")
 
-st.session_state["document_meta_list"] = document_meta_list
+st.session_state["facets"] = facets
 
 
-available_categories = get_options_list(document_meta_list, "category")
+available_categories = list(facets.get("category", {}))
 st.session_state["available_categories"] = available_categories
 
-available_languages = get_options_list(document_meta_list, "language")
+available_languages = list(facets.get("language", {}))
 st.session_state["available_languages"] = available_languages
 
 
-available_files = get_options_list(st.session_state["document_meta_list"], "path")
+available_files = list(facets.get("path", {}))
 
 
 def get_slide_link(file_name, page_num=None) -> str:
@@ -309,7 +321,7 @@ def get_ext_img_with_href(url, target_url, *args) -> str:
     def get_img_html(dc):
         return f"""
         <div class="slider-item">
-                    <img src="{dc['url']}" width="90" />
+                    <img src="{dc['url']}" width="90" loading="lazy" />
                 </div>"""
 
     slider_images = "\n".join([get_img_html(dc) for dc in args])
@@ -63,6 +63,7 @@ import dotenv
 import pathway as pw
 import psycopg
 import tiktoken
+from parser_pool import ProcessPoolParser
 from pathway.stdlib.utils.col import unpack_col
 from pathway.xpacks.llm.llms import OpenAIChat, prompt_chat_single_qa
 from pathway.xpacks.llm.parsers import UnstructuredParser
@@ -285,6 +286,7 @@ def run(
     postresql_user: str = os.environ.get("POSTGRESQL_USER", "user"),
     postresql_password: str = os.environ.get("POSTGRESQL_PASSWORD", "password"),
     postresql_table: str = os.environ.get("POSTGRESQL_TABLE", "quarterly_earnings"),
+    parser_processes: int = int(os.environ.get("PARSER_PROCESSES", "0")),
     **kwargs,
 ):
     #
@@ -302,7 +304,11 @@ def run(
         data_dir,
         format="binary",
     )
-    parser = UnstructuredParser()
+    if parser_processes > 0:
+        # parse the documents in parallel, in a pool of worker processes
+        parser = ProcessPoolParser(UnstructuredParser, max_workers=parser_processes)
+    else:
+        parser = UnstructuredParser()
     unstructured_documents = files.select(texts=parser(pw.this.data)).select(
         texts=strip_metadata(pw.this.texts)
     )